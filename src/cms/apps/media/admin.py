@@ -10,9 +10,10 @@ from django.template.defaultfilters import filesizeformat
 from django.utils.text import Truncator
 
 import optimizations
+from optimizations.thumbnailcache import PROPORTIONAL
 
-from cms import permalinks, externals
-from cms.apps.media.models import Label, File
+from cms import permalinks, externals, thumbnails
+from cms.apps.media.models import Label, File, PREVIEW_WIDTH, PREVIEW_HEIGHT
 
 
 class LabelAdmin(admin.ModelAdmin):
@@ -153,7 +154,7 @@ class FileAdminBase(admin.ModelAdmin):
         permalink = permalinks.create(obj)
         if icon == IMAGE_FILE_ICON:
             try:
-                thumbnail = optimizations.get_thumbnail(obj.file, 100, 66)
+                thumbnail = thumbnails.get_thumbnail(obj.file, PREVIEW_WIDTH, PREVIEW_HEIGHT, PROPORTIONAL)
             except IOError:
                 pass
             else:
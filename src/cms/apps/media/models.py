@@ -1,9 +1,15 @@
 """Models used by the static media management application."""
 
+import re
+
 from django.db import models
 from django.contrib import admin
 from django.contrib.admin.widgets import ForeignKeyRawIdWidget
 
+from optimizations.thumbnailcache import PROPORTIONAL
+
+from cms import thumbnails
+
 
 class Label(models.Model):
     
@@ -53,6 +59,20 @@ class File(models.Model):
         ordering = ("title",)
 
 
+# The size of the image previews shown in the admin.
+PREVIEW_WIDTH = 100
+
+PREVIEW_HEIGHT = 66
+
+
+def queue_file_preview(sender, instance, raw=False, **kwargs):
+    """Starts generating the admin preview of an uploaded image."""
+    if not raw and instance.file and RE_IMAGE_FILE.search(instance.file.name):
+        thumbnails.queue_thumbnail(instance.file, PREVIEW_WIDTH, PREVIEW_HEIGHT, PROPORTIONAL)
+
+models.signals.post_save.connect(queue_file_preview, sender=File)
+
+
 class FileRefField(models.ForeignKey):
     
     """A foreign key to a File, constrained to only select image files."""
@@ -71,6 +91,8 @@ class FileRefField(models.ForeignKey):
 
 
 IMAGE_FILTER = {"file__iregex": ur"\.(png|gif|jpg|jpeg)$"} 
+
+RE_IMAGE_FILE = re.compile(IMAGE_FILTER["file__iregex"], re.IGNORECASE)
         
 class ImageRefField(FileRefField):
     
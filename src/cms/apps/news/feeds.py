@@ -0,0 +1,136 @@
+"""
+Cached RSS feeds of news articles.
+
+Rendering a feed means loading its latest articles, resolving their URLs and
+processing their HTML, and feed readers poll feeds far more often than they
+change. The rendered feed of each news feed page is therefore cached, along
+with a gzipped copy, until one of its articles is saved or deleted, the URLs of
+objects change, or the next article is published. Responses carry an ETag and Last-Modified date, so feed
+readers can skip downloading a feed that has not changed.
+"""
+
+import hashlib, time, uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, quote_etag
+from django.utils.text import compress_string
+
+from cms.invalidation import invalidate, get_url_version
+
+
+def get_news_feed_cache_timeout():
+    """Returns the maximum number of seconds to cache a rendered news feed for."""
+    return getattr(settings, "NEWS_FEED_CACHE_TIMEOUT", 60 * 10)
+
+
+def get_news_feed_gzip():
+    """Returns whether a gzipped copy of each rendered news feed should be cached."""
+    return getattr(settings, "NEWS_FEED_GZIP", True)
+
+
+def get_feed_version_key(page_id):
+    """Returns the cache key of the version of the feed of the given news feed page."""
+    return u"cms.apps.news.feeds.version:{page_id}".format(
+        page_id = page_id,
+    )
+
+
+def get_feed_cache_key(page_id):
+    """Returns the cache key of the rendered feed of the given news feed page."""
+    return u"cms.apps.news.feeds.feed:{page_id}".format(
+        page_id = page_id,
+    )
+
+
+def get_feed_version(page_id):
+    """Returns the current version of the feed of the given news feed page."""
+    key = get_feed_version_key(page_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version):
+            version = cache.get(key, version)
+    return version
+
+
+def get_rendered_feed_version(page_id):
+    """
+    Returns the current version of the rendered feed of the given news feed
+    page, which also depends on the URLs of its articles.
+    """
+    return (get_feed_version(page_id), get_url_version())
+
+
+def invalidate_feed(page_id):
+    """
+    Marks the cached feed of the given news feed page as out of date, both now
+    and once the current transaction has finished.
+    """
+    invalidate(cache.delete, get_feed_version_key(page_id))
+
+
+class RenderedFeed(object):
+    
+    """The rendered content of a feed, with the headers used for conditional requests."""
+    
+    def __init__(self, content, mime_type, last_modified=None):
+        """Initializes the RenderedFeed."""
+        self.content = content
+        self.mime_type = mime_type
+        self.last_modified = int(last_modified or time.time())
+        self.etag = hashlib.md5(content).hexdigest()
+        if get_news_feed_gzip():
+            self.gzip_content = compress_string(content)
+        else:
+            self.gzip_content = None
+    
+    def is_not_modified(self, request):
+        """Checks whether the client already has this version of the feed."""
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            return self.etag in etags or "*" in etags
+        if_modified_since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+        return if_modified_since is not None and if_modified_since >= self.last_modified
+    
+    def get_response(self, request):
+        """Returns a response for the feed, honouring conditional and gzip requests."""
+        if self.is_not_modified(request):
+            response = HttpResponseNotModified()
+        elif self.gzip_content is not None and "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", ""):
+            response = HttpResponse(self.gzip_content, content_type=self.mime_type)
+            response["Content-Encoding"] = "gzip"
+            response["Content-Length"] = len(self.gzip_content)
+        else:
+            response = HttpResponse(self.content, content_type=self.mime_type)
+            response["Content-Length"] = len(self.content)
+        response["ETag"] = quote_etag(self.etag)
+        response["Last-Modified"] = http_date(self.last_modified)
+        if self.gzip_content is not None:
+            patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+
+def get_cached_feed(page_id):
+    """
+    Returns the cached RenderedFeed of the given news feed page, or None if it
+    is missing or out of date.
+    """
+    entry = cache.get(get_feed_cache_key(page_id))
+    if entry is None:
+        return None
+    version, rendered_feed = entry
+    if version != get_rendered_feed_version(page_id):
+        return None
+    return rendered_feed
+
+
+def set_cached_feed(page_id, version, rendered_feed, timeout):
+    """
+    Caches the RenderedFeed of the given news feed page, which was rendered
+    from the given version of the feed, as returned by get_rendered_feed_version().
+    """
+    cache.set(get_feed_cache_key(page_id), (version, rendered_feed), timeout)
@@ -1,14 +1,23 @@
 """Models used by the CMS news app."""
 
+from __future__ import with_statement
+
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
-from django.db import models
+from django.db import models, connections
+from django.db.models import Min, Max, Q, Count
 
 from cms import sitemaps, externals
 from cms.apps.media.models import ImageRefField
 from cms.apps.pages.models import ContentBase, Page
-from cms.models import PageBase, OnlineBaseManager, HtmlField, PageBaseSearchAdapter
+from cms.apps.news.feeds import get_news_feed_cache_timeout, get_feed_version, invalidate_feed
+from cms.models import PageBase, OnlineBaseManager, HtmlField, PageBaseSearchAdapter, publication_manager, publication_clock
+from cms.models.fields import urls_changed
 
 
 class NewsFeed(ContentBase):
@@ -25,7 +34,8 @@ class NewsFeed(ContentBase):
     
     content_primary = HtmlField(
         "primary content",
-        blank = True
+        blank = True,
+        prerender = True,
     )
     
     per_page = models.IntegerField(
@@ -72,8 +82,8 @@ class Category(PageBase):
     def _get_permalinks(self):
         """Returns a dictionary of all permalinks for the given category."""
         pages = Page.objects.filter(
-            id__in = Article.objects.filter(
-                categories = self
+            id__in = NewsFeedCategory.objects.filter(
+                category = self,
             ).values_list("news_feed_id", flat=True)
         )
         return dict(
@@ -99,6 +109,19 @@ class CategoryHistoryLinkAdapter(externals.historylinks.HistoryLinkAdapter):
 externals.historylinks("register", Category, CategoryHistoryLinkAdapter)
 
 
+def get_news_cache_timeout():
+    """
+    Returns the number of seconds to cache rendered feeds, adjacent articles
+    and archive counts for, stopping at the next time that an article is
+    published.
+    """
+    timeout = get_news_feed_cache_timeout()
+    next_publication_change = Article.objects.get_next_publication_change()
+    if next_publication_change is not None:
+        timeout = min(timeout, publication_clock.get_timeout(next_publication_change))
+    return timeout
+
+
 class ArticleManager(OnlineBaseManager):
     
     """Manager for Article models."""
@@ -106,9 +129,105 @@ class ArticleManager(OnlineBaseManager):
     def select_published(self, queryset):
         queryset = super(ArticleManager, self).select_published(queryset)
         queryset = queryset.filter(
-            date__lte = timezone.now(),
+            date__lte = publication_clock.now(),
         )
         return queryset
+    
+    def get_published_sql(self):
+        """Returns an SQL condition that selects published articles."""
+        return u" AND ".join((
+            super(ArticleManager, self).get_published_sql(),
+            u"{date} <= %s",
+        ))
+    
+    def get_published_params(self, connection):
+        """Returns the params of the SQL returned by get_published_sql()."""
+        return super(ArticleManager, self).get_published_params(connection) + [
+            self.model._meta.get_field("date").get_db_prep_value(publication_clock.now(), connection),
+        ]
+    
+    def get_next_publication_change(self):
+        """Returns the start of the date of the next article to be published, or None."""
+        with publication_manager.select_published(False):
+            next_date = self.model._base_manager.filter(
+                is_online = True,
+                date__gt = publication_clock.now(),
+            ).aggregate(next_date=Min("date"))["next_date"]
+        if next_date is None:
+            return None
+        next_date = datetime.datetime.combine(next_date, datetime.time())
+        if settings.USE_TZ:
+            next_date = timezone.make_aware(next_date, timezone.utc)  # Dates are compared with the current date in UTC.
+        return next_date
+    
+    def get_adjacent(self, article):
+        """
+        Returns a tuple of the (next, previous) articles either side of the
+        given article in its news feed, or None for either if there is no such
+        article. Articles are ordered by date and id, newest first, so the next
+        article is the older one.
+        
+        Both articles are loaded using a single query.
+        """
+        queryset = self.filter(news_feed=article.news_feed_id)
+        next_sql, next_params = queryset.filter(
+            Q(date__lt=article.date) | Q(date=article.date, id__lt=article.id),
+        ).order_by("-date", "-id")[:1].query.sql_with_params()
+        previous_sql, previous_params = queryset.filter(
+            Q(date__gt=article.date) | Q(date=article.date, id__gt=article.id),
+        ).order_by("date", "id")[:1].query.sql_with_params()
+        next_article = None
+        previous_article = None
+        adjacent_articles = self.raw(
+            u"SELECT * FROM ({next_sql}) next_article UNION ALL SELECT * FROM ({previous_sql}) previous_article".format(
+                next_sql = next_sql,
+                previous_sql = previous_sql,
+            ),
+            tuple(next_params) + tuple(previous_params),
+        )
+        for adjacent_article in adjacent_articles:
+            if (adjacent_article.date, adjacent_article.id) < (article.date, article.id):
+                next_article = adjacent_article
+            else:
+                previous_article = adjacent_article
+        return next_article, previous_article
+    
+    def get_archive_months(self, news_feed_id):
+        """
+        Returns a list of (year, month, count) tuples for each month containing
+        articles in the given news feed, newest first.
+        
+        The list is cached until an article in the news feed changes, or the
+        next article is published.
+        """
+        if publication_manager.select_published_active():
+            cache_key = u"cms.apps.news.models.archive:{news_feed_id}".format(
+                news_feed_id = news_feed_id,
+            )
+            version = get_feed_version(news_feed_id)
+            entry = cache.get(cache_key)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+        # Count the articles in each month.
+        connection = connections[self.db]
+        date_column = u"{table}.{column}".format(
+            table = connection.ops.quote_name(self.model._meta.db_table),
+            column = connection.ops.quote_name(self.model._meta.get_field("date").column),
+        )
+        archive_months = sorted((
+            (int(archive_month["year"]), int(archive_month["month"]), archive_month["count"])
+            for archive_month
+            in self.filter(news_feed=news_feed_id).extra(select={
+                "year": connection.ops.date_extract_sql("year", date_column),
+                "month": connection.ops.date_extract_sql("month", date_column),
+            }).values("year", "month").annotate(count=Count("id")).order_by()
+        ), reverse=True)
+        # Cache the counts.
+        if publication_manager.select_published_active():
+            timeout = get_news_cache_timeout()
+            if timeout > 0:
+                cache.set(cache_key, (version, archive_months), timeout)
+        return archive_months
 
 
 class Article(PageBase):
@@ -134,10 +253,12 @@ class Article(PageBase):
     
     content = HtmlField(
         blank = True,
+        prerender = True,
     )
     
     summary = HtmlField(
         blank = True,
+        prerender = True,
     )
     
     categories = models.ManyToManyField(
@@ -171,7 +292,286 @@ class Article(PageBase):
 externals.historylinks("register", Article)
 
 
-sitemaps.register(Article)
+def get_articles_for_pages(sender, object_ids, **kwargs):
+    """
+    Returns the articles whose URLs are derived from the given pages, since
+    they belong to their news feeds.
+    """
+    article_ids = []
+    for index in xrange(0, len(object_ids), 500):
+        article_ids.extend(Article._base_manager.filter(
+            news_feed__in = object_ids[index:index+500],
+        ).values_list("id", flat=True))
+    return [(Article, article_ids)]
+
+urls_changed.connect(get_articles_for_pages, sender=Page)
+
+
+class NewsFeedCategory(models.Model):
+    
+    """
+    The number of articles in a category in a news feed, and the date of the
+    latest one, both including and excluding unpublished articles.
+    
+    These are maintained whenever an article is saved or deleted, or its
+    categories change, so that category lists never join over articles. The
+    published counts are also recalculated when they are next used after the
+    next_publication_date has passed.
+    """
+    
+    news_feed = models.ForeignKey(
+        NewsFeed,
+    )
+    
+    category = models.ForeignKey(
+        Category,
+    )
+    
+    article_count = models.PositiveIntegerField(
+        default = 0,
+    )
+    
+    latest_article_date = models.DateField(
+        blank = True,
+        null = True,
+    )
+    
+    published_article_count = models.PositiveIntegerField(
+        default = 0,
+    )
+    
+    latest_published_article_date = models.DateField(
+        blank = True,
+        null = True,
+    )
+    
+    next_publication_date = models.DateField(
+        blank = True,
+        null = True,
+    )
+    
+    def get_article_count(self):
+        """Returns the number of articles, excluding unpublished articles if only published articles are selected."""
+        if publication_manager.select_published_active():
+            return self.published_article_count
+        return self.article_count
+    
+    class Meta:
+        unique_together = (("news_feed", "category",),)
+
+
+def update_news_feed_categories(news_feed_ids, category_ids):
+    """
+    Recalculates the article counts of the given categories in the given news
+    feeds.
+    
+    The news feeds are locked first, so that concurrent updates of the same
+    news feed wait for each other, rather than creating the same rows.
+    """
+    news_feed_ids = sorted(set(news_feed_id for news_feed_id in news_feed_ids if news_feed_id is not None))
+    category_ids = set(category_ids)
+    if not news_feed_ids or not category_ids:
+        return
+    list(NewsFeed._base_manager.select_for_update().filter(pk__in=news_feed_ids).order_by("pk").values_list("pk", flat=True))
+    now = publication_clock.now()
+    category_articles = Article.categories.through.objects.filter(
+        article__news_feed__in = news_feed_ids,
+        category__in = category_ids,
+    )
+    # Count all articles, then the published ones, then find the next to be published.
+    news_feed_categories = {}
+    for queryset, aggregates in (
+        (category_articles, {
+            "article_count": Count("article"),
+            "latest_article_date": Max("article__date"),
+        }),
+        (category_articles.filter(article__is_online=True, article__date__lte=now), {
+            "published_article_count": Count("article"),
+            "latest_published_article_date": Max("article__date"),
+        }),
+        (category_articles.filter(article__is_online=True, article__date__gt=now), {
+            "next_publication_date": Min("article__date"),
+        }),
+    ):
+        for category_count in queryset.values("article__news_feed", "category").annotate(**aggregates).order_by():
+            key = (category_count["article__news_feed"], category_count["category"])
+            news_feed_category = news_feed_categories.get(key)
+            if news_feed_category is None:
+                news_feed_category = news_feed_categories[key] = NewsFeedCategory(
+                    news_feed_id = key[0],
+                    category_id = key[1],
+                )
+            for name in aggregates:
+                setattr(news_feed_category, name, category_count[name])
+    NewsFeedCategory.objects.filter(
+        news_feed__in = news_feed_ids,
+        category__in = category_ids,
+    ).delete()
+    NewsFeedCategory.objects.bulk_create(news_feed_categories.values())
+
+
+def refresh_news_feed_categories(news_feed_id):
+    """
+    Recalculates the counts of the categories in the given news feed that have
+    had articles published since they were last calculated.
+    """
+    category_ids = list(NewsFeedCategory.objects.filter(
+        news_feed = news_feed_id,
+        next_publication_date__lte = publication_clock.now(),
+    ).values_list("category_id", flat=True))
+    if category_ids:
+        update_news_feed_categories((news_feed_id,), category_ids)
+
+
+def get_news_feed_category_list(news_feed_id):
+    """
+    Returns a queryset of the categories used in the given news feed, each
+    annotated with its article_count and latest_article_date in that feed.
+    
+    If only published articles are selected, then categories are only listed
+    if they contain published articles, and only published articles are
+    counted.
+    """
+    if publication_manager.select_published_active():
+        refresh_news_feed_categories(news_feed_id)
+        count_field_name, date_field_name = "published_article_count", "latest_published_article_date"
+    else:
+        count_field_name, date_field_name = "article_count", "latest_article_date"
+    qn = connections[Category.objects.db].ops.quote_name
+    table = qn(NewsFeedCategory._meta.db_table)
+    return Category.objects.filter(**{
+        "newsfeedcategory__news_feed": news_feed_id,
+        "newsfeedcategory__{0}__gt".format(count_field_name): 0,
+    }).extra(select={
+        "article_count": u"{table}.{column}".format(
+            table = table,
+            column = qn(NewsFeedCategory._meta.get_field(count_field_name).column),
+        ),
+        "latest_article_date": u"{table}.{column}".format(
+            table = table,
+            column = qn(NewsFeedCategory._meta.get_field(date_field_name).column),
+        ),
+    })
+
+
+def remember_article_news_feed(sender, instance, **kwargs):
+    """Records which news feed an article was in, its date and whether it was online, before it was saved."""
+    instance._saved_news_feed_id = None
+    instance._saved_date = None
+    instance._saved_is_online = None
+    if instance.pk is not None:
+        with publication_manager.select_published(False):
+            saved_values = Article._base_manager.filter(pk=instance.pk).values_list("news_feed_id", "date", "is_online")[:1]
+        if saved_values:
+            instance._saved_news_feed_id, instance._saved_date, instance._saved_is_online = saved_values[0]
+
+models.signals.pre_save.connect(remember_article_news_feed, sender=Article)
+
+
+def update_news_feed_categories_for_article(sender, instance, created=False, **kwargs):
+    """Updates the category counts of a saved article, if it was moved, redated, or taken on or offline."""
+    # New articles are not in any categories yet.
+    if created:
+        return
+    if (instance._saved_news_feed_id, instance._saved_date, instance._saved_is_online) == (instance.news_feed_id, instance.date, instance.is_online):
+        return
+    update_news_feed_categories(
+        (instance.news_feed_id, instance._saved_news_feed_id),
+        instance.categories.values_list("id", flat=True),
+    )
+
+models.signals.post_save.connect(update_news_feed_categories_for_article, sender=Article)
+
+
+def remember_article_categories(sender, instance, **kwargs):
+    """Records the categories of an article before it is deleted, or its categories are cleared."""
+    instance._saved_category_ids = list(instance.categories.values_list("id", flat=True))
+
+models.signals.pre_delete.connect(remember_article_categories, sender=Article)
+
+
+def update_news_feed_categories_for_deleted_article(sender, instance, **kwargs):
+    """Updates the category counts of a deleted article."""
+    update_news_feed_categories((instance.news_feed_id,), instance._saved_category_ids)
+
+models.signals.post_delete.connect(update_news_feed_categories_for_deleted_article, sender=Article)
+
+
+def update_news_feed_categories_for_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    """Updates the category counts of the news feeds affected by a change to article categories."""
+    if not reverse:
+        # The categories of an article were changed.
+        if action == "pre_clear":
+            remember_article_categories(sender, instance)
+        elif action == "post_clear":
+            update_news_feed_categories((instance.news_feed_id,), instance._saved_category_ids)
+        elif action in ("post_add", "post_remove"):
+            update_news_feed_categories((instance.news_feed_id,), pk_set)
+        return
+    # The articles of a category were changed.
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    news_feed_ids = set(NewsFeedCategory.objects.filter(
+        category = instance,
+    ).values_list("news_feed_id", flat=True))
+    if pk_set:
+        with publication_manager.select_published(False):
+            news_feed_ids.update(Article._base_manager.filter(
+                pk__in = pk_set,
+            ).values_list("news_feed_id", flat=True))
+    update_news_feed_categories(news_feed_ids, (instance.pk,))
+
+models.signals.m2m_changed.connect(update_news_feed_categories_for_categories, sender=Article.categories.through)
+
+
+class ArticleSitemap(sitemaps.PageBaseSitemap):
+    
+    """Sitemap for news articles."""
+    
+    model = Article
+    
+    only_fields = ("id", "news_feed", "date", "url_title", "sitemap_priority", "sitemap_changefreq",)
+    
+    def __init__(self):
+        """Initializes the ArticleSitemap."""
+        self._news_feed_pages = {}
+        
+    def prepare_batch(self, items):
+        """Loads the news feed pages of the articles."""
+        news_feed_ids = set(article.news_feed_id for article in items).difference(self._news_feed_pages)
+        if news_feed_ids:
+            self._news_feed_pages.update(Page.objects.in_bulk(news_feed_ids))
+            
+    def location(self, obj):
+        """Returns the URL of the article, using the loaded news feed page if available."""
+        page = self._news_feed_pages.get(obj.news_feed_id)
+        if page is None:
+            return obj.get_absolute_url()
+        return obj._get_permalink_for_page(page)
+
+
+sitemaps.register(Article, sitemap_cls=ArticleSitemap)
+
+
+def invalidate_feed_for_instance(sender, instance, **kwargs):
+    """
+    Invalidates the cached feed of the news feed page that the saved or deleted
+    object belongs to, and of the news feed page that an article was moved from.
+    """
+    if isinstance(instance, Article):
+        invalidate_feed(instance.news_feed_id)
+        saved_news_feed_id = getattr(instance, "_saved_news_feed_id", None)
+        if saved_news_feed_id is not None and saved_news_feed_id != instance.news_feed_id:
+            invalidate_feed(saved_news_feed_id)
+    else:
+        invalidate_feed(instance.pk)
+
+models.signals.post_save.connect(invalidate_feed_for_instance, sender=Page)
+models.signals.post_delete.connect(invalidate_feed_for_instance, sender=Page)
+models.signals.post_save.connect(invalidate_feed_for_instance, sender=NewsFeed)
+models.signals.post_delete.connect(invalidate_feed_for_instance, sender=NewsFeed)
+models.signals.post_save.connect(invalidate_feed_for_instance, sender=Article)
+models.signals.post_delete.connect(invalidate_feed_for_instance, sender=Article)
 
 
 externals.watson("register", Article, adapter_cls=PageBaseSearchAdapter)
\ No newline at end of file
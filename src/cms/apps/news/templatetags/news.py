@@ -1,5 +1,6 @@
 """Template tags used by the news module."""
 
+import datetime
 from functools import wraps
 
 from django import template
@@ -137,6 +138,16 @@ def article_year_archive_url(context, year, page):
     }))
     
     
+@register.simple_tag(takes_context=True)
+@takes_current_page
+def article_month_archive_url(context, date, page):
+    """Renders the month archive URL for the given date."""
+    return escape(page.reverse("article_month_archive", kwargs={
+        "year": date.year,
+        "month": date.strftime("%b").lower(),
+    }))
+    
+    
 @register.simple_tag(takes_context=True)
 @takes_current_page
 def article_day_archive_url(context, date, page):
@@ -179,10 +190,23 @@ def article_meta(context, article):
 @page_context
 @takes_current_page
 def article_date_list(context, page):
-    """Renders a list of dates."""
-    date_list = Article.objects.filter(
-        news_feed_id = page.id,
-    ).dates("date", "month").order_by("-date")
+    """Renders a list of dates, with the number of articles in each year and month."""
+    year_list = []
+    date_list = []
+    for year, month, count in Article.objects.get_archive_months(page.id):
+        if not year_list or year_list[-1]["year"] != year:
+            year_list.append({
+                "year": year,
+                "count": 0,
+                "months": [],
+            })
+        month_date = datetime.datetime(year, month, 1)
+        year_list[-1]["count"] += count
+        year_list[-1]["months"].append({
+            "date": month_date,
+            "count": count,
+        })
+        date_list.append(month_date)
     # Resolve the current year.
     current_year = context.get("year", None)
     if current_year is not None:
@@ -202,6 +226,7 @@ def article_date_list(context, page):
     # Render the template.
     return {
         "date_list": date_list,
+        "year_list": year_list,
         "current_year": current_year,
     }
     
@@ -1,16 +1,30 @@
 """Views used by the CMS news app."""
 
+from django.conf import settings
+from django.core.cache import cache
 from django.views import generic
 from django.views.generic.list import BaseListView
 from django.shortcuts import get_object_or_404
 from django.utils.feedgenerator import DefaultFeed
-from django.http import HttpResponse
+from django.http import Http404
+from django.core.paginator import InvalidPage
 
 from cms.views import PageDetailMixin
-from cms.apps.news.models import Article, Category
+from cms.models import publication_manager
+from cms.pagination import KeysetPaginator
+from cms.apps.news.models import Article, Category, NewsFeedCategory, get_news_cache_timeout, get_news_feed_category_list, refresh_news_feed_categories
+from cms.apps.news.feeds import RenderedFeed, get_feed_version, get_rendered_feed_version, get_cached_feed, set_cached_feed
 from cms.html import process as process_html
 
 
+def get_news_keyset_pagination():
+    """
+    Returns whether article lists are paginated by cursor, rather than by page
+    number.
+    """
+    return getattr(settings, "NEWS_KEYSET_PAGINATION", False)
+
+
 class ArticleListMixin(object):
     
     """Base class for every view that handles articles."""
@@ -25,17 +39,45 @@ class ArticleListMixin(object):
     
     context_object_name = "article_list"
     
+    keyset_ordering = ("-date", "-id",)
+    
     def get_paginate_by(self, queryset):
         """Returns the number of articles to show per page."""
         return self.request.pages.current.content.per_page
     
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginates the queryset, seeking to the articles after a cursor if keyset
+        pagination is enabled.
+        """
+        if not get_news_keyset_pagination():
+            return super(ArticleListMixin, self).paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size,
+            ordering = self.keyset_ordering,
+            allow_empty_first_page = self.get_allow_empty(),
+        )
+        cursor = self.request.GET.get("cursor")
+        try:
+            page = paginator.page(cursor)
+        except InvalidPage:
+            raise Http404("Invalid page cursor.")
+        page._pagination_key = "cursor"
+        return (paginator, page, page.object_list, page.has_other_pages())
+    
+    def get_dated_queryset(self, **lookup):
+        """
+        Returns the articles matching the given date lookups, checking whether
+        there are any without loading them all.
+        """
+        queryset = self.get_queryset().filter(**lookup)
+        if not self.get_allow_empty() and not queryset.exists():
+            raise Http404("No articles available.")
+        return queryset
+    
     def get_context_data(self, **kwargs):
         """Returns the context data for the view."""
         context = super(ArticleListMixin, self).get_context_data(**kwargs)
-        category_list = Category.objects.filter(
-            article__news_feed__page = self.request.pages.current,
-        ).distinct()
-        context["category_list"] = category_list
+        context["category_list"] = get_news_feed_category_list(self.request.pages.current.id)
         return context
     
     def get_queryset(self):
@@ -45,7 +87,7 @@ class ArticleListMixin(object):
             "authors",
         ).select_related("image").filter(
             news_feed__page = self.request.pages.current,
-        ).order_by("-date")
+        ).order_by(*self.keyset_ordering)
 
 
 class ArticleArchiveView(ArticleListMixin, generic.ArchiveIndexView):
@@ -55,11 +97,16 @@ class ArticleArchiveView(ArticleListMixin, generic.ArchiveIndexView):
 
 class ArticleFeedView(ArticleListMixin, BaseListView):
     
-    """Generates an RSS feed of articles."""
+    """
+    Generates an RSS feed of articles.
     
-    def get(self, request):
-        """Generates the RSS feed."""
-        page = request.pages.current
+    The rendered feed is cached until one of its articles changes, or the next
+    article is published.
+    """
+    
+    def render_feed(self):
+        """Renders the RSS feed."""
+        page = self.request.pages.current
         # Write the feed headers.
         feed = DefaultFeed(
             title = page.title,
@@ -70,16 +117,26 @@ class ArticleFeedView(ArticleListMixin, BaseListView):
         for article in self.get_queryset()[:30]:
             feed.add_item(
                 title = article.title,
-                link = article.get_absolute_url(),
+                link = article._get_permalink_for_page(page),
                 description = process_html(article.summary or article.content),
                 pubdate = article.date,
             )
-        # Write the response.
-        content = feed.writeString("utf-8")
-        response = HttpResponse(content)
-        response["Content-Type"] = feed.mime_type
-        response["Content-Length"] = len(content)
-        return response
+        return RenderedFeed(feed.writeString("utf-8"), feed.mime_type)
+    
+    def get(self, request):
+        """Sends the RSS feed, rendering it if it is not cached."""
+        page_id = request.pages.current.id
+        # Previews are never cached.
+        if not publication_manager.select_published_active():
+            return self.render_feed().get_response(request)
+        rendered_feed = get_cached_feed(page_id)
+        if rendered_feed is None:
+            version = get_rendered_feed_version(page_id)
+            rendered_feed = self.render_feed()
+            timeout = get_news_cache_timeout()
+            if timeout > 0:
+                set_cached_feed(page_id, version, rendered_feed, timeout)
+        return rendered_feed.get_response(request)
 
 
 class ArticleYearArchiveView(ArticleListMixin, generic.YearArchiveView):
@@ -101,26 +158,33 @@ class ArticleDetailView(ArticleListMixin, PageDetailMixin, generic.DateDetailVie
     
     context_object_name = "article"
     
+    def get_adjacent_articles(self):
+        """
+        Returns a tuple of the (next, previous) articles either side of this
+        one, cached until an article in the news feed changes, or the next
+        article is published.
+        """
+        article = self.object
+        # Previews are never cached.
+        if not publication_manager.select_published_active():
+            return Article.objects.get_adjacent(article)
+        cache_key = u"cms.apps.news.views.adjacent:{article_id}".format(
+            article_id = article.id,
+        )
+        version = get_feed_version(article.news_feed_id)
+        entry = cache.get(cache_key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        adjacent_articles = Article.objects.get_adjacent(article)
+        timeout = get_news_cache_timeout()
+        if timeout > 0:
+            cache.set(cache_key, (version, adjacent_articles), timeout)
+        return adjacent_articles
+    
     def get_context_data(self, **kwargs):
         """Adds the next and previous articles to the context."""
         context = super(ArticleDetailView, self).get_context_data(**kwargs)
-        # Get the next article.
-        try:
-            next_article = self.get_queryset().filter(
-                date__lt = self.object.date,
-            )[0]
-        except IndexError:
-            next_article = None
-        context["next_article"] = next_article
-        # Get the previous article.
-        try:
-            prev_article = self.get_queryset().reverse().filter(
-                date__gt = self.object.date,
-            )[0]
-        except IndexError:
-            prev_article = None
-        context["prev_article"] = prev_article
-        # All done!
+        context["next_article"], context["prev_article"] = self.get_adjacent_articles()
         return context
 
 
@@ -132,7 +196,11 @@ class ArticleCategoryArchiveView(PageDetailMixin, ArticleArchiveView):
     
     def get_queryset(self):
         """Returns the queryset filtered by category."""
-        return super(ArticleCategoryArchiveView, self).get_queryset().filter(
+        queryset = super(ArticleCategoryArchiveView, self).get_queryset()
+        # Skip the join over articles if the category has no articles in this news feed.
+        if self.news_feed_category is None or not self.news_feed_category.get_article_count():
+            return queryset.none()
+        return queryset.filter(
             categories = self.object,
         )
         
@@ -140,6 +208,7 @@ class ArticleCategoryArchiveView(PageDetailMixin, ArticleArchiveView):
         """Adds the category to the context."""
         context = super(ArticleCategoryArchiveView, self).get_context_data(**kwargs)
         context["category"] = self.object
+        context["news_feed_category"] = self.news_feed_category
         return context
     
     def dispatch(self, request, *args, **kwargs):
@@ -147,4 +216,13 @@ class ArticleCategoryArchiveView(PageDetailMixin, ArticleArchiveView):
         self.object = get_object_or_404(Category,
             url_title = kwargs["url_title"],
         )
+        if publication_manager.select_published_active():
+            refresh_news_feed_categories(request.pages.current.id)
+        try:
+            self.news_feed_category = NewsFeedCategory.objects.get(
+                news_feed = request.pages.current.id,
+                category = self.object,
+            )
+        except NewsFeedCategory.DoesNotExist:
+            self.news_feed_category = None
         return super(ArticleCategoryArchiveView, self).dispatch(request, *args, **kwargs)
\ No newline at end of file
@@ -15,7 +15,6 @@ from django.conf.urls import patterns, url
 from django.contrib.admin.widgets import FilteredSelectMultiple
 from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
-from django.db.models import F
 from django.http import Http404, HttpResponseRedirect, HttpResponse, HttpResponseForbidden
 from django.shortcuts import render, redirect, get_object_or_404
 from django import forms
@@ -23,7 +22,9 @@ from django.utils import simplejson as json
 
 from cms import debug, externals
 from cms.admin import PageBaseAdmin
-from cms.apps.pages.models import Page, get_registered_content, PageSearchAdapter
+from cms.apps.pages.models import Page, get_content_registry, get_registered_content, PageSearchAdapter
+from cms.apps.pages.tree import invalidate_page_tree
+from cms.apps.pages.cache import invalidate_objects, invalidate_page_cache
 
 
 # Used to track references to and from the JS sitemap.
@@ -70,7 +71,7 @@ class PageAdmin(PageBaseAdmin):
         self.admin_site.index_template = "admin/pages/dashboard.html"
         # Prepare to register some content inlines.
         self.content_inlines = []
-        # Register all page inlines.
+        # Register all page inlines, without touching the database, which might not exist yet.
         for content_cls in get_registered_content():
             self._register_page_inline(content_cls)
     
@@ -238,6 +239,24 @@ class PageAdmin(PageBaseAdmin):
         content_obj.save()
         obj.content = content_obj
     
+    # Custom admin actions.
+    
+    def publish_selected(self, request, queryset):
+        """Publishes the selected pages."""
+        super(PageAdmin, self).publish_selected(request, queryset)
+        Page.objects.update_visibility()
+        invalidate_page_tree()
+        invalidate_page_cache()
+    publish_selected.short_description = PageBaseAdmin.publish_selected.short_description
+    
+    def unpublish_selected(self, request, queryset):
+        """Unpublishes the selected pages."""
+        super(PageAdmin, self).unpublish_selected(request, queryset)
+        Page.objects.update_visibility()
+        invalidate_page_tree()
+        invalidate_page_cache()
+    unpublish_selected.short_description = PageBaseAdmin.unpublish_selected.short_description
+    
     # Permissions.
     
     def has_add_content_permission(self, request, model):
@@ -249,8 +268,8 @@ class PageAdmin(PageBaseAdmin):
         """Checks whether the user can edits pages and at least one content model."""
         if not super(PageAdmin, self).has_add_permission(request):
             return False
-        for content_model in get_registered_content():
-            if self.has_add_content_permission(request, content_model):
+        for content in get_content_registry():
+            if self.has_add_content_permission(request, content.model):
                 return True
         return False
     
@@ -317,21 +336,19 @@ class PageAdmin(PageBaseAdmin):
         """Ensures that a valid content type is chosen."""
         if not PAGE_TYPE_PARAMETER in request.GET:
             # Generate the available content items.
-            content_items = get_registered_content()
-            content_items.sort(lambda a, b: cmp(a.classifier, b.classifier) or cmp(a._meta.verbose_name.lower(), b._meta.verbose_name.lower()))
             content_types = []
-            for content_type in content_items:
-                if self.has_add_content_permission(request, content_type):
+            for content in get_content_registry():
+                if self.has_add_content_permission(request, content.model):
                     # If we get this far, then we have permisison to add a page of this type.
                     get_params = request.GET.copy()
-                    get_params[PAGE_TYPE_PARAMETER] = ContentType.objects.get_for_model(content_type).id
+                    get_params[PAGE_TYPE_PARAMETER] = content.content_type_id
                     query_string = get_params.urlencode()
                     url = request.path + "?" + query_string
                     content_type_context = {
-                        "name": content_type._meta.verbose_name,
-                        "icon": content_type.icon,
+                        "name": content.model._meta.verbose_name,
+                        "icon": content.icon,
                         "url": url,
-                        "classifier": content_type.classifier
+                        "classifier": content.classifier
                     }
                     content_types.append(content_type_context)
             # Shortcut for when there is a single content type.
@@ -414,18 +431,13 @@ class PageAdmin(PageBaseAdmin):
         # Check that the user has permission to move pages.
         if not self.has_change_permission(request):
             return HttpResponseForbidden("You do not have permission to move this page.")
-        # Lock entire table.
-        existing_pages_list = Page.objects.all().select_for_update().values("id", "parent_id", "left", "right", "title").order_by("left")
-        existing_pages = dict(
-            (page["id"], page)
-            for page
-            in existing_pages_list
-        )
-        # Get the page.
-        page = existing_pages[int(request.POST["page"])]
+        # Lock the tree, then the page, its parent and its siblings.
+        Page.objects.lock_tree()
+        page = Page.objects.lock_page(int(request.POST["page"]))
         parent_id = page["parent_id"]
-        # Get all the siblings.
-        siblings = [s for s in existing_pages_list if s["parent_id"] == parent_id]
+        if parent_id is not None:
+            Page.objects.lock_page(parent_id)
+        siblings = list(Page.objects.filter(parent=parent_id).select_for_update().values("id", "left", "right").order_by("left"))
         # Find the page to swap.
         direction = request.POST["direction"]
         if direction == "up":
@@ -444,23 +456,13 @@ class PageAdmin(PageBaseAdmin):
             return HttpResponse("Page could not be moved, as nothing to swap with.")
         # Put the pages in order.
         first_page, second_page = sorted((page, other_page), key=lambda p: p["left"])
-        # Excise the first page.
-        Page.objects.filter(left__gte=first_page["left"], right__lte=first_page["right"]).update(
-            left = F("left") * -1,
-            right = F("right") * -1,
-        )
-        # Move the other page.
-        branch_width = first_page["right"] - first_page["left"] + 1
-        Page.objects.filter(left__gte=second_page["left"], right__lte=second_page["right"]).update(
-            left = F("left") - branch_width,
-            right = F("right") - branch_width,
-        )
-        # Put the page back in.
-        second_branch_width = second_page["right"] - second_page["left"] + 1
-        Page.objects.filter(left__lte=-first_page["left"], right__gte=-first_page["right"]).update(
-            left = (F("left") - second_branch_width) * -1,
-            right = (F("right") - second_branch_width) * -1,
-        )
+        # Move the second page in front of the first page.
+        Page.objects.move_branch(second_page["left"], second_page["right"], first_page["left"])
+        invalidate_page_tree()
+        if parent_id is None:
+            invalidate_page_cache()
+        else:
+            invalidate_objects(Page, (parent_id,))
         # Report back.
         return HttpResponse("Page #%s was moved %s." % (page["id"], direction))
 
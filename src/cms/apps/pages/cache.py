@@ -0,0 +1,183 @@
+"""
+A cache of rendered page responses.
+
+Each cached response records the versions of the objects it depends on, such
+as the page and its ancestors, and any objects linked to by permalinks. Saving
+or deleting one of these objects deletes its version, which invalidates every
+response that depends on it.
+
+The versions are stored in the default cache, so it must be shared between
+processes. With a process-local cache, a change would only invalidate the
+responses cached by the process that made it, and PageCacheMiddleware is
+disabled unless PAGE_CACHE_ALLOW_LOCAL_CACHE is set, such as for a single
+process deployment.
+"""
+
+from __future__ import with_statement
+
+import threading, hashlib, uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import iri_to_uri
+
+from cms import permalinks, thumbnails
+from cms.invalidation import invalidate
+
+
+# The cache key of the version shared by all cached responses.
+PAGE_CACHE_VERSION_KEY = "cms.apps.pages.cache.version"
+
+
+def get_page_cache_timeout():
+    """Returns the maximum number of seconds to cache a page response for."""
+    return getattr(settings, "PAGE_CACHE_TIMEOUT", 60 * 10)
+
+
+def get_page_cache_allow_local_cache():
+    """Returns whether the page cache may be used with a process-local default cache."""
+    return getattr(settings, "PAGE_CACHE_ALLOW_LOCAL_CACHE", False)
+
+
+def get_object_version_key(model, object_id):
+    """Returns the cache key of the version of the given object."""
+    return u"cms.apps.pages.cache.object:{app_label}.{model_name}:{object_id}".format(
+        app_label = model._meta.app_label,
+        model_name = model._meta.object_name.lower(),
+        object_id = object_id,
+    )
+
+
+def invalidate_objects(model, object_ids):
+    """
+    Invalidates all cached responses that depend on the given objects, both
+    now and once the current transaction has finished.
+    """
+    invalidate(cache.delete_many, tuple(
+        get_object_version_key(model, object_id)
+        for object_id
+        in object_ids
+    ))
+
+
+def invalidate_page_cache():
+    """
+    Invalidates all cached responses, both now and once the current
+    transaction has finished.
+    """
+    invalidate(cache.delete, PAGE_CACHE_VERSION_KEY)
+
+
+class DependencyRecorder(threading.local):
+
+    """
+    Tracks a thread-local record of the objects that the current response
+    depends on, and whether it can be cached at all.
+    """
+
+    def __init__(self):
+        """Initializes the DependencyRecorder."""
+        super(DependencyRecorder, self).__init__()
+        self._keys = None
+        self._cacheable = True
+
+    def start(self):
+        """Starts recording dependencies, discarding any previous record."""
+        self._keys = set()
+        self._cacheable = True
+
+    def record(self, model, object_id):
+        """Records a dependency on the given object, if recording is active."""
+        if self._keys is not None:
+            self._keys.add(get_object_version_key(model, object_id))
+
+    def prevent_caching(self):
+        """Marks the current response as one that must not be cached."""
+        self._cacheable = False
+
+    def stop(self):
+        """
+        Stops recording dependencies, returning the version keys recorded, or
+        None if the response must not be cached.
+        """
+        keys = self._keys or set()
+        self._keys = None
+        if not self._cacheable:
+            return None
+        return keys
+
+
+# A single, thread-safe dependency recorder.
+dependency_recorder = DependencyRecorder()
+
+
+def record_permalink_dependency(sender, object_id, **kwargs):
+    """Records a dependency on the object referred to by a resolved permalink."""
+    dependency_recorder.record(sender, object_id)
+
+permalinks.permalink_resolved.connect(record_permalink_dependency)
+
+
+def prevent_caching_pending_thumbnail(sender, **kwargs):
+    """
+    Prevents caching of a response that shows a pending thumbnail, since it
+    uses the original file until the thumbnail has been generated.
+    """
+    dependency_recorder.prevent_caching()
+
+thumbnails.thumbnail_pending.connect(prevent_caching_pending_thumbnail)
+
+
+def get_versions(keys, timeout):
+    """Returns a dictionary of the current versions of the given keys."""
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = uuid.uuid4().hex
+            if not cache.add(key, version, timeout):
+                version = cache.get(key, version)
+            versions[key] = version
+    return versions
+
+
+class PageCache(object):
+
+    """A cache of rendered page responses."""
+
+    def get_cache_key(self, request, variation):
+        """Returns the cache key for the given request, which includes its scheme and host."""
+        return "cms.apps.pages.cache.response:{variation}:{url}".format(
+            variation = variation,
+            url = hashlib.md5(iri_to_uri(u"{scheme}://{host}{path}".format(
+                scheme = request.is_secure() and "https" or "http",
+                host = request.get_host(),
+                path = request.get_full_path(),
+            ))).hexdigest(),
+        )
+
+    def get(self, cache_key):
+        """
+        Returns the cached response for the given key, or None if the response
+        is missing or out of date.
+        """
+        entry = cache.get(cache_key)
+        if entry is None:
+            return None
+        versions, response = entry
+        if cache.get_many(versions.keys()) != versions:
+            return None
+        return response
+
+    def set(self, cache_key, response, dependencies, timeout):
+        """
+        Caches the given response, along with the current versions of its
+        dependencies.
+        """
+        keys = list(dependencies)
+        keys.append(PAGE_CACHE_VERSION_KEY)
+        versions = get_versions(keys, get_page_cache_timeout())
+        cache.set(cache_key, (versions, response), timeout)
+
+
+# A shared page cache.
+page_cache = PageCache()
@@ -0,0 +1,86 @@
+"""Compares the latency of serving pages from PageMiddleware and from a catch-all URL pattern."""
+
+from __future__ import with_statement
+
+import sys, time, types
+from optparse import make_option
+
+from django.conf import settings
+from django.conf.urls import patterns, url
+from django.core import urlresolvers
+from django.core.management.base import BaseCommand, CommandError
+from django.test.client import Client
+from django.test.utils import override_settings
+from django.utils.importlib import import_module
+
+from cms.apps.pages.models import Page
+
+
+# The name of the generated urlconf that ends with the catch-all page pattern.
+CATCH_ALL_URLCONF = "cms.apps.pages.management.commands.benchmark_page_dispatch_urls"
+
+
+def create_catch_all_urlconf():
+    """Creates a copy of the root urlconf with a catch-all page pattern appended."""
+    root_urlconf = import_module(settings.ROOT_URLCONF)
+    urlconf = types.ModuleType(CATCH_ALL_URLCONF)
+    urlconf.__dict__.update(root_urlconf.__dict__)
+    urlconf.urlpatterns = list(root_urlconf.urlpatterns) + patterns("",
+        url(r"", "cms.apps.pages.views.page_dispatch"),
+    )
+    sys.modules[CATCH_ALL_URLCONF] = urlconf
+    return CATCH_ALL_URLCONF
+
+
+class Command(BaseCommand):
+
+    args = "[path path ...]"
+
+    help = (
+        "Compares the latency of serving pages from the PageMiddleware 404 fallback and from a "
+        "catch-all URL pattern. If no paths are given, the first ten pages in the tree are used."
+    )
+
+    option_list = BaseCommand.option_list + (
+        make_option("--requests",
+            action = "store",
+            type = "int",
+            dest = "requests",
+            default = 100,
+            help = "The number of times to request each path in each mode.",
+        ),
+    )
+
+    def time_requests(self, paths, count):
+        """Returns the mean time taken to request each path, in milliseconds."""
+        client = Client()
+        urlresolvers.clear_url_caches()
+        for path in paths:
+            client.get(path)  # Warm up any caches.
+        start = time.time()
+        for _ in xrange(count):
+            for path in paths:
+                client.get(path)
+        return (time.time() - start) * 1000.0 / (count * len(paths))
+
+    def handle(self, *paths, **options):
+        """Runs the command."""
+        count = options["requests"]
+        if not paths:
+            paths = [page.get_absolute_url() for page in Page.objects.all()[:10]]
+            if not paths:
+                raise CommandError("There are no pages to request.")
+        # The page cache would hide the cost of dispatch, so disable it.
+        middleware_classes = [
+            middleware_class
+            for middleware_class
+            in settings.MIDDLEWARE_CLASSES
+            if middleware_class != "cms.apps.pages.middleware.PageCacheMiddleware"
+        ]
+        with override_settings(MIDDLEWARE_CLASSES=middleware_classes, DEBUG=False):
+            middleware_time = self.time_requests(paths, count)
+            with override_settings(ROOT_URLCONF=create_catch_all_urlconf()):
+                catch_all_time = self.time_requests(paths, count)
+        urlresolvers.clear_url_caches()
+        self.stdout.write("PageMiddleware fallback: {0:.2f}ms per request\n".format(middleware_time))
+        self.stdout.write("Catch-all URL pattern: {0:.2f}ms per request\n".format(catch_all_time))
@@ -0,0 +1,185 @@
+"""Imports pages in bulk from a JSON or CSV file."""
+
+import csv, json
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.template.defaultfilters import slugify
+
+from cms.invalidation import run_pending_invalidations
+from cms.apps.pages.models import Page
+
+
+def read_records(filename):
+    """
+    Reads page records from the given file, one at a time.
+
+    CSV files should have a header row. Other files should contain one JSON
+    object per line.
+    """
+    with open(filename, "rb") as handle:
+        if filename.endswith(".csv"):
+            for row in csv.DictReader(handle):
+                yield dict(
+                    (key.decode("utf-8"), value.decode("utf-8"))
+                    for key, value
+                    in row.iteritems()
+                )
+        else:
+            for line in handle:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def normalize_path(path):
+    """Converts the given url path into a path relative to the homepage."""
+    path = path.strip(u"/")
+    if path:
+        path += u"/"
+    return path
+
+
+def set_field_value(obj, field, value):
+    """
+    Sets the given field of the object from an imported value. Blank values
+    leave the default value of non-nullable fields in place.
+    """
+    if value == u"":
+        if not field.null:
+            return
+        value = None
+    else:
+        value = field.to_python(value)
+    setattr(obj, field.attname, value)
+
+
+class Command(BaseCommand):
+
+    args = "<filename>"
+
+    help = (
+        "Imports pages from a CSV file, or a file containing one JSON object per line. "
+        "Each record should have a 'path', and either a 'content_type' (as app_label.model) "
+        "for new pages, or a 'move_from' path for existing pages being moved. Other values "
+        "are used for the fields of new pages and their content. Parent pages must appear "
+        "before their children, or already exist."
+    )
+
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size",
+            action = "store",
+            type = "int",
+            dest = "batch_size",
+            default = 5000,
+            help = "The number of pages to save at a time.",
+        ),
+    )
+
+    def create_page(self, record, parent, url_title):
+        """Creates a new page and its content from the given record."""
+        try:
+            app_label, model = record.pop("content_type").split(u".")
+            content_type = ContentType.objects.get_by_natural_key(app_label, model.lower())
+        except (KeyError, ValueError, ContentType.DoesNotExist):
+            raise CommandError("Invalid content type for page {path!r}.".format(**record))
+        page = Page(
+            parent = None,
+            url_title = url_title,
+            content_type = content_type,
+        )
+        if isinstance(parent, Page):
+            page.parent = parent
+        else:
+            page.parent_id = parent
+        content_cls = content_type.model_class()
+        content = content_cls(page=page)
+        page_fields = dict((field.name, field) for field in Page._meta.fields if field.editable)
+        content_fields = dict((field.name, field) for field in content_cls._meta.fields if field.editable)
+        for name, value in record.iteritems():
+            if name == "path":
+                continue
+            if name in page_fields:
+                set_field_value(page, page_fields[name], value)
+            elif name in content_fields:
+                set_field_value(content, content_fields[name], value)
+            else:
+                raise CommandError("Unknown field {name!r} for page {path!r}.".format(name=name, path=record["path"]))
+        if not page.url_title:
+            page.url_title = slugify(page.title)
+        return page, content
+
+    def save_batch(self, pages, contents, batch_pages):
+        """
+        Saves a batch of pages, returning a new snapshot of the page tree.
+
+        The saved pages are discarded, and can be found by path in the new
+        snapshot.
+        """
+        Page.objects.bulk_import(pages, contents)
+        del pages[:]
+        del contents[:]
+        batch_pages.clear()
+        return Page.objects.get_tree()
+
+    def handle(self, filename=None, **options):
+        """Runs the command."""
+        if filename is None:
+            raise CommandError("Please specify a file to import.")
+        self.import_pages(filename, **options)
+        # The page tree snapshots loaded during the import must not outlive it.
+        run_pending_invalidations()
+
+    @transaction.commit_on_success
+    def import_pages(self, filename, **options):
+        """Imports the pages in the given file, in a single transaction."""
+        verbosity = int(options.get("verbosity", 1))
+        batch_size = options["batch_size"]
+        page_tree = Page.objects.get_tree()
+        batch_pages = {}
+        pages = []
+        contents = []
+        count = 0
+        for record in read_records(filename):
+            try:
+                path = normalize_path(record["path"])
+            except KeyError:
+                raise CommandError("Missing path for page record {0}.".format(count + 1))
+            # Find the parent page.
+            if path:
+                parent_path, url_title = path[:-1].rpartition(u"/")[::2]
+                parent_path = normalize_path(parent_path)
+                parent = batch_pages.get(parent_path)
+                if parent is None:
+                    parent = page_tree.get_page_id(parent_path)
+                    if parent is None:
+                        raise CommandError("No parent page found for page {0!r}.".format(record["path"]))
+            else:
+                parent = None
+                url_title = u""
+            # Create or move the page.
+            move_from = record.pop("move_from", None)
+            if move_from:
+                page_id = page_tree.get_page_id(normalize_path(move_from))
+                if page_id is None:
+                    raise CommandError("No page found at {0!r}.".format(move_from))
+                page = page_tree.create_page(page_id)
+                if isinstance(parent, Page):
+                    page.parent = parent
+                else:
+                    page.parent_id = parent
+                page.url_title = url_title or page.url_title
+            else:
+                page, content = self.create_page(record, parent, url_title)
+                contents.append(content)
+            pages.append(page)
+            batch_pages[path] = page
+            count += 1
+            if len(pages) >= batch_size:
+                page_tree = self.save_batch(pages, contents, batch_pages)
+        if pages:
+            self.save_batch(pages, contents, batch_pages)
+        if verbosity >= 1:
+            self.stdout.write("Imported {0} pages.\n".format(count))
@@ -0,0 +1,57 @@
+"""Updates the search entries of pages that have changed since they were last indexed."""
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from cms import externals
+from cms.apps.pages.search import update_page_search_index
+
+
+class Command(NoArgsCommand):
+    
+    help = (
+        "Updates the search entries of pages whose fields, content or effective publication "
+        "settings have changed since they were last indexed, in batches spread over a pool "
+        "of worker processes. Run this regularly, such as from cron."
+    )
+    
+    option_list = NoArgsCommand.option_list + (
+        make_option("--force",
+            action = "store_true",
+            dest = "force",
+            default = False,
+            help = "Update the search entry of every page, not just the changed ones.",
+        ),
+        make_option("--workers",
+            action = "store",
+            type = "int",
+            dest = "workers",
+            default = None,
+            help = "The number of worker processes to use. Defaults to the SEARCH_INDEX_WORKERS setting.",
+        ),
+        make_option("--batch-size",
+            action = "store",
+            type = "int",
+            dest = "batch_size",
+            default = None,
+            help = "The number of pages to index in each batch. Defaults to the SEARCH_INDEX_BATCH_SIZE setting.",
+        ),
+    )
+    
+    def handle_noargs(self, **options):
+        """Runs the command."""
+        if not externals.watson:
+            raise CommandError("django-watson is not installed.")
+        verbosity = int(options.get("verbosity", 1))
+        indexed_count = skipped_count = deleted_count = 0
+        for indexed, skipped, deleted in update_page_search_index(options["force"], options["workers"], options["batch_size"]):
+            indexed_count += indexed
+            skipped_count += skipped
+            deleted_count += deleted
+        if verbosity >= 1:
+            self.stdout.write("Indexed {indexed} pages, skipped {skipped} unchanged pages and deleted {deleted} stale search entries.\n".format(
+                indexed = indexed_count,
+                skipped = skipped_count,
+                deleted = deleted_count,
+            ))
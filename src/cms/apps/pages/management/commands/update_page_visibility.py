@@ -0,0 +1,24 @@
+"""Recalculates the effective publication settings of all pages."""
+
+from __future__ import with_statement
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from cms.invalidation import run_pending_invalidations
+from cms.apps.pages.models import Page
+from cms.apps.pages.tree import invalidate_page_tree
+from cms.apps.pages.cache import invalidate_page_cache
+
+
+class Command(NoArgsCommand):
+    
+    help = "Recalculates the effective publication settings of all pages, combining them with the settings of their ancestors."
+    
+    def handle_noargs(self, **options):
+        """Runs the command."""
+        with transaction.commit_on_success():
+            Page.objects.update_visibility()
+            invalidate_page_tree()
+            invalidate_page_cache()
+        run_pending_invalidations()
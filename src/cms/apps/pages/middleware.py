@@ -4,14 +4,19 @@ import sys
 
 from django.conf import settings
 from django.core import urlresolvers
+from django.core.exceptions import MiddlewareNotUsed
 from django.core.handlers.base import BaseHandler
 from django.http import Http404
 from django.views.debug import technical_404_response
-from django.shortcuts import redirect
 from django.utils.functional import cached_property
 from django.template.response import SimpleTemplateResponse
 
+from cms.invalidation import is_cache_shared
+from cms.models import publication_manager, publication_clock, get_next_publication_change
 from cms.apps.pages.models import Page
+from cms.apps.pages.tree import PageLoader
+from cms.apps.pages.views import page_dispatch
+from cms.apps.pages.cache import page_cache, dependency_recorder, get_page_cache_timeout, get_page_cache_allow_local_cache, get_object_version_key
 
 
 class RequestPageManager(object):
@@ -22,14 +27,20 @@ class RequestPageManager(object):
         """Initializes the RequestPageManager."""
         self._path = path
         self._path_info = path_info
+        # Whether the response was generated by the content of the current page.
+        self.is_dispatched = False
+        # Whether the request has already been dispatched to the current page, successfully or not.
+        self.dispatch_attempted = False
+        
+    @cached_property
+    def _page_loader(self):
+        """Loads pages from the in-memory page tree."""
+        return PageLoader(Page.objects.get_tree())
         
     @cached_property
     def homepage(self):
         """Returns the site homepage."""
-        try:
-            return Page.objects.get_homepage()
-        except Page.DoesNotExist:
-            return None
+        return self._page_loader.homepage
         
     @property
     def is_homepage(self):
@@ -39,20 +50,7 @@ class RequestPageManager(object):
     @cached_property
     def breadcrumbs(self):
         """The breadcrumbs for the current request."""
-        breadcrumbs = []
-        slugs = self._path_info.strip("/").split("/")
-        slugs.reverse()
-        def do_breadcrumbs(page):
-            breadcrumbs.append(page)
-            if slugs:
-                slug = slugs.pop()
-                for child in page.children:
-                    if child.url_title == slug:
-                        do_breadcrumbs(child)
-                        break
-        if self.homepage:
-            do_breadcrumbs(self.homepage)
-        return breadcrumbs
+        return self._page_loader.get_breadcrumbs(self._path_info)
     
     @property
     def section(self):
@@ -93,36 +91,19 @@ class PageMiddleware(object):
         request.pages = RequestPageManager(request.path, request.path_info)
             
     def process_response(self, request, response):
-        """If the response was a 404, attempt to serve up a page."""
-        if response.status_code != 404:
+        """
+        If the response was a 404, attempt to serve up a page, unless the
+        request was already dispatched to the current page by a catch-all URL.
+        """
+        if response.status_code != 404 or request.pages.is_dispatched or request.pages.dispatch_attempted:
             return response
-        # Get the current page.
-        page = request.pages.current
-        if page is None:
-            return response
-        script_name = page.get_absolute_url()[:-1]
-        path_info = request.path[len(script_name):]
-        # Dispatch to the content.
         try:
-            try:
-                callback, callback_args, callback_kwargs = urlresolvers.resolve(path_info, page.content.urlconf)
-            except urlresolvers.Resolver404:
-                # First of all see if adding a slash will help matters.
-                if settings.APPEND_SLASH:
-                    new_path_info = path_info + "/"
-                    try:
-                        urlresolvers.resolve(new_path_info, page.content.urlconf)
-                    except urlresolvers.Resolver404:
-                        pass
-                    else:
-                        return redirect(script_name + new_path_info)
-                return response
-            response = callback(request, *callback_args, **callback_kwargs)
-            # Validate the response.
-            if not response:
-                raise ValueError, "The view {0!r} didn't return an HttpResponse object.".format(callback.__name__)
-            if isinstance(response, SimpleTemplateResponse):
-                return response.render()
+            page_response = page_dispatch(request)
+            if isinstance(page_response, SimpleTemplateResponse):
+                return page_response.render()
+            return page_response
+        except urlresolvers.Resolver404:
+            # No page matched this request.
             return response
         except Http404, ex:
             if settings.DEBUG:
@@ -130,4 +111,90 @@ class PageMiddleware(object):
             # Let the normal 404 mechanisms render an error page.
             return response
         except:
-            return BaseHandler().handle_uncaught_exception(request, urlresolvers.get_resolver(None), sys.exc_info())
\ No newline at end of file
+            return BaseHandler().handle_uncaught_exception(request, urlresolvers.get_resolver(None), sys.exc_info())
+
+
+class PageCacheMiddleware(object):
+    
+    """
+    Serves page responses from the page cache.
+    
+    This should be placed after PublicationMiddleware, so that preview mode
+    bypasses the cache, and before PageMiddleware, so that the rendered page
+    response is cached.
+    """
+    
+    def __init__(self):
+        """
+        Disables the middleware if the default cache is process-local, since
+        changes made in one process would not invalidate the responses cached
+        by the others.
+        """
+        if not is_cache_shared() and not get_page_cache_allow_local_cache():
+            raise MiddlewareNotUsed("The page cache requires a process-shared default cache, or PAGE_CACHE_ALLOW_LOCAL_CACHE.")
+    
+    def get_variation(self, request):
+        """
+        Returns the cache variation for the request, or None if it should not be
+        cached. Responses to authenticated users can contain anything about the
+        user, so they are never cached.
+        """
+        if request.method != "GET" or not publication_manager.select_published_active():
+            return None
+        if request.user.is_authenticated():
+            return None
+        return "anonymous"
+    
+    def get_timeout(self):
+        """
+        Returns the number of seconds to cache a response for, stopping at the
+        next time that anything is published or expires, since pages can list
+        any published items.
+        """
+        timeout = get_page_cache_timeout()
+        next_publication_change = get_next_publication_change()
+        if next_publication_change is not None:
+            timeout = min(timeout, publication_clock.get_timeout(next_publication_change))
+        return timeout
+    
+    def process_request(self, request):
+        """Serves the response from the cache, if available."""
+        variation = self.get_variation(request)
+        if variation is not None:
+            cache_key = page_cache.get_cache_key(request, variation)
+            response = page_cache.get(cache_key)
+            if response is not None:
+                return response
+            request._page_cache_key = cache_key
+            dependency_recorder.start()
+            
+    def process_response(self, request, response):
+        """Caches the response, if it was generated by a page."""
+        cache_key = getattr(request, "_page_cache_key", None)
+        if cache_key is None:
+            return response
+        del request._page_cache_key
+        dependencies = dependency_recorder.stop()
+        if dependencies is None:
+            return response
+        # Only cache successful page responses that are the same for every user.
+        if not (response.status_code == 200 and request.pages.is_dispatched):
+            return response
+        if response.cookies or request.META.get("CSRF_COOKIE_USED") or "private" in response.get("Cache-Control", ""):
+            return response
+        # The cache key ignores the request headers, such as Accept-Encoding, that the response varies on.
+        if response.has_header("Vary"):
+            return response
+        session = getattr(request, "session", None)
+        if session is not None and session.modified:
+            return response
+        timeout = self.get_timeout()
+        if timeout > 0:
+            # The response depends on the current page and its ancestors.
+            dependencies.update(
+                get_object_version_key(Page, page.id)
+                for page
+                in request.pages.breadcrumbs
+            )
+            page_cache.set(cache_key, response, dependencies, timeout)
+        return response
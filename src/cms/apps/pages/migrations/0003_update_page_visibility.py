@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models, connections
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Combines the publication settings of each page with those of its ancestors."
+        # Calculate the new visibility of each page in a single walk of the tree.
+        visibility = {}
+        rows = []
+        for row in orm["pages.Page"].objects.order_by("left").values_list(
+            "id",
+            "parent_id",
+            "is_online",
+            "publication_date",
+            "expiry_date",
+            "effective_is_online",
+            "effective_publication_date",
+            "effective_expiry_date",
+        ):
+            page_id, parent_id, is_online, publication_date, expiry_date = row[:5]
+            if parent_id is not None:
+                parent_is_online, parent_publication_date, parent_expiry_date = visibility[parent_id]
+                is_online = is_online and parent_is_online
+                if publication_date is None or (parent_publication_date is not None and parent_publication_date > publication_date):
+                    publication_date = parent_publication_date
+                if expiry_date is None or (parent_expiry_date is not None and parent_expiry_date < expiry_date):
+                    expiry_date = parent_expiry_date
+            visibility[page_id] = (is_online, publication_date, expiry_date)
+            if visibility[page_id] != row[5:]:
+                rows.append((page_id,) + visibility[page_id])
+        # Write the changed pages using a combined update for each batch of rows.
+        connection = connections[db.db_alias]
+        opts = orm["pages.Page"]._meta
+        fields = [
+            opts.get_field(field_name)
+            for field_name
+            in ("effective_is_online", "effective_publication_date", "effective_expiry_date")
+        ]
+        id_column = db.quote_name(opts.pk.column)
+        for index in xrange(0, len(rows), 100):
+            batch = rows[index:index+100]
+            assignments = []
+            params = []
+            for field_index, field in enumerate(fields, 1):
+                assignments.append(u"{column} = CASE {id} {cases} END".format(
+                    column = db.quote_name(field.column),
+                    id = id_column,
+                    cases = u" ".join([u"WHEN %s THEN %s"] * len(batch)),
+                ))
+                for row in batch:
+                    params.extend((row[0], field.get_db_prep_value(row[field_index], connection=connection)))
+            params.extend(row[0] for row in batch)
+            db.execute(u"UPDATE {table} SET {assignments} WHERE {id} IN ({ids})".format(
+                table = db.quote_name(opts.db_table),
+                assignments = u", ".join(assignments),
+                id = id_column,
+                ids = u", ".join([u"%s"] * len(batch)),
+            ), params)
+
+    def backwards(self, orm):
+        "No changes are required to unapply this migration."
+
+    models = {
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'pages.page': {
+            'Meta': {'ordering': "('left',)", 'unique_together': "(('parent', 'url_title'),)", 'object_name': 'Page'},
+            'browser_title': ('django.db.models.fields.CharField', [], {'max_length': '1000', 'blank': 'True'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'effective_expiry_date': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'effective_is_online': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'db_index': 'True'}),
+            'effective_publication_date': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'expiry_date': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'in_navigation': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_online': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'left': ('django.db.models.fields.IntegerField', [], {'db_index': 'True'}),
+            'meta_description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'meta_keywords': ('django.db.models.fields.CharField', [], {'max_length': '1000', 'blank': 'True'}),
+            'parent': ('django.db.models.fields.related.ForeignKey', [], {'default': 'None', 'related_name': "'child_set'", 'null': 'True', 'blank': 'True', 'to': "orm['pages.Page']"}),
+            'publication_date': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'right': ('django.db.models.fields.IntegerField', [], {'db_index': 'True'}),
+            'robots_archive': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'robots_follow': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'robots_index': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'short_title': ('django.db.models.fields.CharField', [], {'max_length': '200', 'blank': 'True'}),
+            'sitemap_changefreq': ('django.db.models.fields.IntegerField', [], {'default': 'None', 'null': 'True', 'blank': 'True'}),
+            'sitemap_priority': ('django.db.models.fields.FloatField', [], {'default': 'None', 'null': 'True', 'blank': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1000'}),
+            'url_title': ('django.db.models.fields.SlugField', [], {'max_length': '50'})
+        }
+    }
+
+    complete_apps = ['pages']
+    symmetrical = True
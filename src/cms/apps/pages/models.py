@@ -1,15 +1,21 @@
 """Core models used by the CMS."""
 
+import collections, hashlib, itertools
+
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.core import urlresolvers
-from django.db import models, connection
-from django.db.models import Q, F
+from django.db import models, connections, router, transaction
+from django.db.models import Q, F, Max
+from django.db.models.query import QuerySet, ITER_CHUNK_SIZE
 from django.utils.functional import cached_property
-from django.utils import timezone
 
 from cms import sitemaps, externals
-from cms.models import PageBase, OnlineBaseManager, PageBaseSearchAdapter
-from cms.models.managers import publication_manager
+from cms.models import PageBase, OnlineBaseManager, PageBaseSearchAdapter, HtmlField
+from cms.models.managers import publication_manager, publication_clock
+from cms.models.fields import invalidate_prerendered_urls
+from cms.apps.pages.tree import get_page_tree, invalidate_page_tree
+from cms.apps.pages.cache import invalidate_objects, invalidate_page_cache
 
 
 def get_default_page_parent():
@@ -20,55 +26,513 @@ def get_default_page_parent():
         return None
 
 
+def get_tree_spacing():
+    """
+    Returns the number of spare left and right values to leave when making room
+    in the page tree.
+    
+    A non-zero spacing means that most new pages can be inserted into the tree
+    without renumbering any other pages, at the cost of the tree no longer being
+    contiguous.
+    """
+    return getattr(settings, "PAGE_TREE_SPACING", 0)
+
+
+def get_effective_visibility(parent_visibility, is_online, publication_date, expiry_date):
+    """
+    Combines the publication settings of a page with the effective publication
+    settings of its parent, returning a tuple of (is_online, publication_date,
+    expiry_date).
+    """
+    if parent_visibility is not None:
+        parent_is_online, parent_publication_date, parent_expiry_date = parent_visibility
+        is_online = is_online and parent_is_online
+        if publication_date is None or (parent_publication_date is not None and parent_publication_date > publication_date):
+            publication_date = parent_publication_date
+        if expiry_date is None or (parent_expiry_date is not None and parent_expiry_date < expiry_date):
+            expiry_date = parent_expiry_date
+    return (is_online, publication_date, expiry_date)
+
+
+# Content classes and their URL resolvers, keyed by content type id.
+_content_resolvers = {}
+
+
+def get_content_resolver(content_type_id):
+    """
+    Returns a tuple of (content_cls, resolver) for the given content type id,
+    where resolver resolves the URLs of the content's urlconf.
+    
+    These are cached for the lifetime of the process.
+    """
+    try:
+        return _content_resolvers[content_type_id]
+    except KeyError:
+        content = get_content_registry().get_for_content_type_id(content_type_id)
+        if content is None:
+            content_cls = ContentType.objects.get_for_id(content_type_id).model_class()
+            urlconf = content_cls.urlconf
+        else:
+            content_cls = content.model
+            urlconf = content.urlconf
+        content_resolver = (content_cls, urlresolvers.get_resolver(urlconf))
+        _content_resolvers[content_type_id] = content_resolver
+        return content_resolver
+
+
+def get_content_cls(content_type_id):
+    """Returns the content class for the given content type id."""
+    return get_content_resolver(content_type_id)[0]
+
+
+def prefetch_page_content(pages):
+    """
+    Loads the content of the given pages using a single query for each content
+    model, and caches it on each page.
+    """
+    pages_by_content_type = {}
+    for page in pages:
+        if "content" not in page.__dict__:
+            pages_by_content_type.setdefault(page.content_type_id, {}).setdefault(page.id, []).append(page)
+    for content_type_id, pages_by_id in pages_by_content_type.iteritems():
+        content_cls = get_content_cls(content_type_id)
+        page_ids = pages_by_id.keys()
+        for index in xrange(0, len(page_ids), 500):
+            for content in content_cls._default_manager.filter(page__in=page_ids[index:index+500]):
+                for page in pages_by_id[content.page_id]:
+                    content.page = page
+                    page.__dict__["content"] = content
+
+
+def iter_prefetch_page_content(pages):
+    """
+    Iterates over the given pages, prefetching their content in batches.
+    """
+    pages = iter(pages)
+    while True:
+        batch = list(itertools.islice(pages, ITER_CHUNK_SIZE))
+        if not batch:
+            break
+        prefetch_page_content(batch)
+        for page in batch:
+            yield page
+
+
+class PageQuerySet(QuerySet):
+    
+    """A queryset of pages."""
+    
+    _prefetch_content = False
+    
+    def prefetch_content(self):
+        """
+        Returns a new queryset that loads the content of its pages using a
+        single query for each content model.
+        """
+        return self._clone(_prefetch_content=True)
+        
+    def iterator(self):
+        """Iterates over the pages in the queryset."""
+        pages = super(PageQuerySet, self).iterator()
+        if self._prefetch_content:
+            pages = iter_prefetch_page_content(pages)
+        return pages
+    
+    def _clone(self, klass=None, setup=False, **kwargs):
+        """Creates a copy of the queryset."""
+        if klass is None or issubclass(klass, PageQuerySet):
+            kwargs.setdefault("_prefetch_content", self._prefetch_content)
+        return super(PageQuerySet, self)._clone(klass, setup, **kwargs)
+
+
 class PageManager(OnlineBaseManager):
     
     """Manager for Page objects."""
     
-    def select_published(self, queryset, page_alias=None):
+    def get_query_set(self):
+        """Returns a queryset of pages."""
+        return super(PageManager, self).get_query_set()._clone(klass=PageQuerySet)
+        
+    def prefetch_content(self):
+        """Returns a queryset that loads the content of its pages in batches."""
+        return self.get_query_set().prefetch_content()
+    
+    def select_published(self, queryset):
         """Selects only published pages."""
         queryset = super(PageManager, self).select_published(queryset)
-        now = timezone.now()
-        # Perform local filtering.
-        queryset = queryset.filter(Q(publication_date=None) | Q(publication_date__lte=now))
-        queryset = queryset.filter(Q(expiry_date=None) | Q(expiry_date__gt=now))
-        # Perform parent ordering.
-        quote_name = connection.ops.quote_name
-        page_alias = page_alias  or quote_name("pages_page")
-        queryset = queryset.extra(
-            where = ("""
-                NOT EXISTS (
-                    SELECT *
-                    FROM {pages_page} AS {ancestors}
-                    WHERE
-                        {ancestors}.{left} < {page_alias}.{left} AND
-                        {ancestors}.{right} > {page_alias}.{right} AND (
-                            {ancestors}.{is_online} = FALSE OR
-                            {ancestors}.{publication_date} > %s OR
-                            {ancestors}.{expiry_date} <= %s
-                        )
-                )
-            """.format(
-                page_alias = page_alias,
-                **dict(
-                    (name, quote_name(name))
-                    for name in (
-                        "pages_page",
-                        "ancestors",
-                        "left",
-                        "right",
-                        "is_online",
-                        "publication_date",
-                        "expiry_date",
-                    )
-                )
-            ),),
-            params = (now, now),
-        )
+        now = publication_clock.now()
+        # Filter on the publication settings combined with those of the ancestors.
+        queryset = queryset.filter(effective_is_online=True)
+        queryset = queryset.filter(Q(effective_publication_date=None) | Q(effective_publication_date__lte=now))
+        queryset = queryset.filter(Q(effective_expiry_date=None) | Q(effective_expiry_date__gt=now))
         return queryset
     
+    def get_published_sql(self):
+        """Returns an SQL condition that selects published pages."""
+        return u" AND ".join((
+            super(PageManager, self).get_published_sql(),
+            u"{effective_is_online} = %s",
+            u"({effective_publication_date} IS NULL OR {effective_publication_date} <= %s)",
+            u"({effective_expiry_date} IS NULL OR {effective_expiry_date} > %s)",
+        ))
+    
+    def get_published_params(self, connection):
+        """Returns the params of the SQL returned by get_published_sql()."""
+        now = connection.ops.value_to_db_datetime(publication_clock.now())
+        return super(PageManager, self).get_published_params(connection) + [True, now, now]
+    
+    def get_next_publication_change(self):
+        """Returns the next time that a page will be published or expire, or None."""
+        return self.get_tree().get_next_publication_change()
+    
     def get_homepage(self):
         """Returns the site homepage."""
         return self.prefetch_related("child_set__child_set").get(parent=None)
+    
+    def update_visibility(self, page=None):
+        """
+        Recalculates the effective publication settings of the given page and
+        all of its descendants.
+        
+        If no page is given, then the whole tree is updated.
+        """
+        with publication_manager.select_published(False):
+            queryset = self.model._base_manager.all()
+            visibility = {}
+            if page is not None:
+                queryset = queryset.filter(left__gte=page.left, right__lte=page.right)
+                if page.parent_id is not None:
+                    visibility[page.parent_id] = self.model._base_manager.filter(id=page.parent_id).values_list(
+                        "effective_is_online",
+                        "effective_publication_date",
+                        "effective_expiry_date",
+                    ).get()
+            # Calculate the new visibility of each page.
+            changed_pages = {}
+            for row in queryset.order_by("left").values_list(
+                "id",
+                "parent_id",
+                "is_online",
+                "publication_date",
+                "expiry_date",
+                "effective_is_online",
+                "effective_publication_date",
+                "effective_expiry_date",
+            ):
+                page_id, parent_id = row[0:2]
+                visibility[page_id] = get_effective_visibility(visibility.get(parent_id), *row[2:5])
+                if visibility[page_id] != row[5:]:
+                    changed_pages.setdefault(visibility[page_id], []).append(page_id)
+            # Update the changed pages, grouped by their new visibility.
+            for (effective_is_online, effective_publication_date, effective_expiry_date), page_ids in changed_pages.iteritems():
+                for index in xrange(0, len(page_ids), 500):
+                    self.model._base_manager.filter(id__in=page_ids[index:index+500]).update(
+                        effective_is_online = effective_is_online,
+                        effective_publication_date = effective_publication_date,
+                        effective_expiry_date = effective_expiry_date,
+                    )
+    
+    # Tree management.
+    
+    def lock_tree(self):
+        """
+        Locks the root of the page tree for update, serializing all changes to
+        the tree.
+        
+        Inserting, moving or deleting a page renumbers every page after it,
+        including its ancestors, so locking only the pages being changed would
+        let concurrent changes read stale positions. The tree should be locked
+        before any pages are locked or their positions are read, so that locks
+        are always taken in the same order.
+        """
+        db = router.db_for_write(self.model)
+        list(self.model._base_manager.using(db).select_for_update().filter(parent=None).values_list("id", flat=True))
+    
+    def lock_page(self, page_id):
+        """
+        Locks the given page for update, returning a dictionary of its current
+        tree and publication fields.
+        """
+        return self.model._base_manager.select_for_update().filter(id=page_id).values(
+            "id",
+            "parent_id",
+            "url_title",
+            "left",
+            "right",
+            "is_online",
+            "publication_date",
+            "expiry_date",
+            "effective_is_online",
+            "effective_publication_date",
+            "effective_expiry_date",
+        ).get()
+    
+    def _update_tree(self, sql, params):
+        """Runs the given raw SQL update over the page tree."""
+        db = router.db_for_write(self.model)
+        quote_name = connections[db].ops.quote_name
+        cursor = connections[db].cursor()
+        cursor.execute(sql.format(
+            pages_page = quote_name(self.model._meta.db_table),
+            left = quote_name("left"),
+            right = quote_name("right"),
+        ), params)
+        transaction.commit_unless_managed(using=db)
+    
+    def shift_tree(self, position, offset):
+        """
+        Shifts every left and right value at or after the given position by the
+        given offset, using a single update.
+        """
+        self._update_tree("""
+            UPDATE {pages_page} SET
+                {left} = CASE WHEN {left} >= %s THEN {left} + %s ELSE {left} END,
+                {right} = {right} + %s
+            WHERE {right} >= %s
+        """, (position, offset, offset, position))
+        
+    def move_branch(self, left, right, position):
+        """
+        Moves the branch between the given left and right values so that it
+        starts at the given position, shifting the values in between to make
+        room for it.
+        
+        Only the values between the branch and the position are updated, using
+        a single combined update.
+        """
+        branch_width = right - left + 1
+        if position > right:
+            # Move the branch forward, shifting the values in between back.
+            branch_offset = position - right - 1
+            other_left = right + 1
+            other_right = position - 1
+            other_offset = -branch_width
+        else:
+            # Move the branch back, shifting the values in between forward.
+            branch_offset = position - left
+            other_left = position
+            other_right = left - 1
+            other_offset = branch_width
+        lowest = min(left, other_left)
+        highest = max(right, other_right)
+        self._update_tree("""
+            UPDATE {pages_page} SET
+                {left} = CASE
+                    WHEN {left} BETWEEN %s AND %s THEN {left} + %s
+                    WHEN {left} BETWEEN %s AND %s THEN {left} + %s
+                    ELSE {left}
+                END,
+                {right} = CASE
+                    WHEN {right} BETWEEN %s AND %s THEN {right} + %s
+                    WHEN {right} BETWEEN %s AND %s THEN {right} + %s
+                    ELSE {right}
+                END
+            WHERE {left} BETWEEN %s AND %s OR {right} BETWEEN %s AND %s
+        """, (
+            left, right, branch_offset,
+            other_left, other_right, other_offset,
+        ) * 2 + (
+            lowest, highest,
+        ) * 2)
+    
+    def make_room(self, parent_page, branch_width, spacing=0):
+        """
+        Finds room for a branch of the given width at the end of the children
+        of the given parent page, returning a tuple of (position, gap_width).
+        
+        If there is no free space under the parent page, then a gap is opened up
+        in the tree, large enough for the branch plus the given spacing, and
+        gap_width will be the width of this gap. Otherwise, gap_width will be 0.
+        """
+        if spacing:
+            last_child_right = self.model._base_manager.filter(parent=parent_page["id"]).aggregate(
+                right = Max("right"),
+            )["right"]
+            position = (last_child_right or parent_page["left"]) + 1
+            if parent_page["right"] - position >= branch_width:
+                return position, 0
+        position = parent_page["right"]
+        gap_width = branch_width + spacing
+        self.shift_tree(position, gap_width)
+        return position, gap_width
+    
+    def _bulk_update(self, field_names, rows):
+        """
+        Updates the given fields of many pages, using a combined update for each
+        batch of rows.
+        
+        Each row should be a tuple of a page id followed by the new values of
+        the given fields.
+        """
+        quote_name = connections[router.db_for_write(self.model)].ops.quote_name
+        id_column = quote_name(self.model._meta.pk.column)
+        for index in xrange(0, len(rows), 100):
+            batch = rows[index:index+100]
+            assignments = []
+            params = []
+            for field_index, field_name in enumerate(field_names, 1):
+                assignments.append(u"{column} = CASE {id} {cases} END".format(
+                    column = quote_name(self.model._meta.get_field(field_name).column),
+                    id = id_column,
+                    cases = u" ".join([u"WHEN %s THEN %s"] * len(batch)),
+                ))
+                for row in batch:
+                    params.extend((row[0], row[field_index]))
+            params.extend(row[0] for row in batch)
+            self._update_tree(u"UPDATE {{pages_page}} SET {assignments} WHERE {id} IN ({ids})".format(
+                assignments = u", ".join(assignments),
+                id = id_column,
+                ids = u", ".join([u"%s"] * len(batch)),
+            ), params)
+    
+    def renumber_tree(self, ordering=None, spacing=None):
+        """
+        Recalculates the left and right values of the whole page tree in a
+        single pass, updating only the pages whose values have changed.
+        
+        The ordering can be a dictionary mapping page ids to a position among
+        their siblings. Pages in the ordering are placed after their other
+        siblings, in the order given.
+        """
+        if ordering is None:
+            ordering = {}
+        if spacing is None:
+            spacing = get_tree_spacing()
+        with publication_manager.select_published(False):
+            rows = list(self.model._base_manager.order_by("left").values_list("id", "parent_id", "left", "right"))
+        # Sort the children of each page.
+        child_ids = {}
+        for page_id, parent_id, left, right in rows:
+            child_ids.setdefault(parent_id, []).append(page_id)
+        for sibling_ids in child_ids.itervalues():
+            sibling_ids.sort(key=lambda page_id: ordering.get(page_id, -1))
+        # Number the tree.
+        numbering = {}
+        lefts = {}
+        position = 1
+        stack = [(page_id, False) for page_id in reversed(child_ids.get(None, ()))]
+        while stack:
+            page_id, is_complete = stack.pop()
+            if is_complete:
+                numbering[page_id] = (lefts[page_id], position + spacing)
+                position += spacing + 1
+            else:
+                lefts[page_id] = position
+                position += 1
+                stack.append((page_id, True))
+                stack.extend((child_id, False) for child_id in reversed(child_ids.get(page_id, ())))
+        if len(numbering) != len(rows):
+            raise ValueError("The page tree contains a cycle.")
+        # Update the changed pages.
+        self._bulk_update(("left", "right"), [
+            (page_id,) + numbering[page_id]
+            for page_id, parent_id, left, right
+            in rows
+            if numbering[page_id] != (left, right)
+        ])
+        return numbering
+    
+    def bulk_import(self, pages, contents=()):
+        """
+        Saves the given new or moved pages, and the content objects of the new
+        pages, renumbering the page tree in a single pass.
+        
+        New pages are inserted using bulk_create, one level of the tree at a
+        time, so the parent of a new page can be another new page. Moved pages
+        have their parent and url title updated. Both are placed after the
+        existing children of their parent, in the order given.
+        
+        This bypasses the save signals of the pages and their content, so
+        search indexes should be rebuilt afterwards. It should be run inside a
+        transaction.
+        """
+        pages = list(pages)
+        db = router.db_for_write(self.model)
+        with publication_manager.select_published(False):
+            self.lock_tree()
+        parent_cache_name = self.model._meta.get_field("parent").get_cache_name()
+        def get_parent(page):
+            if page.parent_id is None:
+                return getattr(page, parent_cache_name, None)
+            return None
+        def get_parent_id(page):
+            parent = get_parent(page)
+            if parent is not None:
+                return parent.id
+            return page.parent_id
+        moved_pages = [page for page in pages if page.id is not None]
+        # Insert the new pages, one level at a time.
+        new_pages = [page for page in pages if page.id is None]
+        marker = 0
+        while new_pages:
+            level_pages = []
+            remaining_pages = []
+            for page in new_pages:
+                parent = get_parent(page)
+                if parent is not None and parent.id is None:
+                    remaining_pages.append(page)
+                else:
+                    level_pages.append(page)
+            if not level_pages:
+                raise ValueError("The parents of some new pages have not been saved.")
+            # Pages are inserted with a temporary marker in place of their tree position.
+            marker -= 1
+            for page in level_pages:
+                page.parent_id = get_parent_id(page)
+                page.left = page.right = marker
+            with publication_manager.select_published(False):
+                self.model._base_manager.using(db).bulk_create(level_pages)
+                page_ids = dict(
+                    ((parent_id, url_title), page_id)
+                    for parent_id, url_title, page_id
+                    in self.model._base_manager.using(db).filter(left=marker).values_list("parent_id", "url_title", "id")
+                )
+            for page in level_pages:
+                page.id = page_ids[(page.parent_id, page.url_title)]
+                page._state.adding = False
+                page._state.db = db
+            new_pages = remaining_pages
+        # Insert the content of the new pages.
+        content_batches = {}
+        for content in contents:
+            if content.page_id is None:
+                content.page_id = content.page.id
+            content_batches.setdefault(content.__class__, []).append(content)
+        for content_cls, content_batch in content_batches.iteritems():
+            content_cls._default_manager.db_manager(db).bulk_create(content_batch)
+        # Update the moved pages.
+        self._bulk_update(("parent", "url_title"), [
+            (page.id, get_parent_id(page), page.url_title)
+            for page in moved_pages
+        ])
+        # Renumber the tree and recalculate the publication settings.
+        numbering = self.renumber_tree(dict((page.id, index) for index, page in enumerate(pages)))
+        for page in pages:
+            page.parent_id = get_parent_id(page)
+            page.left, page.right = numbering[page.id]
+        self.update_visibility()
+        # The URLs of the moved pages, and of everything below them, might have changed.
+        if moved_pages:
+            moved_ranges = sorted(numbering[page.id] for page in moved_pages)
+            moved_page_ids = []
+            branch_right = 0
+            for page_id, (left, right) in sorted(numbering.iteritems(), key=lambda item: item[1]):
+                while moved_ranges and moved_ranges[0][0] <= left:
+                    branch_right = max(branch_right, moved_ranges.pop(0)[1])
+                if left <= branch_right:
+                    moved_page_ids.append(page_id)
+            invalidate_prerendered_urls(self.model, moved_page_ids)
+        invalidate_page_tree()
+        invalidate_page_cache()
+    
+    def get_tree(self, load=True):
+        """
+        Returns an in-memory snapshot of the whole page tree.
+        
+        If load is False, then None is returned rather than loading an
+        out-of-date snapshot from the database.
+        """
+        return get_page_tree(self.model, load)
 
 
 class Page(PageBase):
@@ -100,6 +564,9 @@ class Page(PageBase):
     @cached_property
     def children(self):
         """The child pages for this page."""
+        page_loader = getattr(self, "_page_loader", None)
+        if page_loader is not None:  # Optimization - pages loaded from the tree snapshot don't need a query.
+            return page_loader.get_children(self)
         children = []
         if self.right - self.left > 1:  # Optimization - don't fetch children we know aren't there!
             for child in self.child_set.all():
@@ -128,6 +595,28 @@ class Page(PageBase):
         help_text = "The date that this page will be removed from the website.  Leave this blank to never expire this page.",
     )
 
+    # The publication settings of this page, combined with those of its ancestors.
+    
+    effective_is_online = models.BooleanField(
+        default = True,
+        editable = False,
+        db_index = True,
+    )
+    
+    effective_publication_date = models.DateTimeField(
+        blank = True,
+        null = True,
+        editable = False,
+        db_index = True,
+    )
+    
+    effective_expiry_date = models.DateTimeField(
+        blank = True,
+        null = True,
+        editable = False,
+        db_index = True,
+    )
+    
     # Navigation fields.
 
     in_navigation = models.BooleanField(
@@ -147,7 +636,7 @@ class Page(PageBase):
     @cached_property
     def content(self):
         """The associated content model for this page."""
-        content_cls = ContentType.objects.get_for_id(self.content_type_id).model_class()
+        content_cls = get_content_cls(self.content_type_id)
         content = content_cls._default_manager.get(page=self)
         content.page = self
         return content
@@ -158,13 +647,24 @@ class Page(PageBase):
             args = ()
         if kwargs is None:
             kwargs = {}
-        urlconf = ContentType.objects.get_for_id(self.content_type_id).model_class().urlconf
+        urlconf = get_content_cls(self.content_type_id).urlconf
         return self.get_absolute_url() + urlresolvers.reverse(view_func, args=args, kwargs=kwargs, urlconf=urlconf, prefix="")
 
     # Standard model methods.
     
     def get_absolute_url(self):
         """Generates the absolute url of the page."""
+        # Use the precomputed path from the page tree, if available.
+        page_loader = getattr(self, "_page_loader", None)
+        if page_loader is not None:
+            page_tree = page_loader.page_tree
+        else:
+            page_tree = Page.objects.get_tree(load=False)
+        if page_tree is not None:
+            path = page_tree.get_path(self)
+            if path is not None:
+                return urlresolvers.get_script_prefix() + path
+        # Fall back to generating the url from the parent.
         if self.parent:
             return self.parent.get_absolute_url() + self.url_title + "/"
         return urlresolvers.get_script_prefix()
@@ -174,87 +674,112 @@ class Page(PageBase):
     @property
     def _branch_width(self):
         return self.right - self.left + 1
-    
-    def _excise_branch(self):
-        """Excises this whole branch from the tree."""
-        branch_width = self._branch_width
-        Page.objects.filter(left__gte=self.left).update(
-            left = F("left") - branch_width,
-        )
-        Page.objects.filter(right__gte=self.left).update(
-            right = F("right") - branch_width,
-        )
-        
-    def _insert_branch(self):
-        """Inserts this whole branch into the tree."""
-        branch_width = self._branch_width
-        Page.objects.filter(left__gte=self.left).update(
-            left = F("left") + branch_width,
-        )
-        Page.objects.filter(right__gte=self.left).update(
-            right = F("right") + branch_width,
-        )
         
     def save(self, *args, **kwargs):
         """Saves the page."""
-        # Lock entire table.
-        existing_pages = dict(
-            (page["id"], page)
-            for page
-            in Page.objects.all().select_for_update().values("id", "parent_id", "left", "right")
-        )
-        if self.left is None or self.right is None:
-            # This page is being inserted.
-            if existing_pages:
-                parent_right = existing_pages[self.parent_id]["right"]
-                # Set the model left and right.
-                self.left = parent_right
-                self.right = self.left + 1
-                # Update the whole tree structure.
-                self._insert_branch()
+        spacing = get_tree_spacing()
+        update_branch_visibility = False
+        url_changed = False
+        with publication_manager.select_published(False):
+            parent_page = None
+            if self.left is None or self.right is None:
+                # This page is being inserted.
+                Page.objects.lock_tree()
+                if self.parent_id is None:
+                    # This is the first page to be created, ever!
+                    self.left = 1
+                    self.right = 2
+                else:
+                    parent_page = Page.objects.lock_page(self.parent_id)
+                    self.left = Page.objects.make_room(parent_page, 2, spacing)[0]
+                    self.right = self.left + 1
             else:
-                # This is the first page to be created, ever!
-                self.left = 1
-                self.right = 2
-        else:
-            # This is an update.
-            old_parent_id = existing_pages[self.id]["parent_id"]
-            if old_parent_id != self.parent_id:
-                # The page has moved.
-                branch_width = self.right - self.left + 1
-                # Disconnect child branch.
-                if branch_width > 2:
-                    Page.objects.filter(left__gt=self.left, right__lt=self.right).update(
-                        left = F("left") * -1,
-                        right = F("right") * -1,
-                    )
-                self._excise_branch()
-                # Store old left and right values.
-                old_left = self.left
-                old_right = self.right
-                # Put self into the tree.
-                parent_right = existing_pages[self.parent_id]["right"]
-                if parent_right > self.right:
-                    parent_right -= self._branch_width
-                self.left = parent_right
-                self.right = self.left + branch_width - 1
-                self._insert_branch()
-                # Put all children back into the tree.
-                if branch_width > 2:
-                    child_offset = self.left - old_left
-                    Page.objects.filter(left__lt=-old_left, right__gt=-old_right).update(
-                        left = (F("left") - child_offset) * -1,
-                        right = (F("right") - child_offset) * -1,
-                    )
+                # This is an update. Only moving the page renumbers the rest
+                # of the tree, so other updates lock just the rows they read.
+                is_moving = Page._base_manager.filter(id=self.id).values_list("parent_id", flat=True).get() != self.parent_id
+                if is_moving:
+                    Page.objects.lock_tree()
+                old_page = Page.objects.lock_page(self.id)
+                old_parent_id = old_page["parent_id"]
+                if not is_moving and old_parent_id != self.parent_id:
+                    # Another transaction moved the page after it was read, so
+                    # this save moves it back. Locking the tree out of order
+                    # can deadlock, but the database will abort one of the
+                    # transactions rather than corrupt the tree.
+                    Page.objects.lock_tree()
+                url_changed = old_parent_id != self.parent_id or old_page["url_title"] != self.url_title
+                self.left = old_page["left"]
+                self.right = old_page["right"]
+                update_branch_visibility = self.right - self.left > 1 and (
+                    old_parent_id != self.parent_id or
+                    old_page["is_online"] != self.is_online or
+                    old_page["publication_date"] != self.publication_date or
+                    old_page["expiry_date"] != self.expiry_date
+                )
+                if self.parent_id is not None:
+                    parent_page = Page.objects.lock_page(self.parent_id)
+                if old_parent_id != self.parent_id:
+                    # The page has moved, so the navigation of its old parent has changed.
+                    if old_parent_id is not None:
+                        invalidate_objects(Page, (old_parent_id,))
+                    branch_width = self._branch_width
+                    if spacing:
+                        # Move the branch into a free space under the new parent.
+                        position, gap_width = Page.objects.make_room(parent_page, branch_width, spacing)
+                        if gap_width and self.left >= position:
+                            self.left += gap_width
+                            self.right += gap_width
+                        Page._base_manager.filter(left__gte=self.left, right__lte=self.right).update(
+                            left = F("left") + (position - self.left),
+                            right = F("right") + (position - self.left),
+                        )
+                        self.left = position
+                    else:
+                        # Move the branch to the end of the new parent, closing up the space it leaves.
+                        position = parent_page["right"]
+                        Page.objects.move_branch(self.left, self.right, position)
+                        if position > self.right:
+                            self.left = position - branch_width
+                        else:
+                            self.left = position
+                    self.right = self.left + branch_width - 1
+        # Combine the publication settings with those of the parent.
+        parent_visibility = None
+        if parent_page is not None:
+            parent_visibility = (
+                parent_page["effective_is_online"],
+                parent_page["effective_publication_date"],
+                parent_page["effective_expiry_date"],
+            )
+        self.effective_is_online, self.effective_publication_date, self.effective_expiry_date = get_effective_visibility(
+            parent_visibility,
+            self.is_online,
+            self.publication_date,
+            self.expiry_date,
+        )
         # Now actually save it!
         super(Page, self).save(*args, **kwargs)
+        # Update the publication settings of the descendants.
+        if update_branch_visibility:
+            Page.objects.update_visibility(self)
+        # The URLs of the descendants, and of anything derived from them, have changed.
+        if url_changed:
+            invalidate_prerendered_urls(Page, Page._base_manager.filter(
+                left__gte = self.left,
+                right__lte = self.right,
+            ).values_list("id", flat=True))
+        invalidate_page_tree()
 
     def delete(self, *args, **kwargs):
         """Deletes the page."""
-        list(Page.objects.all().select_for_update().values_list("left", "right"))  # Lock entire table.
+        with publication_manager.select_published(False):
+            Page.objects.lock_tree()
+            page = Page.objects.lock_page(self.id)
         super(Page, self).delete(*args, **kwargs)
-        # Update the entire tree.
-        self._excise_branch()
+        # Close up the space left by the branch.
+        if not get_tree_spacing():
+            Page.objects.shift_tree(page["right"] + 1, page["left"] - page["right"] - 1)
+        invalidate_page_tree()
 
     class Meta:
         unique_together = (("parent", "url_title",),)
@@ -270,6 +795,8 @@ class PageSitemap(sitemaps.PageBaseSitemap):
     
     model = Page
     
+    only_fields = ("id", "parent", "url_title", "sitemap_priority", "sitemap_changefreq",)
+    
     def items(self):
         """Only lists items that are marked as indexable."""
         return filter_indexable_pages(super(PageSitemap, self).items())
@@ -278,45 +805,183 @@ class PageSitemap(sitemaps.PageBaseSitemap):
 sitemaps.register(Page, sitemap_cls=PageSitemap)
 
 
+# The names of the text fields of each content model, keyed by model.
+_search_text_field_names = {}
+
+
+def get_search_text_field_names(model):
+    """
+    Returns the names of the text fields of the given model that should be
+    included in its search text. The stored renditions of HtmlFields are left
+    out, since they repeat the HTML that they were rendered from.
+    
+    These are cached for the lifetime of the process.
+    """
+    try:
+        return _search_text_field_names[model]
+    except KeyError:
+        excluded_field_names = set()
+        for field in model._meta.fields:
+            if isinstance(field, HtmlField) and field.prerender:
+                excluded_field_names.update((field.rendered_attname, field.dependencies_attname))
+        field_names = tuple(
+            field.attname
+            for field
+            in model._meta.fields
+            if isinstance(field, (models.CharField, models.TextField)) and field.attname not in excluded_field_names
+        )
+        _search_text_field_names[model] = field_names
+        return field_names
+
+
+# Page fields that change without affecting the search entry of the page.
+PAGE_SEARCH_FINGERPRINT_IGNORED_FIELDS = ("left", "right",)
+
+
+def get_page_search_fingerprint(page):
+    """
+    Returns a hash of everything that the search entry of the given page is
+    built from: the fields of the page and its content, its URL, and its
+    effective publication settings, which include those of its ancestors.
+    """
+    content = page.content
+    values = [page.get_absolute_url()]
+    values.extend(
+        getattr(page, field.attname)
+        for field
+        in page._meta.fields
+        if field.attname not in PAGE_SEARCH_FINGERPRINT_IGNORED_FIELDS
+    )
+    values.extend(
+        getattr(content, field.attname)
+        for field
+        in content._meta.fields
+    )
+    return hashlib.md5(repr(values)).hexdigest()
+
+
 class PageSearchAdapter(PageBaseSearchAdapter):
     
     """Search adapter for Page models."""
     
     def get_content(self, obj):
         """Returns the search text for the page."""
-        content_obj = obj.content
+        content_obj = obj.content  # Already loaded if the page came from the live queryset.
         return u" ".join((
             super(PageSearchAdapter, self).get_content(obj),
             self.prepare_content(u" ".join(
-                unicode(self._resolve_field(content_obj, field_name))
-                for field_name in (
-                    field.name for field
-                    in content_obj._meta.fields
-                    if isinstance(field, (models.CharField, models.TextField))
-                )
+                unicode(getattr(content_obj, field_name))
+                for field_name
+                in get_search_text_field_names(content_obj.__class__)
             ))
         ))
+    
+    def get_meta(self, obj):
+        """
+        Returns the meta information for the page, including the fingerprint
+        used by the update_page_search_index command to skip unchanged pages.
+        """
+        meta = super(PageSearchAdapter, self).get_meta(obj)
+        meta["search_fingerprint"] = get_page_search_fingerprint(obj)
+        return meta
         
     def get_live_queryset(self):
         """Selects the live page queryset."""
-        # HACK: Prevents a table name collision in the Django queryset manager.
-        with publication_manager.select_published(False):
-            qs = Page._base_manager.all()
-        if publication_manager.select_published_active():
-            qs = Page.objects.select_published(qs, page_alias="U0")
         # Filter out unindexable pages.
-        qs = filter_indexable_pages(qs)
-        # All done!
-        return qs
+        return filter_indexable_pages(super(PageSearchAdapter, self).get_live_queryset()).prefetch_content()
         
         
 externals.watson("register", Page, adapter_cls=PageSearchAdapter)
 
 
+
 # Base content class.
 
+class RegisteredContent(collections.namedtuple("RegisteredContentBase", ("model", "content_type_id", "urlconf", "classifier", "icon", "robots_index",))):
+    
+    """The settings of a registered content model."""
+    
+    __slots__ = ()
+    
+    
+class ContentRegistry(object):
+    
+    """An immutable registry of all concrete ContentBase subclasses."""
+    
+    def __init__(self, contents):
+        """Initializes the ContentRegistry."""
+        self._contents = tuple(sorted(contents, key=lambda content: (content.classifier, content.model._meta.verbose_name.lower())))
+        self._contents_by_content_type_id = dict(
+            (content.content_type_id, content)
+            for content
+            in self._contents
+        )
+        self.indexable_content_type_ids = tuple(
+            content.content_type_id
+            for content
+            in self._contents
+            if content.robots_index
+        )
+        
+    def __iter__(self):
+        """Iterates over the registered content, sorted by classifier and name."""
+        return iter(self._contents)
+        
+    def __len__(self):
+        """Returns the number of registered content models."""
+        return len(self._contents)
+        
+    def get_for_content_type_id(self, content_type_id):
+        """Returns the RegisteredContent for the given content type id, or None."""
+        return self._contents_by_content_type_id.get(content_type_id)
+        
+    @classmethod
+    def build(cls):
+        """Builds a new ContentRegistry from the installed models."""
+        content_models = get_registered_content()
+        content_types = ContentType.objects.get_for_models(*content_models)
+        return cls(
+            RegisteredContent(
+                model = model,
+                content_type_id = content_types[model].id,
+                urlconf = model.urlconf,
+                classifier = model.classifier,
+                icon = model.icon,
+                robots_index = model.robots_index,
+            )
+            for model
+            in content_models
+        )
+
+
+# The content registry, built when first used.
+_content_registry = None
+
+
+def get_content_registry():
+    """Returns the registry of all content models."""
+    global _content_registry
+    if _content_registry is None:
+        _content_registry = ContentRegistry.build()
+    return _content_registry
+
+
+def clear_content_registry(sender, **kwargs):
+    """Rebuilds the content registry if a content model is created after it was built."""
+    global _content_registry
+    if issubclass(sender, ContentBase):
+        _content_registry = None
+
+models.signals.class_prepared.connect(clear_content_registry)
+
+
 def get_registered_content():
-    """Returns a list of all registered content objects."""
+    """
+    Returns a list of all registered content models.
+    
+    Unlike get_content_registry(), this does not query the database, so it can
+    be used while the models and admin classes are being loaded.
+    """
     return [
         model for model in models.get_models()
         if issubclass(model, ContentBase) and not model._meta.abstract
@@ -330,12 +995,7 @@ def filter_indexable_pages(queryset):
     """
     return queryset.filter(
         robots_index = True,
-        content_type__in = [
-            ContentType.objects.get_for_model(content_model)
-            for content_model
-            in get_registered_content()
-            if content_model.robots_index
-        ]
+        content_type__in = get_content_registry().indexable_content_type_ids,
     )
     
 
@@ -370,4 +1030,58 @@ class ContentBase(models.Model):
         return unicode(self.page)
     
     class Meta:
-        abstract = True
\ No newline at end of file
+        abstract = True
+
+
+# Page cache invalidation.
+
+# Apps whose models never affect the content of a page.
+PAGE_CACHE_IGNORED_APPS = ("admin", "auth", "contenttypes", "sessions", "south", "watson", "reversion", "historylinks",)
+
+
+# Whether saving each model can affect cached pages.
+_page_cache_senders = {}
+
+
+def affects_page_cache(model):
+    """
+    Checks whether saving or deleting the given model can affect any cached
+    page responses. This is the case for pages, page content, models that refer
+    to pages, and models with a URL, which can be linked to by permalinks.
+    """
+    try:
+        return _page_cache_senders[model]
+    except KeyError:
+        affects_cache = model._meta.app_label not in PAGE_CACHE_IGNORED_APPS and (
+            issubclass(model, (Page, ContentBase)) or
+            hasattr(model, "get_absolute_url") or
+            any(
+                isinstance(field, models.ForeignKey) and issubclass(field.rel.to, (Page, ContentBase))
+                for field
+                in model._meta.fields
+            )
+        )
+        _page_cache_senders[model] = affects_cache
+        return affects_cache
+
+
+def invalidate_page_cache_for_instance(sender, instance, **kwargs):
+    """
+    Invalidates the cached responses that depend on the given object, or on any
+    page that it refers to.
+    """
+    if not affects_page_cache(sender):
+        return
+    invalidate_objects(sender, (instance.pk,))
+    page_ids = [
+        getattr(instance, field.attname)
+        for field
+        in sender._meta.fields
+        if isinstance(field, models.ForeignKey) and issubclass(field.rel.to, (Page, ContentBase))
+    ]
+    page_ids = [page_id for page_id in page_ids if page_id is not None]
+    if page_ids:
+        invalidate_objects(Page, page_ids)
+        
+models.signals.post_save.connect(invalidate_page_cache_for_instance)
+models.signals.post_delete.connect(invalidate_page_cache_for_instance)
@@ -0,0 +1,169 @@
+"""
+Cached navigation fragments.
+
+Rendering a navigation list means finding the URL and title of every page in
+it, and rendering the navigation template. Both only change when the page tree
+changes, apart from which entries are marked as "here" for the current request.
+Each process therefore caches the URLs and titles of each navigation list, and
+the rendered HTML for each combination of "here" markers, keyed by the version
+of the page tree that the pages were loaded from.
+"""
+
+from __future__ import with_statement
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.template import Context
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+
+# The template used to render navigation lists.
+NAVIGATION_TEMPLATE = "pages/navigation.html"
+
+
+def get_navigation_cache_size():
+    """Returns the maximum number of navigation fragments to cache in each process."""
+    return getattr(settings, "NAVIGATION_CACHE_SIZE", 1000)
+
+
+class NavigationCache(object):
+    
+    """
+    A process-level LRU cache of navigation fragments.
+    
+    Entries are stored with the version of the page tree that they were built
+    from, and are discarded once the page tree changes.
+    """
+    
+    def __init__(self):
+        """Initializes the NavigationCache."""
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, version):
+        """Returns the cached entry for the given key and version, or raises a KeyError."""
+        with self._lock:
+            entry_version, value = self._entries.pop(key)
+            if entry_version != version:
+                raise KeyError(key)
+            self._entries[key] = (entry_version, value)
+        return value
+    
+    def set(self, key, version, value):
+        """Caches the given entry, discarding the least recently used entries."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (version, value)
+            while len(self._entries) > get_navigation_cache_size():
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """Removes all cached entries."""
+        with self._lock:
+            self._entries.clear()
+
+
+# A single, process-wide navigation cache.
+navigation_cache = NavigationCache()
+
+
+def get_page_tree_version(pages):
+    """
+    Returns the version of the page tree snapshot that all the given pages were
+    loaded from, or None if they were not all loaded from the same snapshot.
+    """
+    version = None
+    for page in pages:
+        page_loader = getattr(page, "_page_loader", None)
+        if page_loader is None:
+            return None
+        if version is None:
+            version = page_loader.page_tree.version
+        elif version != page_loader.page_tree.version:
+            return None
+    return version
+
+
+class Navigation(object):
+    
+    """
+    The entries of a navigation list, with a key identifying its pages, and
+    the version of the page tree that they were loaded from.
+    """
+    
+    def __init__(self, entries, key, version):
+        """Initializes the Navigation."""
+        self.entries = entries
+        self.key = key
+        self.version = version
+
+
+def build_navigation(request, pages, section=None, current_page=None):
+    """
+    Returns a Navigation of the given pages, starting with the section if
+    given.
+    
+    Each entry is a dictionary of the page, its URL and title, and whether it
+    is "here". A page is here if the request path is within it, apart from the
+    section, which is only here if it is the current page.
+    """
+    pages = list(pages)
+    if section:
+        pages.insert(0, section)
+    version = get_page_tree_version(pages)
+    page_ids = tuple(page.id for page in pages)
+    # Look up the URLs and titles of the pages.
+    urls_and_titles = None
+    if version is not None:
+        try:
+            urls_and_titles = navigation_cache.get(("entries", page_ids), version)
+        except KeyError:
+            pass
+    if urls_and_titles is None:
+        urls_and_titles = [
+            (page.get_absolute_url(), unicode(page))
+            for page
+            in pages
+        ]
+        if version is not None:
+            navigation_cache.set(("entries", page_ids), version, urls_and_titles)
+    # Compile the entries.
+    path = request.path
+    entries = [
+        {
+            "url": url,
+            "page": page,
+            "title": title,
+            "here": path.startswith(url),
+        }
+        for page, (url, title)
+        in zip(pages, urls_and_titles)
+    ]
+    if section:
+        entries[0]["here"] = current_page == section
+    return Navigation(entries, (bool(section),) + page_ids, version)
+
+
+def render_navigation(request, navigation, autoescape=True):
+    """
+    Renders the given Navigation using the navigation template.
+    
+    The rendered HTML is cached for each combination of "here" markers, so the
+    template should only depend on the navigation entries.
+    """
+    key = ("html", autoescape, navigation.key, tuple(entry["here"] for entry in navigation.entries))
+    if navigation.version is not None:
+        try:
+            return navigation_cache.get(key, navigation.version)
+        except KeyError:
+            pass
+    html = mark_safe(get_template(NAVIGATION_TEMPLATE).render(Context({
+        "request": request,
+        "navigation": navigation.entries,
+    }, autoescape=autoescape)))
+    if navigation.version is not None:
+        navigation_cache.set(key, navigation.version, html)
+    return html
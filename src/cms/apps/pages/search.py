@@ -0,0 +1,174 @@
+"""
+Batched search indexing for pages.
+
+Pages are indexed in batches of consecutive ids, with their content loaded
+using a single query for each content model, and their search entries written
+in bulk. Each search entry stores a fingerprint of its page, so that pages
+that have not changed since they were last indexed are skipped. Batches are
+spread over a pool of worker processes.
+"""
+
+from __future__ import with_statement
+
+import json, multiprocessing
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections, transaction
+
+from cms import externals
+from cms.models.managers import publication_manager
+from cms.apps.pages.models import Page, prefetch_page_content
+
+
+def get_search_index_workers():
+    """
+    Returns the number of worker processes used to update the page search
+    index. If zero, then the index is updated in this process.
+    """
+    return getattr(settings, "SEARCH_INDEX_WORKERS", 2)
+
+
+def get_search_index_batch_size():
+    """Returns the number of pages to index in each batch."""
+    return getattr(settings, "SEARCH_INDEX_BATCH_SIZE", 500)
+
+
+def get_page_search_engines():
+    """Returns a dictionary of the search engines that pages are registered with, keyed by slug."""
+    return dict(
+        (engine_slug, search_engine)
+        for engine_slug, search_engine
+        in externals.watson["registration.SearchEngine"].get_created_engines()
+        if search_engine.is_registered(Page)
+    )
+
+
+def iter_page_id_ranges(batch_size):
+    """
+    Yields a tuple of (min_id, max_id) for each batch of pages, where the batch
+    contains the pages with min_id < id <= max_id. The first min_id and the last
+    max_id are None, so the ranges cover every possible page id.
+    """
+    min_id = None
+    with publication_manager.select_published(False):
+        page_ids = Page._base_manager.order_by("id").values_list("id", flat=True).iterator()
+        for index, page_id in enumerate(page_ids, 1):
+            if index % batch_size == 0:
+                yield (min_id, page_id)
+                min_id = page_id
+    yield (min_id, None)
+
+
+def filter_id_range(queryset, field_name, min_id, max_id):
+    """Filters the given queryset to the objects whose named id field is in the given range."""
+    if min_id is not None:
+        queryset = queryset.filter(**{"{0}__gt".format(field_name): min_id})
+    if max_id is not None:
+        queryset = queryset.filter(**{"{0}__lte".format(field_name): max_id})
+    return queryset
+
+
+@transaction.commit_on_success
+def index_pages(engine_slug, min_id, max_id, force=False):
+    """
+    Updates the search entries of the pages with min_id < id <= max_id in the
+    named search engine, returning a tuple of (indexed, skipped, deleted).
+    
+    Pages whose fingerprint matches their search entry are skipped, unless
+    force is True. Search entries of deleted pages are removed.
+    """
+    SearchEntry = externals.watson["models.SearchEntry"]
+    adapter = get_page_search_engines()[engine_slug].get_adapter(Page)
+    content_type = ContentType.objects.get_for_model(Page)
+    # Load the pages and their content.
+    with publication_manager.select_published(False):
+        pages = list(filter_id_range(Page._base_manager.all(), "id", min_id, max_id))
+    prefetch_page_content(pages)
+    # Load the fingerprints of the existing search entries.
+    search_entries = filter_id_range(SearchEntry.objects.filter(
+        engine_slug = engine_slug,
+        content_type = content_type,
+    ), "object_id_int", min_id, max_id)
+    fingerprints = {}
+    for object_id_int, meta_encoded in search_entries.values_list("object_id_int", "meta_encoded").iterator():
+        try:
+            fingerprints[object_id_int] = json.loads(meta_encoded).get("search_fingerprint")
+        except (ValueError, AttributeError):
+            fingerprints[object_id_int] = None
+    # Build the search entries of the changed pages.
+    new_search_entries = []
+    skipped = 0
+    for page in pages:
+        try:
+            meta = adapter.get_meta(page)
+        except ObjectDoesNotExist:  # The page has no content.
+            continue
+        fingerprint = meta.get("search_fingerprint")
+        if not force and fingerprint is not None and fingerprints.get(page.id) == fingerprint:
+            skipped += 1
+            continue
+        search_entry = SearchEntry(
+            engine_slug = engine_slug,
+            content_type = content_type,
+            object_id = unicode(page.id),
+            object_id_int = page.id,
+            title = adapter.get_title(page),
+            description = adapter.get_description(page),
+            content = adapter.get_content(page),
+            url = adapter.get_url(page),
+        )
+        search_entry.meta = meta
+        new_search_entries.append(search_entry)
+    # Replace the search entries of changed and deleted pages.
+    page_ids = set(page.id for page in pages)
+    unchanged_page_ids = page_ids.difference(
+        search_entry.object_id_int
+        for search_entry
+        in new_search_entries
+    )
+    stale_search_entries = search_entries
+    if unchanged_page_ids:
+        stale_search_entries = stale_search_entries.exclude(object_id_int__in=unchanged_page_ids)
+    stale_search_entries.delete()
+    SearchEntry.objects.bulk_create(new_search_entries)
+    return (len(new_search_entries), skipped, len(set(fingerprints).difference(page_ids)))
+
+
+def index_pages_task(args):
+    """Runs index_pages() in a worker process."""
+    return index_pages(*args)
+
+
+def update_page_search_index(force=False, workers=None, batch_size=None):
+    """
+    Updates the search entries of every page in every search engine that pages
+    are registered with, yielding a tuple of (indexed, skipped, deleted) as
+    each batch is completed.
+    """
+    if workers is None:
+        workers = get_search_index_workers()
+    if batch_size is None:
+        batch_size = get_search_index_batch_size()
+    tasks = [
+        (engine_slug, min_id, max_id, force)
+        for engine_slug
+        in get_page_search_engines()
+        for min_id, max_id
+        in iter_page_id_ranges(batch_size)
+    ]
+    if not workers:
+        for task in tasks:
+            yield index_pages_task(task)
+        return
+    # The worker processes must not share this process's database connections.
+    for connection in connections.all():
+        connection.close()
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap_unordered(index_pages_task, tasks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
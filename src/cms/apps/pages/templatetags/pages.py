@@ -5,6 +5,7 @@ from django import template
 from django.utils.html import escape
 
 from cms.apps.pages.models import Page
+from cms.apps.pages.navigation import build_navigation, render_navigation
 
 
 register = template.Library()
@@ -12,43 +13,35 @@ register = template.Library()
 
 # Navigation.
 
-@register.inclusion_tag("pages/navigation.html", takes_context=True)
+@register.simple_tag(takes_context=True)
 def navigation(context, pages, section=None):
     """
     Renders a navigation list for the given pages.
     
     The pages should all be a subclass of PageBase, and possess a get_absolute_url() method.
     
-    You can also specify an alias for the navigation, at which point it will be set in the
-    context rather than rendered.
+    The rendered HTML is cached until the page tree changes, so the
+    pages/navigation.html template should only depend on the navigation
+    entries.
     """
     request = context["request"]
-    # Compile the entries.
-    def page_entry(page):
-        url = page.get_absolute_url()
-        return {
-            "url": url,
-            "page": page,
-            "title": unicode(page),
-            "here": request.path.startswith(url),
-        }
-    entries = map(page_entry, pages)
-    # Add the section.
-    if section:
-        section_entry = page_entry(section)
-        section_entry["here"] = context["pages"].current == section_entry["page"]
-        entries = [section_entry] + entries
-    # Render the template.
-    return {
-        "request": request,
-        "navigation": entries, 
-    }
+    return render_navigation(request, build_navigation(
+        request,
+        pages,
+        section,
+        section and context["pages"].current,
+    ), context.autoescape)
     
     
 @register.assignment_tag(takes_context=True)
 def get_navigation(context, pages, section=None):
     """Returns a navigation list for the given pages."""
-    return navigation(context, pages, section)["navigation"]
+    return build_navigation(
+        context["request"],
+        pages,
+        section,
+        section and context["pages"].current,
+    ).entries
 
 
 # Page linking.
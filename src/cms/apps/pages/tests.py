@@ -1,14 +1,79 @@
 """Tests for the pages app."""
 
+import os, tempfile, gzip, pickle
+from cStringIO import StringIO
+from datetime import timedelta
+
+from django.conf.urls import patterns, url
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.urlresolvers import Resolver404
+from django.http import HttpResponse, HttpResponseNotFound, Http404
+from django.template import Context, Template
+from django.test.client import RequestFactory
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.unittest import skipUnless
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import F
+from django.utils import timezone
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+
+from cms import externals, permalinks, sitemaps, thumbnails
+from cms.invalidation import run_pending_invalidations
+from cms.apps.pages.tree import PAGE_TREE_VERSION_KEY, invalidate_page_tree
+from cms.html import process, iter_process
+from cms.models import publication_manager, publication_clock, HtmlField
+from cms.models.fields import HtmlDependency
+from cms.models.managers import PublishedWhere
+from cms.templatetags.html import html as html_filter
+from cms.apps.pages.models import Page, PageManager, ContentBase, PageSitemap, get_content_resolver, get_content_registry, get_registered_content, filter_indexable_pages, get_page_search_fingerprint, affects_page_cache
+from cms.apps.pages.middleware import RequestPageManager, PageMiddleware, PageCacheMiddleware
+from cms.apps.pages import middleware
+from cms.apps.pages.views import page_dispatch
+from cms.views import sitemap_index, sitemap
+
+
+# Used by the page dispatch tests as the root urlconf.
+urlpatterns = patterns("",
+    url(r"^r/(?P<content_type_id>\d+)-(?P<object_id>[^/]+)/$", "django.contrib.contenttypes.views.shortcut", name="permalink_redirect"),
+    url(r"^sitemap-(?P<section>.+)\.xml$", sitemap, name="page_sitemap"),
+    url(r"", page_dispatch),
+)
+
+
+def render_test_page(request, slug=None):
+    """Renders the current page, raising a 404 for the missing slug."""
+    if slug == "missing":
+        raise Http404("Missing slug.")
+    return HttpResponse(u"{0} {1}".format(request.pages.current.title, slug or u""))
+
 
-from cms import externals
-from cms.apps.pages.models import Page, ContentBase
+class TestPageUrls(object):
+    
+    urlpatterns = patterns("",
+        url(r"^$", render_test_page),
+        url(r"^(?P<slug>[^/]+)/$", render_test_page),
+    )
 
 
 class TestPageContent(ContentBase):
     
+    urlconf = TestPageUrls
+    
+    class Meta:
+        app_label = "pages"
+
+
+class TestHtmlContent(ContentBase):
+    
+    content_primary = HtmlField(
+        blank = True,
+        prerender = True,
+    )
+    
     class Meta:
         app_label = "pages"
 
@@ -66,4 +131,816 @@ class PageEfficiencyTest(TestCase):
         self.assertEqual(subsubsection.title, "Subsubsection")
         with self.assertNumQueries(0):
             subsubsection = subsection.children[0]
-        self.assertEqual(subsubsection.title, "Subsubsection")
\ No newline at end of file
+        self.assertEqual(subsubsection.title, "Subsubsection")
+        
+    def testContentPrefetching(self):
+        with self.assertNumQueries(2):
+            pages = list(Page.objects.prefetch_content())
+            for page in pages:
+                self.assertEqual(page.content.page, page)
+        # Prefetching also works with chained querysets and iterators.
+        with self.assertNumQueries(2):
+            for page in Page.objects.prefetch_content().filter(parent__isnull=False).iterator():
+                self.assertEqual(page.content.page_id, page.id)
+        # Without prefetching, each page needs its own query.
+        with self.assertNumQueries(5):
+            for page in Page.objects.all():
+                page.content
+                
+    def testContentRegistry(self):
+        content_type_id = ContentType.objects.get_for_model(TestPageContent).id
+        content = get_content_registry().get_for_content_type_id(content_type_id)
+        self.assertEqual(content.model, TestPageContent)
+        self.assertEqual(content.urlconf, TestPageContent.urlconf)
+        self.assertTrue(content_type_id in get_content_registry().indexable_content_type_ids)
+        # Listing the content models does not need the database.
+        with self.assertNumQueries(0):
+            self.assertTrue(TestPageContent in get_registered_content())
+        # The registry is only built once.
+        with self.assertNumQueries(1):
+            self.assertEqual(len(filter_indexable_pages(Page.objects.all())), 4)
+    
+    def testSearchFingerprint(self):
+        get_fingerprint = lambda page: get_page_search_fingerprint(Page._base_manager.get(id=page.id))
+        fingerprint = get_fingerprint(self.subsubsection)
+        # Moving the page within the tree doesn't change the fingerprint.
+        Page._base_manager.update(left=F("left") + 10, right=F("right") + 10)
+        self.assertEqual(get_fingerprint(self.subsubsection), fingerprint)
+        # Changing the publication of an ancestor does.
+        self.section.is_online = False
+        self.section.save()
+        self.assertNotEqual(get_fingerprint(self.subsubsection), fingerprint)
+        fingerprint = get_fingerprint(self.subsubsection)
+        # Changing the URL of an ancestor does.
+        self.subsection.url_title = "renamed"
+        self.subsection.save()
+        self.assertNotEqual(get_fingerprint(self.subsubsection), fingerprint)
+    
+    @skipUnless(externals.watson, "django-watson is not installed.")
+    def testIncrementalSearchIndex(self):
+        from cms.apps.pages.search import update_page_search_index
+        SearchEntry = externals.watson["models.SearchEntry"]
+        SearchEntry.objects.all().delete()
+        update_index = lambda: tuple(map(sum, zip(*update_page_search_index(workers=0, batch_size=3))))
+        # Every page is indexed the first time.
+        self.assertEqual(update_index(), (4, 0, 0))
+        self.assertEqual(SearchEntry.objects.count(), 4)
+        # Only changed pages are indexed again.
+        self.assertEqual(update_index(), (0, 4, 0))
+        Page._base_manager.filter(id=self.subsubsection.id).update(title="Changed")
+        self.assertEqual(update_index(), (1, 3, 0))
+        self.assertEqual(SearchEntry.objects.get(object_id_int=self.subsubsection.id).title, "Changed")
+        # Entries for deleted pages are removed.
+        Page._base_manager.filter(id=self.subsubsection.id).delete()
+        self.assertEqual(update_index(), (0, 3, 1))
+        self.assertEqual(SearchEntry.objects.count(), 3)
+
+
+class PageTreeTest(TestCase):
+    
+    def setUp(self):
+        content_type = ContentType.objects.get_for_model(TestPageContent)
+        self.homepage = Page.objects.create(
+            title = "Homepage",
+            url_title = "homepage",
+            content_type = content_type,
+        )
+        self.section = Page.objects.create(
+            parent = self.homepage,
+            title = "Section",
+            url_title = "section",
+            content_type = content_type,
+        )
+        self.subsection = Page.objects.create(
+            parent = self.section,
+            title = "Subsection",
+            url_title = "subsection",
+            content_type = content_type,
+        )
+        self.offline_section = Page.objects.create(
+            parent = self.homepage,
+            title = "Offline section",
+            url_title = "offline-section",
+            content_type = content_type,
+            is_online = False,
+        )
+        
+    def testRequestPagesUseTree(self):
+        Page.objects.get_tree()
+        with self.assertNumQueries(0):
+            request_pages = RequestPageManager("/section/subsection/foo/", "/section/subsection/foo/")
+            self.assertEqual(request_pages.homepage, self.homepage)
+            self.assertEqual(request_pages.breadcrumbs, [self.homepage, self.section, self.subsection])
+            self.assertEqual(request_pages.section, self.section)
+            self.assertEqual(request_pages.subsection, self.subsection)
+            self.assertEqual(request_pages.homepage.navigation, [self.section, self.offline_section])
+    
+    def testPathMatching(self):
+        page_tree = Page.objects.get_tree()
+        self.assertEqual(page_tree.match_path("/"), self.homepage.id)
+        self.assertEqual(page_tree.match_path("/section"), self.section.id)
+        self.assertEqual(page_tree.match_path("/section/subsection/"), self.subsection.id)
+        self.assertEqual(page_tree.match_path("/section/foo/subsection/"), self.section.id)
+        self.assertEqual(page_tree.match_path("/subsection/"), self.homepage.id)
+        
+    def testAbsoluteUrlsUseTree(self):
+        subsection = Page.objects.get(id=self.subsection.id)
+        Page.objects.get_tree()
+        with self.assertNumQueries(0):
+            self.assertEqual(subsection.get_absolute_url(), "/section/subsection/")
+        # Unsaved changes to the page should be respected.
+        subsection.url_title = "subsection-renamed"
+        self.assertEqual(subsection.get_absolute_url(), "/section/subsection-renamed/")
+        # Saving the page should update the URL of its descendants.
+        self.section.url_title = "section-renamed"
+        self.section.save()
+        Page.objects.get_tree()
+        with self.assertNumQueries(0):
+            self.assertEqual(Page.objects.get_tree().create_page(self.subsection.id).get_absolute_url(), "/section-renamed/subsection/")
+        
+    def testTreeRespectsPublication(self):
+        with publication_manager.select_published(True):
+            request_pages = RequestPageManager("/offline-section/", "/offline-section/")
+            self.assertEqual(request_pages.homepage.navigation, [self.section])
+            self.assertEqual(request_pages.current, self.homepage)
+        
+    def testNavigationIsCached(self):
+        template = Template("{% load pages %}{% navigation pages.homepage.navigation section=pages.homepage %}")
+        def render_navigation(path):
+            request = RequestFactory().get(path)
+            request.pages = RequestPageManager(path, path)
+            return template.render(Context({"request": request, "pages": request.pages}))
+        with publication_manager.select_published(True):
+            html = render_navigation("/section/subsection/")
+            self.assertTrue(u'<a class="here" href="/section/">Section</a>' in html)
+            self.assertTrue(u'<a href="/">Homepage</a>' in html)
+            # Rendering the same navigation for another request doesn't render the template.
+            with self.assertNumQueries(0):
+                self.assertEqual(render_navigation("/section/"), html)
+            # The "here" markers still vary with the request.
+            html = render_navigation("/")
+            self.assertTrue(u'<a class="here" href="/">Homepage</a>' in html)
+            self.assertTrue(u'<a href="/section/">Section</a>' in html)
+        # Changing the page tree renders the navigation again.
+        self.section.short_title = "Renamed"
+        self.section.save()
+        with publication_manager.select_published(True):
+            self.assertTrue(u'<a href="/section/">Renamed</a>' in render_navigation("/"))
+        
+    def testSelectPublishedUsesAncestors(self):
+        with publication_manager.select_published(True):
+            self.assertEqual(list(Page.objects.all()), [self.homepage, self.section, self.subsection])
+        # Moving a page into an offline section should hide it.
+        self.subsection.parent = self.offline_section
+        self.subsection.save()
+        with publication_manager.select_published(True):
+            self.assertEqual(list(Page.objects.all()), [self.homepage, self.section])
+        # Publication dates of ancestors should also be respected.
+        self.subsection.parent = self.section
+        self.subsection.save()
+        self.section.publication_date = timezone.now() + timedelta(days=1)
+        self.section.save()
+        self.assertEqual(Page.objects.get(id=self.subsection.id).effective_publication_date, self.section.publication_date)
+        with publication_manager.select_published(True):
+            self.assertEqual(list(Page.objects.all()), [self.homepage])
+    
+    def testPublishedSqlMatchesSelectPublished(self):
+        self.section.publication_date = timezone.now() + timedelta(days=1)
+        self.section.save()
+        with publication_manager.select_published(True):
+            queryset = Page.objects.all()
+            self.assertTrue(isinstance(queryset.query.where.children[-1], PublishedWhere))
+            self.assertEqual(list(queryset), list(Page.objects.select_published(Page._base_manager.all())))
+            self.assertEqual(list(queryset), [self.homepage])
+            # Managers that only override select_published() don't use the precompiled SQL.
+            class OnlineOnlyPageManager(PageManager):
+                def select_published(self, queryset):
+                    return queryset.filter(is_online=True)
+            manager = OnlineOnlyPageManager()
+            manager.model = Page
+            self.assertEqual(list(manager.all()), [self.homepage, self.section, self.subsection])
+        # The precompiled SQL can be used in subqueries.
+        self.assertEqual(list(Page.objects.filter(parent__in=queryset)), [self.section, self.offline_section])
+        
+    def testPublishedQuerysetsCanBePickled(self):
+        with publication_manager.select_published(True):
+            queryset = pickle.loads(pickle.dumps(self.homepage.child_set.all()))
+            self.assertEqual(list(queryset), [self.section])
+            homepage = pickle.loads(pickle.dumps(Page.objects.get_homepage()))
+            self.assertEqual(list(homepage.child_set.all()), [self.section])
+        
+    def testTreeIsRebuiltOnSave(self):
+        page_tree = Page.objects.get_tree()
+        self.assertTrue(Page.objects.get_tree() is page_tree)
+        self.subsection.title = "Subsection changed"
+        self.subsection.save()
+        page_tree = Page.objects.get_tree()
+        self.assertTrue(Page.objects.get_tree() is page_tree)
+        self.assertEqual(page_tree.create_page(self.subsection.id).title, "Subsection changed")
+        offline_section_id = self.offline_section.id
+        self.offline_section.delete()
+        self.assertFalse(offline_section_id in Page.objects.get_tree())
+    
+    def testTreeExpiresWithProcessLocalCache(self):
+        page_tree = Page.objects.get_tree()
+        # Another process changes the tree, but can't bump the version held by this one.
+        Page.objects.filter(id=self.subsection.id).update(title="Subsection changed")
+        with override_settings(PAGE_TREE_MAX_AGE=60):
+            self.assertTrue(Page.objects.get_tree() is page_tree)
+        with override_settings(PAGE_TREE_MAX_AGE=0):
+            page_tree = Page.objects.get_tree()
+        self.assertEqual(page_tree.create_page(self.subsection.id).title, "Subsection changed")
+        # The test cache is process-local, so snapshots expire by default.
+        page_tree.loaded_at -= 60
+        self.assertFalse(Page.objects.get_tree() is page_tree)
+    
+    def testTreeIsInvalidatedAgainAfterTransaction(self):
+        # Tests run inside a managed transaction, so the save is not yet committed.
+        self.subsection.save()
+        # Another process loads the uncommitted tree under the new version.
+        cache.set(PAGE_TREE_VERSION_KEY, "stale")
+        run_pending_invalidations()
+        self.assertNotEqual(cache.get(PAGE_TREE_VERSION_KEY), "stale")
+        # Invalidations are only repeated once.
+        cache.set(PAGE_TREE_VERSION_KEY, "committed")
+        run_pending_invalidations()
+        self.assertEqual(cache.get(PAGE_TREE_VERSION_KEY), "committed")
+
+
+class PageTreeMaintenanceTest(TestCase):
+    
+    def createPage(self, url_title, parent=None):
+        page = Page(
+            parent = parent,
+            title = url_title,
+            url_title = url_title,
+            content_type = ContentType.objects.get_for_model(TestPageContent),
+        )
+        page.save()
+        return page
+        
+    def assertTreeValid(self, contiguous):
+        pages = dict((page["id"], page) for page in Page._base_manager.values("id", "parent_id", "left", "right"))
+        children = {}
+        for page in pages.itervalues():
+            self.assertTrue(page["left"] < page["right"])
+            if page["parent_id"] is not None:
+                parent = pages[page["parent_id"]]
+                self.assertTrue(parent["left"] < page["left"] and page["right"] < parent["right"])
+                children.setdefault(page["parent_id"], []).append(page)
+        for siblings in children.itervalues():
+            siblings.sort(key=lambda page: page["left"])
+            for first_page, second_page in zip(siblings, siblings[1:]):
+                self.assertTrue(first_page["right"] < second_page["left"])
+        if contiguous:
+            values = sorted([page["left"] for page in pages.itervalues()] + [page["right"] for page in pages.itervalues()])
+            self.assertEqual(values, range(1, len(pages) * 2 + 1))
+    
+    def runTreeChanges(self, contiguous):
+        homepage = self.createPage("homepage")
+        section_a = self.createPage("a", homepage)
+        section_b = self.createPage("b", homepage)
+        section_a1 = self.createPage("a1", section_a)
+        self.createPage("a2", section_a)
+        section_b1 = self.createPage("b1", section_b)
+        self.assertTreeValid(contiguous)
+        # Move a branch forward.
+        section_a.parent = section_b
+        section_a.save()
+        self.assertTreeValid(contiguous)
+        # Move a branch back.
+        section_a1.parent = homepage
+        section_a1.save()
+        self.assertTreeValid(contiguous)
+        # Swap two siblings.
+        section_b = Page.objects.get(id=section_b.id)
+        section_a1 = Page.objects.get(id=section_a1.id)
+        Page.objects.move_branch(section_a1.left, section_a1.right, section_b.left)
+        self.assertEqual(list(Page.objects.filter(parent=homepage).values_list("url_title", flat=True)), ["a1", "b"])
+        self.assertTreeValid(contiguous)
+        # Delete a branch.
+        section_b1.delete()
+        self.assertTreeValid(contiguous)
+        self.assertEqual(
+            list(Page.objects.values_list("url_title", flat=True)),
+            ["homepage", "a1", "b", "a", "a2"],
+        )
+        
+    def testContiguousTree(self):
+        self.runTreeChanges(True)
+        
+    @override_settings(PAGE_TREE_SPACING=10)
+    def testSpacedTree(self):
+        self.runTreeChanges(False)
+        
+    @override_settings(PAGE_TREE_SPACING=10)
+    def testSpacedTreeInsertsWithoutRenumbering(self):
+        homepage = self.createPage("homepage")
+        self.createPage("a", homepage)
+        homepage_right = Page.objects.get(id=homepage.id).right
+        for url_title in ("b", "c", "d"):
+            self.createPage(url_title, homepage)
+        self.assertEqual(Page.objects.get(id=homepage.id).right, homepage_right)
+        self.assertTreeValid(False)
+        
+    def testOnlyStructuralChangesLockTree(self):
+        tree_locks = []
+        original_lock_tree = PageManager.lock_tree
+        PageManager.lock_tree = lambda manager: tree_locks.append(True)
+        try:
+            homepage = self.createPage("homepage")
+            section = self.createPage("section", homepage)
+            subsection = self.createPage("subsection", section)
+            self.assertEqual(len(tree_locks), 3)
+            # Renaming a page, or changing its publication settings, doesn't move anything.
+            section.title = "Section renamed"
+            section.is_online = False
+            section.save()
+            self.assertEqual(len(tree_locks), 3)
+            # Moving a page does.
+            subsection.parent = homepage
+            subsection.save()
+            self.assertEqual(len(tree_locks), 4)
+            # Saving a stale copy of a moved page moves it back.
+            stale_subsection = Page.objects.get(id=subsection.id)
+            subsection.parent = section
+            subsection.save()
+            self.assertEqual(len(tree_locks), 5)
+            stale_subsection.save()
+            self.assertEqual(len(tree_locks), 6)
+            self.assertEqual(Page.objects.get(id=subsection.id).parent_id, homepage.id)
+            section.delete()
+            self.assertEqual(len(tree_locks), 7)
+        finally:
+            PageManager.lock_tree = original_lock_tree
+        self.assertTreeValid(True)
+        
+    def testBulkImport(self):
+        content_type = ContentType.objects.get_for_model(TestPageContent)
+        homepage = self.createPage("homepage")
+        section = self.createPage("section", homepage)
+        pages = []
+        contents = []
+        for index in xrange(50):
+            page = Page(
+                parent = homepage if index < 25 else pages[index - 25],
+                title = "Page {0}".format(index),
+                url_title = "page-{0}".format(index),
+                content_type = content_type,
+                is_online = index != 0,
+            )
+            pages.append(page)
+            contents.append(TestPageContent(page=page))
+        # Also move an existing page under one of the new pages.
+        section.parent = pages[0]
+        pages.append(section)
+        # The number of queries depends only on the depth of the new pages, plus one to lock the
+        # tree, and two to discard pre-rendered HTML linking below the moved pages.
+        with self.assertNumQueries(13):
+            Page.objects.bulk_import(pages, contents)
+        self.assertTreeValid(True)
+        self.assertEqual(TestPageContent.objects.count(), 50)
+        self.assertEqual(Page.objects.get(id=pages[25].id).parent_id, pages[0].id)
+        self.assertEqual(Page.objects.get(id=section.id).parent_id, pages[0].id)
+        self.assertEqual(list(Page.objects.filter(parent=pages[0]).values_list("url_title", flat=True)), ["page-25", "section"])
+        # Publication settings are combined with those of the new parents.
+        with publication_manager.select_published(True):
+            self.assertFalse(Page.objects.filter(id__in=(pages[25].id, section.id)).exists())
+            self.assertEqual(Page.objects.count(), 49)
+        
+    def testImportCommand(self):
+        homepage = self.createPage("homepage")
+        self.createPage("section", homepage)
+        handle, filename = tempfile.mkstemp(suffix=".csv")
+        try:
+            with os.fdopen(handle, "wb") as import_file:
+                import_file.write(
+                    "path,move_from,content_type,title,in_navigation\n"
+                    "/news/,,pages.testpagecontent,News,\n"
+                    "/news/2012/,,pages.testpagecontent,2012,0\n"
+                    "/news/section/,/section/,,,\n"
+                )
+            call_command("import_pages", filename, verbosity=0, batch_size=1)
+        finally:
+            os.remove(filename)
+        self.assertTreeValid(True)
+        self.assertEqual(
+            list(Page.objects.values_list("url_title", "in_navigation")),
+            [("homepage", True), ("news", True), ("2012", False), ("section", True)],
+        )
+        self.assertEqual(Page.objects.get(url_title="section").get_absolute_url(), "/news/section/")
+
+
+class TestPageSitemap(PageSitemap):
+    
+    limit = 2
+    
+    batch_size = 1
+
+
+class PageSitemapTest(TestCase):
+    
+    urls = "cms.apps.pages.tests"
+    
+    def setUp(self):
+        content_type = ContentType.objects.get_for_model(TestPageContent)
+        self.homepage = Page.objects.create(
+            title = "Homepage",
+            content_type = content_type,
+        )
+        self.pages = [self.homepage]
+        for url_title in ("a", "b", "c", "d"):
+            self.pages.append(Page.objects.create(
+                parent = self.homepage,
+                title = url_title.upper(),
+                url_title = url_title,
+                content_type = content_type,
+            ))
+        self.sitemaps = {"pages-page": TestPageSitemap}
+        self.factory = RequestFactory()
+    
+    def tearDown(self):
+        for shard in (1, 2, 3):
+            default_storage.delete(sitemaps.get_prebuilt_sitemap_name("pages-page", shard))
+    
+    def testShardedUrls(self):
+        sitemap = TestPageSitemap()
+        self.assertEqual(sitemap.get_shard_count(), 3)
+        locations = [
+            url["location"]
+            for shard in (1, 2, 3)
+            for url in sitemap.iter_urls(shard, "www.example.com", "http")
+        ]
+        self.assertEqual(locations, [
+            u"http://www.example.com" + page.get_absolute_url()
+            for page in self.pages
+        ])
+    
+    def testSitemapViews(self):
+        content = "".join(sitemap_index(self.factory.get("/sitemap.xml"), self.sitemaps, sitemap_url_name="page_sitemap"))
+        self.assertEqual(content.count("<sitemap>"), 3)
+        self.assertTrue("http://testserver/sitemap-pages-page.xml?p=3" in content)
+        content = "".join(sitemap(self.factory.get("/sitemap-pages-page.xml", {"p": 2}), self.sitemaps, "pages-page"))
+        self.assertEqual(content.count("<url>"), 2)
+        self.assertTrue("<loc>http://testserver/b/</loc>" in content)
+        self.assertRaises(Http404, lambda: sitemap(self.factory.get("/sitemap-pages-page.xml", {"p": 4}), self.sitemaps, "pages-page"))
+    
+    def testStreamedSitemapsArePublished(self):
+        self.pages[2].is_online = False
+        self.pages[2].save()
+        # The response is streamed after the publication middleware has finished.
+        with publication_manager.select_published(True):
+            index_response = sitemap_index(self.factory.get("/sitemap.xml"), self.sitemaps, sitemap_url_name="page_sitemap")
+            response = sitemap(self.factory.get("/sitemap-pages-page.xml", {"p": 2}), self.sitemaps, "pages-page")
+        self.assertEqual("".join(index_response).count("<sitemap>"), 2)
+        content = "".join(response)
+        self.assertEqual(content.count("<url>"), 2)
+        self.assertFalse("<loc>http://testserver/b/</loc>" in content)
+    
+    def testPrebuiltSitemaps(self):
+        def get_response():
+            return sitemap(self.factory.get("/sitemap-pages-page.xml", HTTP_ACCEPT_ENCODING="gzip"), self.sitemaps, "pages-page")
+        self.assertEqual(sitemaps.build_sitemap("pages-page", TestPageSitemap(), "testserver", "http"), 3)
+        response = get_response()
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        content = gzip.GzipFile(fileobj=StringIO("".join(response))).read()
+        self.assertEqual(content.count("<url>"), 2)
+        # Changing a page makes the pre-built files out of date.
+        self.pages[1].title = "New A"
+        self.pages[1].save()
+        self.assertFalse(get_response().has_header("Content-Encoding"))
+        # So does changing the page tree without saving a page.
+        sitemaps.build_sitemap("pages-page", TestPageSitemap(), "testserver", "http")
+        self.assertTrue(get_response().has_header("Content-Encoding"))
+        Page._base_manager.filter(pk=self.pages[1].pk).update(url_title="new-a")
+        invalidate_page_tree()
+        self.assertFalse(get_response().has_header("Content-Encoding"))
+        # So does the publication of a scheduled page.
+        Page.objects.create(
+            parent = self.homepage,
+            title = "E",
+            url_title = "e",
+            content_type = ContentType.objects.get_for_model(TestPageContent),
+            publication_date = timezone.now() + timedelta(days=1),
+        )
+        sitemaps.build_sitemap("pages-page", TestPageSitemap(), "testserver", "http")
+        self.assertTrue(get_response().has_header("Content-Encoding"))
+        original_now = timezone.now
+        timezone.now = lambda: original_now() + timedelta(days=2)
+        try:
+            self.assertFalse(get_response().has_header("Content-Encoding"))
+        finally:
+            timezone.now = original_now
+        
+        
+@override_settings(PAGE_CACHE_ALLOW_LOCAL_CACHE=True)
+class PageCacheTest(TestCase):
+    
+    def setUp(self):
+        content_type = ContentType.objects.get_for_model(TestPageContent)
+        self.homepage = Page.objects.create(
+            title = "Homepage",
+            url_title = "homepage",
+            content_type = content_type,
+        )
+        self.section = Page.objects.create(
+            parent = self.homepage,
+            title = "Section",
+            url_title = "section",
+            content_type = content_type,
+        )
+        self.other_section = Page.objects.create(
+            parent = self.homepage,
+            title = "Other section",
+            url_title = "other-section",
+            content_type = content_type,
+        )
+        self.middleware = PageCacheMiddleware()
+        self.render_count = 0
+        
+    def getResponse(self, path, preview=False, user=None, vary=None, thumbnail_pending=False, **extra):
+        """Runs a request through the middleware, returning the response content."""
+        request = RequestFactory().get(path, **extra)
+        request.user = user or AnonymousUser()
+        request.pages = RequestPageManager(request.path, request.path_info)
+        with publication_manager.select_published(not preview):
+            response = self.middleware.process_request(request)
+            if response is None:
+                request.pages.is_dispatched = True
+                response = HttpResponse(request.pages.current.title)
+                if thumbnail_pending:
+                    thumbnails.thumbnail_pending.send(sender=Page, file=None)
+                if vary:
+                    response["Vary"] = vary
+                self.render_count += 1
+                response = self.middleware.process_response(request, response)
+        return response.content
+    
+    def testResponsesAreCached(self):
+        self.getResponse("/section/")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.getResponse("/section/"), "Section")
+        self.assertEqual(self.render_count, 1)
+        # Preview mode bypasses the cache.
+        self.getResponse("/section/", preview=True)
+        self.assertEqual(self.render_count, 2)
+        
+    def testResponsesVaryByHostAndUser(self):
+        self.getResponse("/section/")
+        self.getResponse("/section/", HTTP_HOST="other.example.com")
+        self.assertEqual(self.render_count, 2)
+        # Responses to authenticated users are never cached.
+        user = User.objects.create(username="staff", is_staff=True)
+        self.getResponse("/section/", user=user)
+        self.getResponse("/section/", user=user)
+        self.assertEqual(self.render_count, 4)
+        # Responses that vary on request headers are never cached.
+        self.getResponse("/other-section/", vary="Accept-Encoding", HTTP_ACCEPT_ENCODING="gzip")
+        self.getResponse("/other-section/", vary="Accept-Encoding")
+        self.assertEqual(self.render_count, 6)
+    
+    def testPendingThumbnailsAreNotCached(self):
+        self.getResponse("/section/", thumbnail_pending=True)
+        self.getResponse("/section/")
+        self.assertEqual(self.render_count, 2)
+        self.getResponse("/section/")
+        self.assertEqual(self.render_count, 2)
+    
+    def testProcessLocalCacheDisablesMiddleware(self):
+        # The test cache is process-local.
+        with override_settings(PAGE_CACHE_ALLOW_LOCAL_CACHE=False):
+            self.assertRaises(MiddlewareNotUsed, PageCacheMiddleware)
+    
+    def testIrrelevantModelsDoNotInvalidateCache(self):
+        self.assertFalse(affects_page_cache(User))
+        self.assertTrue(affects_page_cache(Page))
+        self.assertTrue(affects_page_cache(TestPageContent))
+        
+    def testSavingPageInvalidatesCache(self):
+        subsection = Page.objects.create(
+            parent = self.section,
+            title = "Subsection",
+            url_title = "subsection",
+            content_type = ContentType.objects.get_for_model(TestPageContent),
+        )
+        self.getResponse("/section/")
+        self.getResponse("/other-section/")
+        self.assertEqual(self.render_count, 2)
+        # Changing a page invalidates its parent, whose navigation has changed.
+        subsection.title = "New subsection"
+        subsection.save()
+        self.getResponse("/section/")
+        self.assertEqual(self.render_count, 3)
+        # Pages in other sections are not affected.
+        self.getResponse("/other-section/")
+        self.assertEqual(self.render_count, 3)
+        # Changing an ancestor changes the navigation of its descendants.
+        self.homepage.save()
+        self.getResponse("/other-section/")
+        self.assertEqual(self.render_count, 4)
+        
+    def testSavingContentInvalidatesCache(self):
+        self.getResponse("/section/")
+        TestPageContent.objects.create(page=self.section)
+        self.getResponse("/section/")
+        self.assertEqual(self.render_count, 2)
+        
+    @override_settings(PUBLICATION_CLOCK_RESOLUTION=0)
+    def testCacheExpiresAtPublicationChange(self):
+        self.other_section.publication_date = timezone.now() + timedelta(seconds=30)
+        self.other_section.save()
+        timeout = self.middleware.get_timeout()
+        self.assertTrue(0 < timeout <= 30)
+    
+    @override_settings(PUBLICATION_CLOCK_RESOLUTION=60)
+    def testCacheExpiresAtPublicationClockTick(self):
+        self.other_section.publication_date = timezone.now() + timedelta(seconds=30)
+        self.other_section.save()
+        before = timezone.now()
+        timeout = self.middleware.get_timeout()
+        after = timezone.now()
+        # The cache expires at the first tick of the clock after the publication date.
+        effective_date = publication_clock.get_effective_date(self.other_section.publication_date)
+        self.assertEqual((effective_date.second, effective_date.microsecond), (0, 0))
+        self.assertTrue(int((effective_date - after).total_seconds()) <= timeout <= int((effective_date - before).total_seconds()))
+        self.assertTrue(0 < timeout <= 90)
+
+
+@override_settings(MIDDLEWARE_CLASSES=(
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "cms.middleware.PublicationMiddleware",
+    "cms.apps.pages.middleware.PageMiddleware",
+), APPEND_SLASH=True)
+class PageDispatchTest(TestCase):
+    
+    urls = "cms.apps.pages.tests"
+    
+    def setUp(self):
+        content_type = ContentType.objects.get_for_model(TestPageContent)
+        self.homepage = Page.objects.create(
+            title = "Homepage",
+            url_title = "homepage",
+            content_type = content_type,
+        )
+        self.section = Page.objects.create(
+            parent = self.homepage,
+            title = "Section",
+            url_title = "section",
+            content_type = content_type,
+        )
+        
+    def testCatchAllDispatch(self):
+        self.assertEqual(self.client.get("/section/").content, "Section ")
+        self.assertEqual(self.client.get("/section/foo/").content, "Section foo")
+        self.assertRedirects(self.client.get("/section/foo"), "/section/foo/", target_status_code=200)
+        self.assertEqual(self.client.get("/section/foo/bar/").status_code, 404)
+        self.assertEqual(self.client.get("/section/missing/").status_code, 404)
+        # Slashes are still appended to URLs matched by other URL patterns.
+        self.assertRedirects(self.client.get("/r/1-1", {"foo": "bar"}), "/r/1-1/?foo=bar", target_status_code=404)
+        self.assertEqual(self.client.get("/section/foo/bar").status_code, 404)
+        
+    def testContentResolversAreCached(self):
+        Page.objects.get_tree()
+        get_content_resolver(self.section.content_type_id)
+        with self.assertNumQueries(0):
+            content_cls, resolver = get_content_resolver(self.section.content_type_id)
+            self.assertEqual(resolver.resolve("/foo/").kwargs, {"slug": "foo"})
+            self.assertEqual(self.section.reverse(render_test_page, kwargs={"slug": "foo"}), "/section/foo/")
+        self.assertEqual(content_cls, TestPageContent)
+        
+    def testMiddlewareDispatch(self):
+        def get_response(path):
+            request = RequestFactory().get(path)
+            PageMiddleware().process_request(request)
+            with publication_manager.select_published(True):
+                return PageMiddleware().process_response(request, HttpResponseNotFound())
+        self.assertEqual(get_response("/section/foo/").content, "Section foo")
+        self.assertEqual(get_response("/section/foo/bar/").status_code, 404)
+        self.assertEqual(get_response("/section/missing/").status_code, 404)
+        # Responses that were already dispatched are not dispatched again.
+        request = RequestFactory().get("/section/")
+        PageMiddleware().process_request(request)
+        request.pages.is_dispatched = True
+        self.assertEqual(PageMiddleware().process_response(request, HttpResponseNotFound()).content, "")
+    
+    def testCatchAllMissIsNotDispatchedAgain(self):
+        request = RequestFactory().get("/section/foo/bar/")
+        PageMiddleware().process_request(request)
+        with publication_manager.select_published(True):
+            self.assertRaises(Resolver404, lambda: page_dispatch(request))
+            self.assertFalse(request.pages.is_dispatched)
+            # The middleware should not try to dispatch the request again.
+            def fail_dispatch(request):
+                raise AssertionError("The request was dispatched twice.")
+            original_page_dispatch = middleware.page_dispatch
+            middleware.page_dispatch = fail_dispatch
+            try:
+                self.assertEqual(PageMiddleware().process_response(request, HttpResponseNotFound("Missing")).content, "Missing")
+            finally:
+                middleware.page_dispatch = original_page_dispatch
+
+
+class PermalinkTest(TestCase):
+    
+    urls = "cms.apps.pages.tests"
+    
+    def setUp(self):
+        content_type = ContentType.objects.get_for_model(TestPageContent)
+        self.homepage = Page.objects.create(
+            title = "Homepage",
+            url_title = "homepage",
+            content_type = content_type,
+        )
+        self.section = Page.objects.create(
+            parent = self.homepage,
+            title = "Section",
+            url_title = "section",
+            content_type = content_type,
+        )
+        self.permalink = permalinks.create(self.section)
+        
+    def testParse(self):
+        self.assertEqual(permalinks.parse(self.permalink), (ContentType.objects.get_for_model(Page).id, unicode(self.section.id)))
+        self.assertRaises(permalinks.PermalinkError, lambda: permalinks.parse("/section/"))
+        self.assertEqual(permalinks.resolve(self.permalink), self.section)
+        
+    def testProcess(self):
+        html = u'<a href="{0}">Section</a> <a href="{0}" title="Foo">Again</a> <a href="/r/1-999/">Missing</a>'.format(self.permalink)
+        expected_html = u'<a href="/section/" title="Section">Section</a> <a href="/section/" title="Foo">Again</a> <a href="/r/1-999/">Missing</a>'
+        self.assertEqual(process(html), expected_html)
+        # Resolved permalinks are cached.
+        with self.assertNumQueries(0):
+            self.assertEqual(process(html), expected_html)
+        # Saving the object invalidates the cache.
+        self.section.url_title = "new-section"
+        self.section.title = "New section"
+        self.section.save()
+        self.assertEqual(process(html).split(u" <a")[0], u'<a href="/new-section/" title="New section">Section</a>')
+        
+    def testProcessFollowsPageTree(self):
+        html = u'<a href="{0}">Section</a>'.format(self.permalink)
+        self.assertEqual(process(html), u'<a href="/section/" title="Section">Section</a>')
+        # Saving models without URLs leaves the cache alone.
+        User.objects.create(username="user")
+        with self.assertNumQueries(0):
+            process(html)
+        # Changing the page tree without saving the page invalidates the cache.
+        Page._base_manager.filter(pk=self.section.pk).update(url_title="moved-section")
+        invalidate_page_tree()
+        self.assertEqual(process(html), u'<a href="/moved-section/" title="Section">Section</a>')
+        
+    def testProcessLeavesOtherTextUntouched(self):
+        html = u"""<p class = 'intro'><A  HREF='{0}' Class=link >Section</A><br/><a href="/other/">Other</a><img src="{0}"/></p>""".format(self.permalink)
+        expected_html = u"""<p class = 'intro'><A  HREF="/section/" Class=link title="Section" >Section</A><br/><a href="/other/">Other</a><img src="/section/" title="Section"/></p>"""
+        self.assertEqual(process(html), expected_html)
+        self.assertEqual(u"".join(iter_process(html)), expected_html)
+        # Text without permalinks is returned as-is.
+        html = u'<a href="/other/">Other</a>'
+        self.assertTrue(process(html) is html)
+        
+    def testPrerenderedHtml(self):
+        html = u'<a href="{0}">Section</a>'.format(self.permalink)
+        content = TestHtmlContent.objects.create(
+            page = self.homepage,
+            content_primary = html,
+        )
+        content = TestHtmlContent.objects.get(pk=content.pk)
+        self.assertEqual(content.content_primary, html)
+        self.assertEqual(content.content_primary.rendered, u'<a href="/section/" title="Section">Section</a>')
+        self.assertEqual(content.content_primary.dependencies, [(ContentType.objects.get_for_model(Page).id, unicode(self.section.id))])
+        # The stored HTML is used by the template filter.
+        with publication_manager.select_published(True):
+            with self.assertNumQueries(0):
+                self.assertEqual(html_filter(content.content_primary), content.content_primary.rendered)
+        # Saving a linked object discards the stored HTML.
+        self.section.url_title = "new-section"
+        self.section.save()
+        content = TestHtmlContent.objects.get(pk=content.pk)
+        self.assertEqual(content.content_primary.rendered, None)
+        with publication_manager.select_published(True):
+            self.assertEqual(html_filter(content.content_primary), u'<a href="/new-section/" title="Section">Section</a>')
+        # The command renders it again.
+        call_command("prerender_html", verbosity=0)
+        content = TestHtmlContent.objects.get(pk=content.pk)
+        self.assertEqual(content.content_primary.rendered, u'<a href="/new-section/" title="Section">Section</a>')
+        # Renaming an ancestor of a linked page discards the stored HTML.
+        subsection = Page.objects.create(
+            parent = self.section,
+            title = "Subsection",
+            url_title = "subsection",
+            content_type = ContentType.objects.get_for_model(TestPageContent),
+        )
+        content.content_primary = u'<a href="{0}">Subsection</a>'.format(permalinks.create(subsection))
+        content.save()
+        self.assertEqual(HtmlDependency.objects.get(object_id=content.pk).dependency_object_id, unicode(subsection.id))
+        self.assertEqual(TestHtmlContent.objects.get(pk=content.pk).content_primary.rendered, u'<a href="/new-section/subsection/" title="Subsection">Subsection</a>')
+        self.section.url_title = "section"
+        self.section.save()
+        content = TestHtmlContent.objects.get(pk=content.pk)
+        self.assertEqual(content.content_primary.rendered, None)
+        # Links that cannot be resolved are not stored.
+        content.content_primary = u'<a href="/r/1-999/">Missing</a>'
+        self.assertEqual(content.content_primary.rendered, None)
+        content.save()
+        self.assertEqual(TestHtmlContent.objects.get(pk=content.pk).content_primary.rendered, None)
@@ -0,0 +1,304 @@
+"""
+In-memory snapshots of the page tree.
+
+Loading the page tree from the database one level at a time costs a query per
+level of the URL being routed. Instead, each process holds an immutable
+snapshot of the entire tree, which is shared between requests and rebuilt only
+when the tree version changes.
+
+The tree version is shared between processes using the default cache. If the
+default cache is process-local, other processes cannot see the version change,
+so snapshots are also reloaded once they are older than PAGE_TREE_MAX_AGE
+seconds, which defaults to a few seconds in that case. A process-shared cache
+backend should still be used in multi-process deployments.
+"""
+
+from __future__ import with_statement
+
+import threading, uuid, bisect, time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from cms.invalidation import invalidate, invalidate_urls, is_cache_shared
+from cms.models.managers import publication_manager, publication_clock
+
+
+# The cache key used to share the current tree version between processes.
+PAGE_TREE_VERSION_KEY = "cms.apps.pages.tree.version"
+
+
+def get_page_tree_max_age():
+    """
+    Returns the number of seconds a snapshot of the page tree may be used for,
+    or None if snapshots can be used until the tree version changes.
+    """
+    max_age = getattr(settings, "PAGE_TREE_MAX_AGE", None)
+    if max_age is None and not is_cache_shared():
+        max_age = 5
+    return max_age
+
+
+def get_page_tree_version():
+    """Returns the current version of the page tree."""
+    version = cache.get(PAGE_TREE_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(PAGE_TREE_VERSION_KEY, version):
+            version = cache.get(PAGE_TREE_VERSION_KEY, version)
+    return version
+
+
+def bump_page_tree_version():
+    """Replaces the current version of the page tree."""
+    cache.set(PAGE_TREE_VERSION_KEY, uuid.uuid4().hex)
+
+
+def invalidate_page_tree():
+    """
+    Marks all existing snapshots of the page tree as out of date, both now and
+    once the current transaction has finished.
+    
+    The URLs of pages, and of any objects below them, might have changed too,
+    so everything that depends on URLs is also marked as out of date.
+    """
+    invalidate(bump_page_tree_version)
+    invalidate_urls()
+
+
+class PageTree(object):
+
+    """An immutable snapshot of the whole page tree."""
+
+    def __init__(self, model, version, db, rows):
+        """
+        Initializes the PageTree.
+
+        The rows should be tuples of field values, in the same order as the
+        model's fields, and ordered by their left value.
+        """
+        self.model = model
+        self.version = version
+        self.loaded_at = time.time()
+        self._db = db
+        self._rows = {}
+        self._parent_ids = {}
+        self._child_ids = {}
+        self._visibility = {}
+        self._paths = {}
+        self._path_ids = {}
+        self.homepage_id = None
+        # Index the rows.
+        field_names = [field.attname for field in model._meta.fields]
+        id_index = field_names.index("id")
+        parent_id_index = field_names.index("parent_id")
+        self._url_title_index = url_title_index = field_names.index("url_title")
+        is_online_index = field_names.index("effective_is_online")
+        publication_date_index = field_names.index("effective_publication_date")
+        expiry_date_index = field_names.index("effective_expiry_date")
+        for row in rows:
+            page_id = row[id_index]
+            parent_id = row[parent_id_index]
+            self._rows[page_id] = row
+            self._parent_ids[page_id] = parent_id
+            if parent_id is None:
+                self.homepage_id = page_id
+                path = u""
+            else:
+                self._child_ids.setdefault(parent_id, []).append(page_id)
+                path = self._paths[parent_id] + row[url_title_index] + u"/"
+            self._visibility[page_id] = (row[is_online_index], row[publication_date_index], row[expiry_date_index])
+            # Index the path of the page, relative to the homepage.
+            self._paths[page_id] = path
+            self._path_ids[path] = page_id
+        # Index the times that the publication state of a page changes.
+        self._publication_changes = sorted(set(
+            date
+            for is_online, publication_date, expiry_date
+            in self._visibility.itervalues()
+            for date
+            in (publication_date, expiry_date)
+            if date is not None
+        ))
+
+    @classmethod
+    def load(cls, model, version):
+        """Loads a snapshot of the page tree from the database."""
+        field_names = [field.attname for field in model._meta.fields]
+        with publication_manager.select_published(False):
+            queryset = model._base_manager.order_by("left").values_list(*field_names)
+            rows = list(queryset)
+        return cls(model, version, queryset.db, rows)
+
+    def __contains__(self, page_id):
+        """Checks whether the given page is in the tree."""
+        return page_id in self._rows
+
+    def is_published(self, page_id, now=None):
+        """
+        Checks whether the given page, and all of its ancestors, are currently
+        published.
+        """
+        is_online, publication_date, expiry_date = self._visibility[page_id]
+        now = now or publication_clock.now()
+        return is_online and (publication_date is None or publication_date <= now) and (expiry_date is None or expiry_date > now)
+
+    def get_next_publication_change(self, now=None):
+        """
+        Returns the next time after now that a page will be published or
+        expire, or None.
+        """
+        index = bisect.bisect_right(self._publication_changes, now or publication_clock.now())
+        if index < len(self._publication_changes):
+            return self._publication_changes[index]
+        return None
+
+    def get_child_ids(self, page_id):
+        """Returns the ids of the children of the given page, in tree order."""
+        return self._child_ids.get(page_id, ())
+
+    def get_lineage(self, page_id):
+        """Returns the ids of the given page and all its ancestors, starting with the homepage."""
+        lineage = []
+        while page_id is not None:
+            lineage.append(page_id)
+            page_id = self._parent_ids[page_id]
+        lineage.reverse()
+        return lineage
+
+    def get_page_id(self, path):
+        """
+        Returns the id of the page with the given path relative to the homepage,
+        or None if there is no such page.
+        """
+        return self._path_ids.get(path)
+
+    def match_path(self, path_info):
+        """
+        Returns the id of the page with the longest path matching the start of
+        the given path, or None if the tree is empty.
+        """
+        slugs = [slug for slug in path_info.split(u"/") if slug]
+        while slugs:
+            page_id = self._path_ids.get(u"/".join(slugs) + u"/")
+            if page_id is not None:
+                return page_id
+            slugs.pop()
+        return self.homepage_id
+
+    def get_path(self, page):
+        """
+        Returns the path of the given page relative to the homepage, or None if
+        the page has been moved or renamed since the snapshot was taken.
+        """
+        row = self._rows.get(page.id)
+        if row is not None and self._parent_ids[page.id] == page.parent_id and row[self._url_title_index] == page.url_title:
+            return self._paths[page.id]
+        return None
+
+    def create_page(self, page_id):
+        """Creates a new page instance from the snapshot."""
+        page = self.model(*self._rows[page_id])
+        page._state.adding = False
+        page._state.db = self._db
+        return page
+
+
+# The most recent page tree snapshots, keyed by model.
+_page_trees = {}
+
+_page_trees_lock = threading.Lock()
+
+
+def get_page_tree(model, load=True):
+    """
+    Returns an up-to-date snapshot of the page tree for the given model.
+
+    If load is False, and the snapshot held by this process is out of date,
+    then None is returned instead of loading a new snapshot.
+    """
+    version = get_page_tree_version()
+    max_age = get_page_tree_max_age()
+    def is_stale(page_tree):
+        return (
+            page_tree is None or
+            page_tree.version != version or
+            (max_age is not None and time.time() - page_tree.loaded_at >= max_age)
+        )
+    page_tree = _page_trees.get(model)
+    if is_stale(page_tree):
+        if not load:
+            return None
+        with _page_trees_lock:
+            page_tree = _page_trees.get(model)
+            if is_stale(page_tree):
+                page_tree = PageTree.load(model, version)
+                _page_trees[model] = page_tree
+    return page_tree
+
+
+class PageLoader(object):
+
+    """
+    Creates page instances from a page tree snapshot.
+
+    Pages created by the same loader are only instantiated once, and their
+    children are loaded from the snapshot rather than from the database. When
+    publication management is active, unpublished pages are hidden.
+    """
+
+    def __init__(self, page_tree):
+        """Initializes the PageLoader."""
+        self.page_tree = page_tree
+        self._pages = {}
+
+    def _is_visible(self, page_id):
+        """Checks whether the given page should be visible."""
+        if publication_manager.select_published_active():
+            return self.page_tree.is_published(page_id)
+        return True
+
+    def _create_page(self, page_id, parent=None):
+        """Returns the page instance for the given id."""
+        try:
+            return self._pages[page_id]
+        except KeyError:
+            page = self.page_tree.create_page(page_id)
+            page._page_loader = self
+            if parent is not None:
+                page.parent = parent
+            self._pages[page_id] = page
+            return page
+
+    @property
+    def homepage(self):
+        """Returns the site homepage, or None."""
+        homepage_id = self.page_tree.homepage_id
+        if homepage_id is not None and self._is_visible(homepage_id):
+            return self._create_page(homepage_id)
+        return None
+
+    def get_breadcrumbs(self, path_info):
+        """
+        Returns the visible pages leading to the page that best matches the
+        given path, starting with the homepage.
+        """
+        breadcrumbs = []
+        page_id = self.page_tree.match_path(path_info)
+        if page_id is not None:
+            parent = None
+            for page_id in self.page_tree.get_lineage(page_id):
+                if not self._is_visible(page_id):
+                    break
+                parent = self._create_page(page_id, parent)
+                breadcrumbs.append(parent)
+        return breadcrumbs
+
+    def get_children(self, page):
+        """Returns the visible children of the given page."""
+        return [
+            self._create_page(child_id, page)
+            for child_id
+            in self.page_tree.get_child_ids(page.id)
+            if self._is_visible(child_id)
+        ]
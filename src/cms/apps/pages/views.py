@@ -1,8 +1,79 @@
 """Views used by the pages app."""
 
-from django.contrib.contenttypes.models import ContentType
+from django.conf import settings
+from django.core import urlresolvers
+from django.shortcuts import redirect
 from django.views.generic import TemplateView
 
+from cms.apps.pages.models import get_content_resolver, get_content_cls
+
+
+def get_append_slash_url(request):
+    """
+    Returns the URL to redirect the request to by appending a slash, or None if
+    appending a slash would not help.
+    
+    The catch-all page_dispatch pattern matches every URL, so CommonMiddleware
+    never appends a slash itself. Instead, a slash is appended if that makes
+    the URL match another pattern in the root urlconf.
+    """
+    if not settings.APPEND_SLASH or request.path_info.endswith("/"):
+        return None
+    try:
+        match = urlresolvers.resolve(request.path_info + "/", getattr(request, "urlconf", None))
+    except urlresolvers.Resolver404:
+        return None
+    if match.func is page_dispatch:
+        return None
+    new_url = request.path + "/"
+    if request.META.get("QUERY_STRING"):
+        new_url += "?" + request.META["QUERY_STRING"]
+    return new_url
+
+
+def page_dispatch(request):
+    """
+    Dispatches the request to the views of the current page's content.
+    
+    This can be used as a catch-all URL pattern at the end of the root urlconf,
+    so that pages are served without first failing to resolve the URL and
+    building a 404 response. Raises a Resolver404 if there is no matching page
+    or content view, unless appending a slash to the URL would match another
+    URL pattern, in which case the request is redirected.
+    """
+    request.pages.dispatch_attempted = True
+    page = request.pages.current
+    if page is None:
+        new_url = get_append_slash_url(request)
+        if new_url is not None:
+            return redirect(new_url)
+        raise urlresolvers.Resolver404({"path": request.path_info})
+    script_name = page.get_absolute_url()[:-1]
+    path_info = request.path[len(script_name):]
+    resolver = get_content_resolver(page.content_type_id)[1]
+    try:
+        callback, callback_args, callback_kwargs = resolver.resolve(path_info)
+    except urlresolvers.Resolver404:
+        # First of all see if adding a slash will help matters.
+        if settings.APPEND_SLASH and not path_info.endswith("/"):
+            new_path_info = path_info + "/"
+            try:
+                resolver.resolve(new_path_info)
+            except urlresolvers.Resolver404:
+                pass
+            else:
+                return redirect(script_name + new_path_info)
+        new_url = get_append_slash_url(request)
+        if new_url is not None:
+            return redirect(new_url)
+        raise
+    # Dispatch to the content.
+    request.pages.is_dispatched = True
+    response = callback(request, *callback_args, **callback_kwargs)
+    if not response:
+        raise ValueError, "The view {0!r} didn't return an HttpResponse object.".format(callback.__name__)
+    return response
+
 
 class ContentIndexView(TemplateView):
     
@@ -10,7 +81,7 @@ class ContentIndexView(TemplateView):
     
     def get_template_names(self):
         """Returns the list of template names."""
-        content_cls = ContentType.objects.get_for_id(self.request.pages.current.content_type_id).model_class()
+        content_cls = get_content_cls(self.request.pages.current.content_type_id)
         params = {
             "model_name": content_cls.__name__.lower(),
             "app_label": content_cls._meta.app_label,
@@ -1,20 +1,231 @@
-"""HTML processing routines."""
+"""
+HTML processing routines.
+
+HTML is scanned once by a small tokenizer that finds <a/> and <img/> tags and
+their attributes. Tags that refer to a permalink are rewritten in place,
+leaving all other text, including untouched tags, byte-identical.
+"""
 
 
 import re
 
-from django.core.exceptions import ObjectDoesNotExist
+from django.core import urlresolvers
 from django.db import models
-from django.utils.html import escape
+from django.utils.encoding import force_unicode
+
+from cms import permalinks, thumbnails
+
+
+# Matches a complete <a/> or <img/> tag, allowing for quoted attribute values.
+RE_TAG = re.compile(ur"""<(a|img)(?=[\s/>])[^<>"']*(?:(?:"[^"<]*"|'[^'<]*')[^<>"']*)*>""", re.IGNORECASE)
+
+RE_ATTR = re.compile(ur"""([^\s"'<>/=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'<>]+))?""")
+
+
+class Tag(object):
+    
+    """
+    An <a/> or <img/> tag found in HTML text.
+    
+    The attributes of the tag are only parsed when first accessed.
+    """
+    
+    __slots__ = ("text", "tagname", "start", "end", "attrs_start", "attrs_end", "_attrs",)
+    
+    def __init__(self, text, match):
+        """Initializes the Tag from a match of RE_TAG."""
+        self.text = text
+        self.tagname = match.group(1).lower()
+        self.start = match.start()
+        self.end = match.end()
+        self.attrs_start = match.end(1)
+        # The attributes end before any whitespace and slash at the end of the tag.
+        attrs_end = self.end - 1
+        if text[attrs_end - 1] == u"/":
+            attrs_end -= 1
+        while attrs_end > self.attrs_start and text[attrs_end - 1].isspace():
+            attrs_end -= 1
+        self.attrs_end = attrs_end
+        self._attrs = None
+    
+    @property
+    def attrs(self):
+        """
+        A dictionary of the attributes of the tag, as tuples of (value, start,
+        end), where start and end are the position of the value in the text,
+        including any quotes. Attribute names are lowercased, and only the first
+        of any duplicate attributes is used.
+        """
+        if self._attrs is None:
+            attrs = {}
+            for match in RE_ATTR.finditer(self.text, self.attrs_start, self.attrs_end):
+                value = match.group(2)
+                if value is None:
+                    value = (u"", match.end(), match.end())
+                elif value[0] in u"\"'":
+                    value = (value[1:-1], match.start(2), match.end(2))
+                else:
+                    value = (value, match.start(2), match.end(2))
+                attrs.setdefault(match.group(1).lower(), value)
+            self._attrs = attrs
+        return self._attrs
+    
+    def get(self, name):
+        """Returns the unquoted value of the given attribute, or None."""
+        attr = self.attrs.get(name)
+        if attr is None:
+            return None
+        return attr[0]
+    
+    @property
+    def link_attr(self):
+        """Returns the name of the attribute that contains the link of this tag."""
+        if self.tagname == u"a":
+            return u"href"
+        return u"src"
+    
+    @property
+    def link(self):
+        """Returns the link of this tag, or None."""
+        return self.get(self.link_attr)
+
 
-import optimizations
+def tokenize(text):
+    """Yields a Tag for each <a/> and <img/> tag in the given text, scanning the text once."""
+    for match in RE_TAG.finditer(text):
+        yield Tag(text, match)
 
-from cms import permalinks
 
+def get_thumbnail(obj, width, height):
+    """
+    Returns a thumbnail of the file in the given object's FileField, or None
+    if the object has no file, or the thumbnail could not be generated.
+    
+    The thumbnail will be pending if it is still being generated.
+    """
+    # Automagically detect a FileField.
+    fieldname = None
+    for field in obj._meta.fields:
+        if isinstance(field, models.FileField):
+            fieldname = field.name
+    if fieldname is None:
+        return None
+    # Generate the thumbnail.
+    try:
+        return thumbnails.get_thumbnail(getattr(obj, fieldname), width, height)
+    except IOError:
+        return None
 
-RE_TAG = re.compile(ur"<(img|a)(\s+.*?)(/?)>", re.IGNORECASE)
 
-RE_ATTR = re.compile(ur"\s([\w-]+)=(\".*?\"|'.*?')", re.IGNORECASE)
+def escape_attr(value):
+    """
+    Escapes the given value for use in a quoted attribute.
+    
+    This is equivalent to django.utils.html.escape, without the overhead of
+    marking the result as safe.
+    """
+    return force_unicode(value).replace(u"&", u"&amp;").replace(u"<", u"&lt;").replace(u">", u"&gt;").replace(u'"', u"&quot;").replace(u"'", u"&#39;")
+
+
+def rewrite_tag(text, tag, resolved_permalink, pending_thumbnails=None):
+    """
+    Returns the given tag, with the URL and title of the given resolved
+    permalink added in.
+    
+    Images are thumbnailed to fit their width and height. If a thumbnail is
+    still being generated, then the original image is used, and the tag is
+    added to pending_thumbnails.
+    """
+    replacements = {
+        tag.link_attr: resolved_permalink.url,
+    }
+    if tag.tagname == u"img":
+        try:
+            width = int(tag.get(u"width"))
+            height = int(tag.get(u"height"))
+        except (ValueError, TypeError):
+            pass
+        else:
+            thumbnail = get_thumbnail(resolved_permalink.obj, width, height)
+            if thumbnail is not None:
+                if thumbnail.pending and pending_thumbnails is not None:
+                    pending_thumbnails.append(tag)
+                replacements[u"src"] = thumbnail.url
+                replacements[u"width"] = thumbnail.width
+                replacements[u"height"] = thumbnail.height
+    # Replace the attribute values in place.
+    attrs = tag.attrs
+    edits = sorted(
+        (attrs[name][1:], value)
+        for name, value
+        in replacements.iteritems()
+    )
+    parts = []
+    position = tag.start
+    for (start, end), value in edits:
+        parts.append(text[position:start])
+        parts.append(u'"%s"' % escape_attr(value))
+        position = end
+    parts.append(text[position:tag.attrs_end])
+    if u"title" not in attrs:
+        parts.append(u' title="%s"' % escape_attr(resolved_permalink.title))
+    parts.append(text[tag.attrs_end:tag.end])
+    return u"".join(parts)
+
+
+def find_permalink_tags(text):
+    """Returns a list of the tags in the given text that might contain permalinks."""
+    try:
+        prefix = permalinks.get_permalink_prefix()
+    except urlresolvers.NoReverseMatch:
+        return []
+    if prefix not in text:
+        return []
+    # Only tags that contain the permalink prefix need their attributes parsing.
+    tags = []
+    for match in RE_TAG.finditer(text):
+        if text.find(prefix, match.start(), match.end()) != -1:
+            tag = Tag(text, match)
+            if tag.link:
+                tags.append(tag)
+    return tags
+
+
+def resolve_tags(tags):
+    """Resolves the permalinks in the given tags, as for permalinks.resolve_many()."""
+    if not tags:
+        return {}
+    return permalinks.resolve_many(set(tag.link for tag in tags))
+
+
+def rewrite(text, tags, resolved_permalinks, pending_thumbnails=None):
+    """
+    Yields the chunks of the given text, with the given tags rewritten to use
+    the given resolved permalinks. All other text is left untouched.
+    
+    Any tags with thumbnails that are still being generated are added to
+    pending_thumbnails.
+    """
+    position = 0
+    for tag in tags:
+        resolved_permalink = resolved_permalinks.get(tag.link)
+        if resolved_permalink:
+            yield text[position:tag.start]
+            yield rewrite_tag(text, tag, resolved_permalink, pending_thumbnails)
+            position = tag.end
+    yield text[position:]
+
+
+def iter_process(text):
+    """
+    Expands permalinks in <a/> and <img/> tags, yielding the processed text in
+    chunks.
+    
+    Images will also be automatically thumbnailed to fit their specified width
+    and height.
+    """
+    tags = find_permalink_tags(text)
+    return rewrite(text, tags, resolve_tags(tags))
 
 
 def process(text):
@@ -24,58 +235,34 @@ def process(text):
     Images will also be automatically thumbnailed to fit their specified width
     and height.
     """
-    resolved_permalinks = {}
-    def sub_tag(match):
-        tagname = match.group(1)
-        attrs = dict(RE_ATTR.findall(match.group(2)))
-        def get_obj(attr_name):
-            if attr_name in attrs:
-                value = attrs[attr_name][1:-1]
-                if not value in resolved_permalinks:
-                    try:
-                        resolved_permalinks[value] = permalinks.resolve(value)
-                    except (permalinks.PermalinkError, ObjectDoesNotExist):
-                        resolved_permalinks[value] = None
-                obj = resolved_permalinks[value]
-                if obj:
-                    # Add in the URL of the obj.
-                    attrs[attr_name] = '"%s"' % escape(obj.get_absolute_url())
-                    # Add in the title of the obj.
-                    attrs.setdefault("title", u'"%s"' % escape(getattr(obj, "title", unicode(obj))))
-                return obj
-            return None
-        if tagname == "a":
-            # Process hyperlinks.
-            get_obj("href")
-        elif tagname == "img":
-            # Process images.            
-            obj = get_obj("src")
-            if obj:
-                try:
-                    width = int(attrs["width"][1:-1])
-                    height = int(attrs["height"][1:-1])
-                except (ValueError, KeyError, TypeError):
-                    pass
-                else:
-                    # Automagically detect a FileField.
-                    fieldname = None
-                    for field in obj._meta.fields:
-                        if isinstance(field, models.FileField):
-                            fieldname = field.name
-                    # Generate the thumbnail.
-                    if fieldname:
-                        try:
-                            thumbnail = optimizations.get_thumbnail(getattr(obj, fieldname), width, height, "resize")
-                        except IOError:
-                            pass
-                        else:
-                            attrs["src"] = '"%s"' % escape(thumbnail.url)
-                            attrs["width"] = '"%s"' % thumbnail.width
-                            attrs["height"] = '"%s"' % thumbnail.height
-        else:
-            assert False
-        # Regenerate the html tag.
-        attrs = u" ".join(u"%s=%s" % (key, value) for key, value in sorted(attrs.iteritems()))
-        return u"<%s %s%s>" % (tagname, attrs, match.group(3))
-    return RE_TAG.sub(sub_tag, text)
+    tags = find_permalink_tags(text)
+    resolved_permalinks = resolve_tags(tags)
+    if not resolved_permalinks:
+        return text
+    return u"".join(rewrite(text, tags, resolved_permalinks))
+
 
+def render(text):
+    """
+    Expands permalinks in the given text for storage, returning a tuple of
+    (html, dependencies), where dependencies is a sorted list of the
+    (content_type_id, object_id) of each permalink in the text.
+    
+    If any of the permalinks could not be resolved, or any thumbnails are still
+    being generated, then html will be None.
+    """
+    tags = find_permalink_tags(text)
+    resolved_permalinks = resolve_tags(tags)
+    pending_thumbnails = []
+    html = u"".join(rewrite(text, tags, resolved_permalinks, pending_thumbnails))
+    if pending_thumbnails:
+        html = None
+    dependencies = set()
+    for tag in tags:
+        try:
+            dependencies.add(permalinks.parse(tag.link))
+        except permalinks.PermalinkError:
+            continue
+        if not resolved_permalinks.get(tag.link):
+            html = None
+    return html, sorted(dependencies)
@@ -0,0 +1,128 @@
+"""
+Invalidation of shared caches around transactions.
+
+Cache versions are shared between processes, so bumping a version before the
+transaction that changed the data has committed lets another process cache the
+old data under the new version, where it would stay indefinitely. Invalidations
+made inside a managed transaction are therefore run immediately, and then run
+again once the transaction has finished, at the end of the request.
+
+Code that runs managed transactions outside of a request, such as management
+commands, should call run_pending_invalidations() after committing.
+
+The URL version is shared by everything that caches the URLs of objects, which
+can change without the objects themselves being saved, such as when a page is
+moved or renamed, changing the URL of everything below it.
+
+Versions are only shared between processes if the default cache is. With a
+process-local backend, such as the local memory cache, other processes only see
+a change once their own copy of the version expires.
+"""
+
+from __future__ import with_statement
+
+import threading, uuid
+
+from django.core import signals
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections, transaction
+
+
+class PendingInvalidations(threading.local):
+    
+    """A thread-local list of invalidations to repeat once the current transaction finishes."""
+    
+    def __init__(self):
+        """Initializes the PendingInvalidations."""
+        super(PendingInvalidations, self).__init__()
+        self._invalidations = []
+        self._running = False
+    
+    def add(self, func, args):
+        """Schedules the given invalidation, unless it is already scheduled."""
+        if not self._running and (func, args) not in self._invalidations:
+            self._invalidations.append((func, args))
+    
+    def run(self):
+        """Runs all scheduled invalidations."""
+        invalidations = self._invalidations
+        self._invalidations = []
+        self._running = True
+        try:
+            for func, args in invalidations:
+                func(*args)
+        finally:
+            self._running = False
+
+
+# A single, thread-safe list of pending invalidations.
+pending_invalidations = PendingInvalidations()
+
+
+def in_managed_transaction():
+    """Checks whether any database connection is in a managed transaction."""
+    return any(
+        transaction.is_managed(using=alias)
+        for alias
+        in connections
+    )
+
+
+def invalidate(func, *args):
+    """
+    Runs the given invalidation function, and runs it again once the current
+    transaction has finished, if there is one.
+    """
+    func(*args)
+    if in_managed_transaction():
+        pending_invalidations.add(func, args)
+
+
+def run_after_transaction(func, *args):
+    """
+    Runs the given function once the current transaction has finished, or
+    immediately if there is no transaction.
+    """
+    if in_managed_transaction():
+        pending_invalidations.add(func, args)
+    else:
+        func(*args)
+
+
+def run_pending_invalidations(**kwargs):
+    """Repeats the invalidations made during the transaction that has just finished."""
+    pending_invalidations.run()
+
+signals.request_finished.connect(run_pending_invalidations)
+
+
+# The cache key used to share the current URL version between processes.
+URL_VERSION_KEY = "cms.invalidation.url_version"
+
+
+def get_url_version():
+    """Returns the current version of the URLs of all objects."""
+    version = cache.get(URL_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(URL_VERSION_KEY, version):
+            version = cache.get(URL_VERSION_KEY, version)
+    return version
+
+
+def invalidate_urls():
+    """
+    Marks everything that depends on the URLs of objects as out of date, both
+    now and once the current transaction has finished.
+    """
+    invalidate(cache.delete, URL_VERSION_KEY)
+
+
+def is_cache_shared(cache_backend=cache):
+    """
+    Checks whether the given cache is shared between processes, so that
+    versions stored in it are seen by every process at once.
+    """
+    return not isinstance(cache_backend, (LocMemCache, DummyCache))
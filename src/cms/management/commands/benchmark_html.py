@@ -0,0 +1,120 @@
+"""Measures the speed of HTML processing over generated article corpora."""
+
+import random, re, time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.utils.html import escape
+
+from cms.html import tokenize, find_permalink_tags, rewrite
+
+
+# The regular expressions used by the previous implementation, for comparison.
+LEGACY_RE_TAG = re.compile(ur"<(img|a)(\s+.*?)(/?)>", re.IGNORECASE)
+
+LEGACY_RE_ATTR = re.compile(ur"\s([\w-]+)=(\".*?\"|'.*?')", re.IGNORECASE)
+
+
+# The number of paragraphs in each generated corpus.
+CORPORA = (
+    ("short article", 5),
+    ("long article", 50),
+    ("very long article", 1000),
+)
+
+
+class BenchmarkObject(object):
+    
+    """An object without a file, so that no thumbnails are generated."""
+    
+    class _meta:
+        
+        fields = ()
+
+
+class BenchmarkPermalink(object):
+    
+    """A resolved permalink that does not need the database."""
+    
+    obj = BenchmarkObject()
+    
+    def __init__(self, index):
+        """Initializes the BenchmarkPermalink."""
+        self.url = u"/news/article-{0}/".format(index)
+        self.title = u"Article {0}".format(index)
+
+
+def generate_paragraph(generator):
+    """Generates a paragraph of text, with a mixture of links and images."""
+    parts = [u"<p>"]
+    for _ in xrange(generator.randint(3, 8)):
+        parts.append(u" ".join(generator.choice((u"lorem", u"ipsum", u"dolor", u"sit", u"amet")) for _ in xrange(generator.randint(5, 20))))
+        choice = generator.random()
+        if choice < 0.3:
+            parts.append(u' <a href="/r/7-{0}/">a link</a> '.format(generator.randint(1, 500)))
+        elif choice < 0.4:
+            parts.append(u' <a href="http://www.example.com/" class="external" target="_blank">an external link</a> ')
+        elif choice < 0.5:
+            parts.append(u' <img src="/r/8-{0}/" width="{1}" height="{2}" alt="An image"/> '.format(generator.randint(1, 500), generator.randint(50, 500), generator.randint(50, 500)))
+        else:
+            parts.append(u" <strong>emphasis</strong> ")
+    parts.append(u"</p>\n")
+    return u"".join(parts)
+
+
+def legacy_process(text, resolved_permalinks):
+    """
+    Expands the permalinks in the text using the previous implementation, which
+    rebuilt every tag.
+    """
+    def sub_tag(match):
+        tagname = match.group(1).lower()
+        attrs = dict(LEGACY_RE_ATTR.findall(match.group(2)))
+        attr_name = "href" if tagname == "a" else "src"
+        if attr_name in attrs:
+            resolved_permalink = resolved_permalinks.get(attrs[attr_name][1:-1])
+            if resolved_permalink:
+                attrs[attr_name] = '"%s"' % escape(resolved_permalink.url)
+                attrs.setdefault("title", u'"%s"' % escape(resolved_permalink.title))
+        attrs = u" ".join(u"%s=%s" % (key, value) for key, value in sorted(attrs.iteritems()))
+        return u"<%s %s%s>" % (match.group(1), attrs, match.group(3))
+    return LEGACY_RE_TAG.sub(sub_tag, text)
+
+
+class Command(NoArgsCommand):
+    
+    help = "Measures the speed of the HTML tokenizer and rewriter used by the html template filter."
+    
+    option_list = NoArgsCommand.option_list + (
+        make_option("--repeat",
+            action = "store",
+            type = "int",
+            dest = "repeat",
+            default = 20,
+            help = "The number of times to process each corpus.",
+        ),
+    )
+    
+    def time_function(self, func, text, repeat):
+        """Returns the mean time taken to run the function over the text, in milliseconds."""
+        start = time.time()
+        for _ in xrange(repeat):
+            func(text)
+        return (time.time() - start) * 1000.0 / repeat
+    
+    def handle_noargs(self, **options):
+        """Runs the command."""
+        repeat = options["repeat"]
+        generator = random.Random(0)
+        for name, paragraphs in CORPORA:
+            text = u"".join(generate_paragraph(generator) for _ in xrange(paragraphs))
+            resolved_permalinks = {}
+            for tag in find_permalink_tags(text):
+                resolved_permalinks[tag.link] = BenchmarkPermalink(len(resolved_permalinks))
+            def process(text):
+                return u"".join(rewrite(text, find_permalink_tags(text), resolved_permalinks))
+            self.stdout.write("{name} ({length} characters):\n".format(name=name, length=len(text)))
+            self.stdout.write("    previous implementation: {0:.3f}ms\n".format(self.time_function(lambda text: legacy_process(text, resolved_permalinks), text, repeat)))
+            self.stdout.write("    tokenize: {0:.3f}ms\n".format(self.time_function(lambda text: [tag.attrs for tag in tokenize(text)], text, repeat)))
+            self.stdout.write("    find permalink tags: {0:.3f}ms\n".format(self.time_function(find_permalink_tags, text, repeat)))
+            self.stdout.write("    find permalink tags and rewrite: {0:.3f}ms\n".format(self.time_function(process, text, repeat)))
@@ -0,0 +1,57 @@
+"""Measures the overhead of publication filtering when creating querysets."""
+
+from __future__ import with_statement
+
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import models
+
+from cms.models.managers import PublishedBaseManager, publication_manager
+
+
+class Command(NoArgsCommand):
+    
+    help = (
+        "Measures the time taken to create and compile a queryset for each model with a "
+        "publication manager, in preview mode and in live mode, comparing the precompiled "
+        "published SQL with filtering by select_published()."
+    )
+    
+    option_list = NoArgsCommand.option_list + (
+        make_option("--repeat",
+            action = "store",
+            type = "int",
+            dest = "repeat",
+            default = 1000,
+            help = "The number of querysets to create in each mode.",
+        ),
+    )
+    
+    def time_querysets(self, get_queryset, select_published, repeat):
+        """Returns the mean time taken to create and compile a queryset, in microseconds."""
+        with publication_manager.select_published(select_published):
+            get_queryset().filter(pk=1).query.get_compiler(get_queryset().db).as_sql()  # Warm up any caches.
+            start = time.time()
+            for _ in xrange(repeat):
+                queryset = get_queryset().filter(pk=1)
+                queryset.query.get_compiler(queryset.db).as_sql()
+            return (time.time() - start) * 1000000.0 / repeat
+    
+    def handle_noargs(self, **options):
+        """Runs the command."""
+        repeat = options["repeat"]
+        for model in models.get_models():
+            manager = model._default_manager
+            if not isinstance(manager, PublishedBaseManager):
+                continue
+            # Filter an unfiltered queryset in the way used before the SQL was precompiled.
+            get_filtered_queryset = lambda: manager.select_published(super(PublishedBaseManager, manager).get_query_set())
+            self.stdout.write("{app_label}.{model_name}:\n".format(
+                app_label = model._meta.app_label,
+                model_name = model._meta.object_name,
+            ))
+            self.stdout.write("    preview mode: {0:.1f}us per queryset\n".format(self.time_querysets(manager.all, False, repeat)))
+            self.stdout.write("    live mode: {0:.1f}us per queryset\n".format(self.time_querysets(manager.all, True, repeat)))
+            self.stdout.write("    live mode using select_published(): {0:.1f}us per queryset\n".format(self.time_querysets(get_filtered_queryset, False, repeat)))
@@ -0,0 +1,62 @@
+"""Builds gzipped sitemap files for the registered sitemaps."""
+
+from __future__ import with_statement
+
+from optparse import make_option
+
+from django.contrib.sites.models import Site
+from django.core.management.base import NoArgsCommand, CommandError
+
+from cms.models import publication_manager
+from cms.sitemaps import registered_sitemaps, get_sitemap_build, build_sitemap
+
+
+class Command(NoArgsCommand):
+    
+    help = (
+        "Builds gzipped sitemap files for each registered sitemap that has changed since it was "
+        "last built. The sitemap views send these files instead of querying the database. Run "
+        "this regularly, such as from cron."
+    )
+    
+    option_list = NoArgsCommand.option_list + (
+        make_option("--domain",
+            action = "store",
+            dest = "domain",
+            default = None,
+            help = "The domain used in sitemap URLs. Defaults to the domain of the current site.",
+        ),
+        make_option("--protocol",
+            action = "store",
+            dest = "protocol",
+            default = "http",
+            help = "The protocol used in sitemap URLs.",
+        ),
+        make_option("--all",
+            action = "store_true",
+            dest = "all",
+            default = False,
+            help = "Build every sitemap, not just the ones that have changed.",
+        ),
+    )
+    
+    def handle_noargs(self, **options):
+        """Runs the command."""
+        verbosity = int(options.get("verbosity", 1))
+        domain = options["domain"]
+        if domain is None:
+            if not Site._meta.installed:
+                raise CommandError("Please specify a --domain, or enable the sites framework.")
+            domain = Site.objects.get_current().domain
+        with publication_manager.select_published(True):
+            for section, sitemap_cls in sorted(registered_sitemaps.iteritems()):
+                if not options["all"] and get_sitemap_build(section) is not None:
+                    continue
+                sitemap = sitemap_cls()
+                protocol = sitemap.protocol or options["protocol"]
+                shards = build_sitemap(section, sitemap, domain, protocol)
+                if verbosity >= 1:
+                    self.stdout.write("Built {shards} sitemap files for {section}.\n".format(
+                        shards = shards,
+                        section = section,
+                    ))
@@ -0,0 +1,44 @@
+"""Renders the stored HTML of HtmlFields that use prerender."""
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import models, transaction
+
+from cms.models.fields import prerendered_html_fields, render_prerendered_html
+
+
+class Command(NoArgsCommand):
+    
+    help = (
+        "Renders the stored HTML of HtmlFields that use prerender, where it has been "
+        "discarded because a linked object has changed. Run this regularly, such as from cron."
+    )
+    
+    option_list = NoArgsCommand.option_list + (
+        make_option("--all",
+            action = "store_true",
+            dest = "all",
+            default = False,
+            help = "Render the stored HTML of every object, not just the out of date ones.",
+        ),
+    )
+    
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        """Runs the command."""
+        verbosity = int(options.get("verbosity", 1))
+        models.get_models()  # Make sure that all HtmlFields are registered.
+        for model, field in prerendered_html_fields:
+            queryset = model._base_manager.all()
+            if not options["all"]:
+                queryset = queryset.filter(**{
+                    "{0}__isnull".format(field.rendered_attname): True,
+                })
+            count = render_prerendered_html(model, field, queryset)
+            if verbosity >= 1:
+                self.stdout.write("Rendered {count} {model}.{field} values.\n".format(
+                    count = count,
+                    model = model._meta.object_name,
+                    field = field.name,
+                ))
@@ -3,4 +3,4 @@
 
 from cms.models.base import PageBase, PublishedBase, PublishedBaseSearchAdapter, SearchMetaBase, OnlineBase, OnlineBaseSearchAdapter, SearchMetaBaseSearchAdapter, PageBaseSearchAdapter
 from cms.models.fields import HtmlField, LinkField
-from cms.models.managers import PublicationManagementError, publication_manager,  PublishedBaseManager, OnlineBaseManager, SearchMetaBaseManager, PageBaseManager
\ No newline at end of file
+from cms.models.managers import PublicationManagementError, publication_manager, publication_clock, get_next_publication_change, PublishedBaseManager, OnlineBaseManager, SearchMetaBaseManager, PageBaseManager
\ No newline at end of file
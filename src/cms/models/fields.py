@@ -1,16 +1,153 @@
 """Fields used by the page management application."""
 
-import urlparse
+from __future__ import with_statement
 
+import os, threading, urlparse, Queue
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, connections, transaction
+from django.dispatch import Signal
+from django.utils.encoding import force_unicode
 
 from cms.forms import HtmlWidget
+from cms.invalidation import run_after_transaction
+from cms.models.managers import publication_manager
+
+
+class HtmlText(unicode):
+    
+    """
+    The raw text of a HtmlField, along with its pre-rendered HTML and the
+    permalinks that the rendered HTML depends on, if available.
+    """
+    
+    rendered = None
+    
+    dependencies = ()
+
+
+class PrerenderedHtmlDescriptor(object):
+    
+    """Attaches the pre-rendered HTML of a HtmlField to its raw text."""
+    
+    def __init__(self, field):
+        """Initializes the PrerenderedHtmlDescriptor."""
+        self.field = field
+        
+    def __get__(self, instance, owner):
+        """Returns the raw text, with any pre-rendered HTML attached."""
+        if instance is None:
+            return self
+        value = instance.__dict__.get(self.field.attname)
+        if value is None:
+            return value
+        text = HtmlText(value)
+        rendered = instance.__dict__.get(self.field.rendered_attname)
+        if rendered is not None:
+            text.rendered = rendered
+            text.dependencies = parse_html_dependencies(instance.__dict__.get(self.field.dependencies_attname))
+        return text
+        
+    def __set__(self, instance, value):
+        """Sets the raw text, discarding any pre-rendered HTML if it has changed."""
+        if instance.__dict__.get(self.field.attname) != value:
+            instance.__dict__[self.field.rendered_attname] = None
+        instance.__dict__[self.field.attname] = value
+
+
+def format_html_dependency(content_type_id, object_id):
+    """Formats a permalink dependency for storage."""
+    return u"{0}-{1}".format(content_type_id, object_id)
+
+
+def parse_html_dependencies(value):
+    """Parses stored permalink dependencies into a list of (content_type_id, object_id)."""
+    return [
+        (int(content_type_id), object_id)
+        for content_type_id, object_id
+        in (dependency.split(u"-", 1) for dependency in (value or u"").split())
+    ]
+
+
+# All concrete HtmlFields that store pre-rendered HTML, as (model, field) tuples.
+prerendered_html_fields = []
 
 
 class HtmlField(models.TextField):
     
-    """A field that contains HTML data."""
+    """
+    A field that contains HTML data.
+    
+    If prerender is True, then the HTML will be processed for permalinks and
+    thumbnails when the model is saved, and stored alongside the raw HTML in
+    two extra fields, "<name>_rendered" and "<name>_dependencies". The html
+    template filter uses the stored HTML rather than processing it on every
+    view. The linked objects are also recorded as HtmlDependency rows, so that
+    saving or deleting one of them, or changing its URL, discards the stored
+    HTML. The discarded HTML is rendered again in the background, or by the
+    prerender_html command if the process exits first.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        """Initializes the HtmlField."""
+        self.prerender = kwargs.pop("prerender", False)
+        super(HtmlField, self).__init__(*args, **kwargs)
+    
+    def contribute_to_class(self, cls, name):
+        """Adds in the fields that store the pre-rendered HTML."""
+        super(HtmlField, self).contribute_to_class(cls, name)
+        if self.prerender and not cls._meta.abstract:
+            self.rendered_attname = "{0}_rendered".format(name)
+            self.dependencies_attname = "{0}_dependencies".format(name)
+            models.TextField(
+                null = True,
+                editable = False,
+            ).contribute_to_class(cls, self.rendered_attname)
+            models.TextField(
+                blank = True,
+                editable = False,
+            ).contribute_to_class(cls, self.dependencies_attname)
+            setattr(cls, name, PrerenderedHtmlDescriptor(self))
+            prerendered_html_fields.append((cls, self))
+            models.signals.post_save.connect(save_html_dependencies_for_instance, sender=cls, dispatch_uid="cms.models.fields.save_html_dependencies")
+            models.signals.post_delete.connect(delete_html_dependencies_for_instance, sender=cls, dispatch_uid="cms.models.fields.delete_html_dependencies")
+    
+    def render(self, value):
+        """
+        Renders the given raw HTML, returning a tuple of (rendered, dependencies)
+        for storage.
+        
+        If any of the permalinks in the HTML cannot currently be resolved, then
+        rendered will be None, and the HTML will be processed when it is viewed.
+        """
+        from cms.html import render
+        if not value:
+            return u"", u""
+        with publication_manager.select_published(True):
+            rendered, dependencies = render(value)
+        return rendered, u" {0} ".format(u" ".join(
+            format_html_dependency(content_type_id, object_id)
+            for content_type_id, object_id
+            in dependencies
+        ))
+    
+    def pre_save(self, model_instance, add):
+        """Renders the HTML for storage, if required."""
+        value = super(HtmlField, self).pre_save(model_instance, add)
+        if self.prerender:
+            rendered, dependencies = self.render(value)
+            setattr(model_instance, self.rendered_attname, rendered)
+            setattr(model_instance, self.dependencies_attname, dependencies)
+        return value
+    
+    def get_prep_value(self, value):
+        """Converts the value to plain unicode text."""
+        value = super(HtmlField, self).get_prep_value(value)
+        if isinstance(value, HtmlText):
+            value = unicode(value)
+        return value
     
     def formfield(self, **kwargs):
         """Returns a HtmlWidget."""
@@ -18,6 +155,249 @@ class HtmlField(models.TextField):
         return super(HtmlField, self).formfield(**kwargs)
 
 
+class HtmlDependency(models.Model):
+    
+    """
+    An object linked to from the pre-rendered HTML of a HtmlField.
+    
+    These are indexed by the linked object, so that the HTML linking to an
+    object can be found without scanning every stored HtmlField.
+    """
+    
+    content_type = models.ForeignKey(
+        ContentType,
+        related_name = "+",
+    )
+    
+    object_id = models.CharField(
+        max_length = 250,
+        db_index = True,
+    )
+    
+    field_name = models.CharField(
+        max_length = 100,
+    )
+    
+    dependency_content_type = models.ForeignKey(
+        ContentType,
+        related_name = "+",
+    )
+    
+    dependency_object_id = models.CharField(
+        max_length = 250,
+        db_index = True,
+    )
+    
+    class Meta:
+        app_label = "cms"
+
+
+def save_html_dependencies(model, object_id, field, dependencies):
+    """
+    Replaces the recorded dependencies of the given field of the given object
+    with the given stored dependencies.
+    """
+    content_type = ContentType.objects.get_for_model(model)
+    object_id = force_unicode(object_id)
+    HtmlDependency.objects.filter(
+        content_type = content_type,
+        object_id = object_id,
+        field_name = field.name,
+    ).delete()
+    HtmlDependency.objects.bulk_create([
+        HtmlDependency(
+            content_type = content_type,
+            object_id = object_id,
+            field_name = field.name,
+            dependency_content_type_id = dependency_content_type_id,
+            dependency_object_id = dependency_object_id,
+        )
+        for dependency_content_type_id, dependency_object_id
+        in parse_html_dependencies(dependencies)
+    ])
+
+
+def save_html_dependencies_for_instance(sender, instance, **kwargs):
+    """Records the dependencies of the pre-rendered HTML of the given object."""
+    for model, field in prerendered_html_fields:
+        if model is sender:
+            save_html_dependencies(sender, instance.pk, field, getattr(instance, field.dependencies_attname))
+
+
+def delete_html_dependencies_for_instance(sender, instance, **kwargs):
+    """Removes the recorded dependencies of the pre-rendered HTML of the given object."""
+    HtmlDependency.objects.filter(
+        content_type = ContentType.objects.get_for_model(sender),
+        object_id = force_unicode(instance.pk),
+    ).delete()
+
+
+# The number of objects to discard the pre-rendered HTML of in each query.
+PRERENDERED_HTML_BATCH_SIZE = 500
+
+
+def get_prerender_html_workers():
+    """
+    Returns the number of background threads used to render discarded HTML
+    again. If zero, then it is rendered synchronously, once the current
+    transaction has finished.
+    """
+    return getattr(settings, "PRERENDER_HTML_WORKERS", 1)
+
+
+def render_prerendered_html(model, field, queryset):
+    """
+    Renders and stores the HTML of the given field for every object in the
+    queryset, returning the number of objects rendered.
+    """
+    count = 0
+    for pk, value in queryset.values_list("pk", field.attname).iterator():
+        rendered, dependencies = field.render(value)
+        # Update the stored HTML directly, so that the save signals are not sent.
+        model._base_manager.filter(pk=pk).update(**{
+            field.rendered_attname: rendered,
+            field.dependencies_attname: dependencies,
+        })
+        save_html_dependencies(model, pk, field, dependencies)
+        count += 1
+    return count
+
+
+def render_discarded_html(model, field, object_ids):
+    """Renders the HTML of the given objects again, if it is still discarded."""
+    with transaction.commit_on_success(using=model._base_manager.db):
+        render_prerendered_html(model, field, model._base_manager.filter(**{
+            "pk__in": object_ids,
+            "{0}__isnull".format(field.rendered_attname): True,
+        }))
+
+
+class PrerenderedHtmlQueue(object):
+    
+    """
+    A queue of discarded pre-rendered HTML, rendered again by background
+    threads in the current process.
+    
+    HTML is only queued once the transaction that discarded it has finished,
+    so that the committed values are rendered. Any HTML still queued when the
+    process exits stays discarded, for the prerender_html command to render.
+    """
+    
+    def __init__(self):
+        """Initializes the PrerenderedHtmlQueue."""
+        self._queue = Queue.Queue()
+        self._threads_pid = None
+        self._lock = threading.Lock()
+    
+    def _start_threads(self):
+        """Starts the worker threads, if this process has not started them yet."""
+        with self._lock:
+            if self._threads_pid != os.getpid():
+                for _ in xrange(get_prerender_html_workers()):
+                    thread = threading.Thread(target=self._work)
+                    thread.daemon = True
+                    thread.start()
+                self._threads_pid = os.getpid()
+    
+    def _work(self):
+        """Renders queued HTML until the process exits."""
+        while True:
+            args = self._queue.get()
+            try:
+                render_discarded_html(*args)
+            except Exception:  # The HTML stays discarded, so the command will render it instead.
+                pass
+            finally:
+                for connection in connections.all():
+                    connection.close()
+                self._queue.task_done()
+    
+    def _submit(self, model, field, object_ids):
+        """Renders the given HTML in the background, or immediately if there are no worker threads."""
+        if not get_prerender_html_workers():
+            render_discarded_html(model, field, object_ids)
+            return
+        self._start_threads()
+        self._queue.put((model, field, object_ids))
+    
+    def add(self, model, field, object_ids):
+        """Queues the discarded HTML of the given objects to be rendered again."""
+        run_after_transaction(self._submit, model, field, tuple(object_ids))
+    
+    def join(self):
+        """Waits for all queued HTML to be rendered."""
+        self._queue.join()
+
+
+# A single, process-wide queue of discarded HTML.
+prerendered_html_queue = PrerenderedHtmlQueue()
+
+
+def discard_prerendered_html(dependencies):
+    """
+    Discards the pre-rendered HTML of the fields with the given HtmlDependency
+    queryset, and queues it to be rendered again.
+    """
+    object_ids = {}
+    for content_type_id, object_id, field_name in dependencies.values_list("content_type_id", "object_id", "field_name").distinct().iterator():
+        object_ids.setdefault((content_type_id, field_name), []).append(object_id)
+    for (content_type_id, field_name), field_object_ids in object_ids.iteritems():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            continue
+        field = model._meta.get_field(field_name)
+        for index in xrange(0, len(field_object_ids), PRERENDERED_HTML_BATCH_SIZE):
+            batch = field_object_ids[index:index + PRERENDERED_HTML_BATCH_SIZE]
+            model._base_manager.filter(
+                pk__in = batch,
+            ).update(**{
+                field.rendered_attname: None,
+            })
+            prerendered_html_queue.add(model, field, batch)
+
+
+def invalidate_prerendered_html(sender, instance, raw=False, **kwargs):
+    """Discards any pre-rendered HTML that links to the given object."""
+    # Models without URLs are never linked to by permalinks.
+    if raw or not prerendered_html_fields or not hasattr(sender, "get_absolute_url"):
+        return
+    discard_prerendered_html(HtmlDependency.objects.filter(
+        dependency_content_type = ContentType.objects.get_for_model(sender),
+        dependency_object_id = force_unicode(instance.pk),
+    ))
+
+models.signals.post_save.connect(invalidate_prerendered_html)
+models.signals.post_delete.connect(invalidate_prerendered_html)
+
+
+# Sent when the URLs of objects change without them being saved, such as the
+# pages below a moved page, with the model class as the sender. Receivers can
+# return a list of (model, object_ids) tuples of the objects whose URLs are
+# derived from them.
+urls_changed = Signal(providing_args=("object_ids",))
+
+
+def invalidate_prerendered_urls(model, object_ids):
+    """
+    Discards any pre-rendered HTML that links to the given objects, whose URLs
+    have changed without them being saved, or to the objects whose URLs are
+    derived from theirs.
+    """
+    if not prerendered_html_fields:
+        return
+    object_ids = list(object_ids)
+    content_type = ContentType.objects.get_for_model(model)
+    dependency_object_ids = [force_unicode(object_id) for object_id in object_ids]
+    for index in xrange(0, len(dependency_object_ids), PRERENDERED_HTML_BATCH_SIZE):
+        discard_prerendered_html(HtmlDependency.objects.filter(
+            dependency_content_type = content_type,
+            dependency_object_id__in = dependency_object_ids[index:index + PRERENDERED_HTML_BATCH_SIZE],
+        ))
+    for receiver, derived_urls in urls_changed.send(sender=model, object_ids=object_ids):
+        for derived_model, derived_object_ids in derived_urls or ():
+            invalidate_prerendered_urls(derived_model, derived_object_ids)
+
+
 class LinkResolutionError(Exception):
     
     """A link could not be resolved."""
@@ -3,9 +3,13 @@
 
 from __future__ import with_statement
 
-import threading, contextlib
+import threading, contextlib, calendar, math
+from datetime import timedelta
 
+from django.conf import settings
 from django.db import models
+from django.db.models.sql.where import AND
+from django.utils import timezone
 
 
 class PublicationManagementError(Exception):
@@ -28,20 +32,22 @@ class PublicationManager(threading.local):
         """Initializes the PublicationManager."""
         super(PublicationManager, self).__init__()
         self._stack = []
+        self._active = False
         
     def begin(self, select_published):
         """Starts a block using the given publication setting."""
         self._stack.append(select_published)
+        self._active = select_published
         
     def select_published_active(self):
         """
         Returns True if querysets should be filtered to exclude unpublished
         content.
+        
+        The current state is kept as a single attribute, so this is cheap
+        enough to call whenever a queryset is created.
         """
-        try:
-            return self._stack[-1]
-        except IndexError:
-            return False
+        return self._active
         
     def end(self):
         """Ends a block of publication control."""
@@ -49,6 +55,7 @@ class PublicationManager(threading.local):
             self._stack.pop()
         except IndexError:
             raise PublicationManagementError, "There is no active block of publication management."
+        self._active = self._stack[-1] if self._stack else False
         
     @contextlib.contextmanager
     def select_published(self, select_published):
@@ -66,6 +73,155 @@ class PublicationManager(threading.local):
 publication_manager = PublicationManager()
 
 
+def get_publication_clock_resolution():
+    """
+    Returns the number of seconds that the publication clock rounds the current
+    time down to. If zero, then the current time is used exactly.
+    """
+    return getattr(settings, "PUBLICATION_CLOCK_RESOLUTION", 60)
+
+
+class PublicationClock(object):
+    
+    """
+    The clock used to select content by its publication and expiry dates.
+    
+    The current time is rounded down to the resolution of the clock, so that
+    queries for published content are identical until the clock next ticks,
+    and their results can be cached. Content is published or expires on the
+    first tick at or after its publication or expiry date.
+    """
+    
+    def floor(self, date):
+        """Rounds the given date down to the last tick of the clock."""
+        resolution = get_publication_clock_resolution()
+        if not resolution:
+            return date
+        seconds = calendar.timegm(date.utctimetuple()) % resolution
+        return date.replace(microsecond=0) - timedelta(seconds=seconds)
+    
+    def now(self):
+        """Returns the current time, rounded down to the last tick of the clock."""
+        return self.floor(timezone.now())
+    
+    def get_effective_date(self, date):
+        """
+        Returns the time that a publication or expiry date takes effect, which
+        is the first tick of the clock at or after the date.
+        """
+        effective_date = self.floor(date)
+        if effective_date < date:
+            effective_date += timedelta(seconds=get_publication_clock_resolution())
+        return effective_date
+    
+    def get_timeout(self, date):
+        """
+        Returns the number of whole seconds until the given publication or
+        expiry date takes effect, for use as a cache timeout.
+        """
+        return int(math.floor((self.get_effective_date(date) - timezone.now()).total_seconds()))
+    
+    
+# A single, process-wide publication clock.
+publication_clock = PublicationClock()
+
+
+# The compiled published SQL, keyed by manager class, model, database and table alias.
+_published_sql = {}
+
+# The managers used to compile published SQL, keyed by manager class and model.
+_published_managers = {}
+
+
+def get_published_sql_manager_class(manager_cls):
+    """
+    Returns the class that defines the published SQL of the given manager
+    class. This is not a dynamically created subclass, such as the manager of
+    a related field, so it can be pickled.
+    """
+    for cls in manager_cls.__mro__:
+        if "get_published_sql" in cls.__dict__ or "get_published_params" in cls.__dict__:
+            return cls
+    return manager_cls
+
+
+def get_published_sql_manager(manager_cls, model):
+    """Returns an instance of the given manager class, used to compile the published SQL of the given model."""
+    key = (manager_cls, model)
+    try:
+        return _published_managers[key]
+    except KeyError:
+        manager = manager_cls()
+        manager.model = model
+        _published_managers[key] = manager
+        return manager
+
+
+class PublishedWhere(object):
+    
+    """
+    A node in the WHERE clause of a query that selects published rows, using
+    the SQL from a manager's get_published_sql().
+    
+    The SQL is compiled once for each model, database and table alias, and the
+    params are evaluated whenever the query is compiled. Only the model and
+    the class of the manager are stored, so that the query can be pickled.
+    """
+    
+    def __init__(self, manager_cls, model, alias):
+        """Initializes the PublishedWhere."""
+        self.manager_cls = get_published_sql_manager_class(manager_cls)
+        self.model = model
+        self.alias = alias
+    
+    def as_sql(self, qn, connection):
+        """Returns a tuple of (sql, params) for the given connection."""
+        manager = get_published_sql_manager(self.manager_cls, self.model)
+        key = (self.manager_cls, self.model, connection.alias, self.alias)
+        try:
+            sql = _published_sql[key]
+        except KeyError:
+            table = qn(self.alias)
+            sql = u"({0})".format(manager.get_published_sql().format(**dict(
+                (field.name, u"{0}.{1}".format(table, qn(field.column)))
+                for field
+                in self.model._meta.fields
+            )))
+            _published_sql[key] = sql
+        return sql, manager.get_published_params(connection)
+    
+    def relabel_aliases(self, change_map):
+        """Relabels the table alias, for when the query is used as a subquery."""
+        self.alias = change_map.get(self.alias, self.alias)
+    
+    def __deepcopy__(self, memo):
+        """Copies the node, without copying the model."""
+        return PublishedWhere(self.manager_cls, self.model, self.alias)
+
+
+# Whether each manager class can filter querysets using its published SQL.
+_uses_published_sql = {}
+
+
+def uses_published_sql(manager_cls):
+    """
+    Returns True if querysets of the given manager class can be filtered using
+    its get_published_sql(). This is not the case if a subclass overrides
+    select_published() without also overriding get_published_sql().
+    """
+    try:
+        return _uses_published_sql[manager_cls]
+    except KeyError:
+        mro = manager_cls.__mro__
+        def get_defining_index(name):
+            for index, cls in enumerate(mro):
+                if name in cls.__dict__:
+                    return index
+        uses_published_sql = get_defining_index("get_published_sql") <= get_defining_index("select_published")
+        _uses_published_sql[manager_cls] = uses_published_sql
+        return uses_published_sql
+
+
 class PublishedBaseManager(models.Manager):
     
     """Manager that fetches published models."""
@@ -80,14 +236,60 @@ class PublishedBaseManager(models.Manager):
         """
         return queryset
     
+    def get_published_sql(self):
+        """
+        Returns an SQL condition that selects the same items as
+        select_published(), with each column written as its field name in
+        braces, or None if querysets should be filtered using
+        select_published().
+        
+        Override this in subclasses along with select_published(), so that
+        querysets can be filtered without building the filter each time.
+        """
+        return None
+    
+    def get_published_params(self, connection):
+        """Returns the params of the SQL returned by get_published_sql()."""
+        return []
+    
+    def get_next_publication_change(self):
+        """
+        Returns the next publication or expiry date after the current time of
+        the publication clock, or None if no items are scheduled to change.
+        
+        Use publication_clock.get_timeout() to turn this into a cache timeout
+        for results that depend on the published items.
+        """
+        return None
+    
     def get_query_set(self):
         """"Returns the queryset, filtered if appropriate."""
         queryset = super(PublishedBaseManager, self).get_query_set()
         if publication_manager.select_published_active():
-            queryset = self.select_published(queryset)
+            if uses_published_sql(self.__class__) and self.get_published_sql() is not None:
+                queryset.query.where.add(PublishedWhere(self.__class__, self.model, queryset.query.get_initial_alias()), AND)
+            else:
+                queryset = self.select_published(queryset)
         return queryset
     
     
+def get_next_publication_change():
+    """
+    Returns the earliest next publication or expiry date of any model with a
+    published default manager, or None if no items are scheduled to change.
+    """
+    next_publication_changes = [
+        model._default_manager.get_next_publication_change()
+        for model
+        in models.get_models()
+        if isinstance(model._default_manager, PublishedBaseManager)
+    ]
+    next_publication_changes = [date for date in next_publication_changes if date is not None]
+    if next_publication_changes:
+        return min(next_publication_changes)
+    return None
+    
+    
 class OnlineBaseManager(PublishedBaseManager):
     
     """Publication manager that uses a simple online/offline flag."""
@@ -99,6 +301,14 @@ class OnlineBaseManager(PublishedBaseManager):
         queryset = super(OnlineBaseManager, self).select_published(queryset)
         return queryset.filter(is_online=True)
     
+    def get_published_sql(self):
+        """Returns an SQL condition that selects items marked as online."""
+        return u"{is_online} = %s"
+    
+    def get_published_params(self, connection):
+        """Returns the params of the SQL returned by get_published_sql()."""
+        return [True]
+    
     
 class SearchMetaBaseManager(OnlineBaseManager):
     
@@ -0,0 +1,221 @@
+"""
+Keyset pagination.
+
+Paginating a queryset by page number means counting every item, and scanning
+past every item on the earlier pages, so deep pages get slower as the queryset
+grows. Keyset pagination instead seeks to the items after the last item on the
+current page, using the values of the fields that the queryset is ordered by,
+so every page costs the same. Pages are identified by opaque cursors rather
+than numbers, and the total count is an approximation cached between requests.
+"""
+
+import base64, hashlib, json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage, EmptyPage
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+__all__ = ("InvalidCursor", "KeysetPaginator", "KeysetPage",)
+
+
+def get_keyset_count_cache_timeout():
+    """Returns the number of seconds to cache the approximate count of a paginated queryset for."""
+    return getattr(settings, "KEYSET_COUNT_CACHE_TIMEOUT", 60 * 10)
+
+
+class InvalidCursor(InvalidPage):
+    
+    """Exception thrown when a pagination cursor cannot be decoded."""
+
+
+# The directions that a cursor can seek in.
+CURSOR_AFTER = u"a"
+
+CURSOR_BEFORE = u"b"
+
+
+def encode_cursor(direction, values):
+    """Encodes the given direction and list of unicode values into an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps([direction] + values)).rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Decodes the given cursor into a tuple of (direction, values).
+    
+    Raises an InvalidCursor if the cursor is not valid.
+    """
+    try:
+        cursor = str(cursor)
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursor("'{0}' is not a valid cursor.".format(cursor))
+    if not isinstance(data, list) or not data or data[0] not in (CURSOR_AFTER, CURSOR_BEFORE):
+        raise InvalidCursor("'{0}' is not a valid cursor.".format(cursor))
+    return data[0], data[1:]
+
+
+class KeysetPaginator(object):
+    
+    """
+    Paginates a queryset by seeking to the items either side of a cursor.
+    
+    The ordering must uniquely identify each item, so it should end with the
+    primary key, and there should be an index on the ordering fields.
+    """
+    
+    is_keyset = True
+    
+    def __init__(self, queryset, per_page, ordering=("-pk",), allow_empty_first_page=True):
+        """Initializes the KeysetPaginator."""
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = ordering
+        self.allow_empty_first_page = allow_empty_first_page
+        # Look up the ordering fields.
+        opts = queryset.model._meta
+        self.fields = []
+        for field_name in ordering:
+            descending = field_name.startswith("-")
+            field_name = field_name.lstrip("-")
+            if field_name == "pk":
+                field = opts.pk
+            else:
+                field = opts.get_field(field_name)
+            self.fields.append((field, descending))
+    
+    @cached_property
+    def count(self):
+        """
+        Returns the approximate number of items in the queryset. The count is
+        cached between requests, so it might be slightly out of date.
+        """
+        sql, params = self.queryset.query.sql_with_params()
+        cache_key = "cms.pagination.count:{hash}".format(
+            hash = hashlib.md5(repr((sql, params)).encode("utf-8")).hexdigest(),
+        )
+        count = cache.get(cache_key)
+        if count is None:
+            count = self.queryset.count()
+            cache.set(cache_key, count, get_keyset_count_cache_timeout())
+        return count
+    
+    def get_cursor(self, direction, obj):
+        """Returns the cursor that seeks from the given object in the given direction."""
+        return encode_cursor(direction, [
+            field.value_to_string(obj)
+            for field, descending
+            in self.fields
+        ])
+    
+    def seek(self, queryset, direction, values):
+        """
+        Filters the queryset to the items after (or before) the item with the
+        given values of the ordering fields.
+        """
+        condition = Q()
+        for index, (field, descending) in enumerate(self.fields):
+            lookup = "lt" if descending == (direction == CURSOR_AFTER) else "gt"
+            field_condition = Q(**{"{0}__{1}".format(field.name, lookup): values[index]})
+            for previous_field, previous_value in zip(self.fields[:index], values[:index]):
+                field_condition &= Q(**{previous_field[0].name: previous_value})
+            condition |= field_condition
+        return queryset.filter(condition)
+    
+    def page(self, cursor=None):
+        """
+        Returns the KeysetPage for the given cursor, or the first page if no
+        cursor is given.
+        
+        Raises an InvalidCursor if the cursor is not valid, or an EmptyPage if
+        there are no items on the page.
+        """
+        direction = CURSOR_AFTER
+        queryset = self.queryset
+        if cursor:
+            direction, values = decode_cursor(cursor)
+            if len(values) != len(self.fields):
+                raise InvalidCursor("'{0}' is not a valid cursor.".format(cursor))
+            try:
+                values = [
+                    field.to_python(value)
+                    for (field, descending), value
+                    in zip(self.fields, values)
+                ]
+            except ValidationError:
+                raise InvalidCursor("'{0}' is not a valid cursor.".format(cursor))
+            queryset = self.seek(queryset, direction, values)
+        # Seeking backwards means reversing the ordering, then the items.
+        if direction == CURSOR_AFTER:
+            ordering = self.ordering
+        else:
+            ordering = [
+                field_name[1:] if field_name.startswith("-") else "-" + field_name
+                for field_name
+                in self.ordering
+            ]
+        object_list = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if direction == CURSOR_AFTER:
+            has_next = has_more
+            has_previous = bool(cursor)
+        else:
+            object_list.reverse()
+            has_next = True
+            has_previous = has_more
+        if not object_list and (cursor or not self.allow_empty_first_page):
+            raise EmptyPage("That page contains no results.")
+        return KeysetPage(object_list, self, has_next, has_previous)
+
+
+class KeysetPage(object):
+    
+    """A page of items from a KeysetPaginator."""
+    
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        """Initializes the KeysetPage."""
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+    
+    def __repr__(self):
+        """Returns a debugging representation of the page."""
+        return "<Keyset page of {0} items>".format(len(self.object_list))
+    
+    def __len__(self):
+        """Returns the number of items on the page."""
+        return len(self.object_list)
+    
+    def __getitem__(self, index):
+        """Returns the item at the given index."""
+        return self.object_list[index]
+    
+    def has_next(self):
+        """Checks whether there is a page after this one."""
+        return self._has_next
+    
+    def has_previous(self):
+        """Checks whether there is a page before this one."""
+        return self._has_previous
+    
+    def has_other_pages(self):
+        """Checks whether there are any other pages."""
+        return self._has_next or self._has_previous
+    
+    def next_cursor(self):
+        """Returns the cursor of the next page, or None."""
+        if self._has_next and self.object_list:
+            return self.paginator.get_cursor(CURSOR_AFTER, self.object_list[-1])
+        return None
+    
+    def previous_cursor(self):
+        """Returns the cursor of the previous page, or None."""
+        if self._has_previous and self.object_list:
+            return self.paginator.get_cursor(CURSOR_BEFORE, self.object_list[0])
+        return None
@@ -5,14 +5,28 @@ A permalink is a model and object id encoded into a URL.  It allows the model to
 change it's absolute URL without breaking links.
 """
 
+from __future__ import with_statement
 
+import re, threading, uuid
+from collections import OrderedDict
+
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.contrib.contenttypes.views import shortcut
 from django.core import urlresolvers
-from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import cache
+from django.db.models import signals
+from django.dispatch import Signal
+from django.utils.encoding import force_unicode
+
+from cms.invalidation import URL_VERSION_KEY, invalidate
+from cms.models.managers import publication_manager
+
+
+__all__ = ("PermalinkError", "permalink_resolved", "create", "parse", "resolve", "resolve_many", "expand",)
 
 
-__all__ = ("PermalinkError", "create", "resolve", "expand",)
+# Sent whenever a permalink is resolved, with the model class as the sender.
+permalink_resolved = Signal(providing_args=("object_id",))
 
 
 class PermalinkError(Exception):
@@ -29,6 +43,71 @@ def create(obj):
               "object_id": object_id}
     return urlresolvers.reverse("permalink_redirect", kwargs=kwargs)
     
+
+# Placeholder values used to find the format of the permalink URL.
+PERMALINK_CONTENT_TYPE_PLACEHOLDER = "987654321"
+
+PERMALINK_OBJECT_PLACEHOLDER = "OBJECT_ID"
+
+# Compiled permalink patterns and URL prefixes, keyed by script prefix.
+_permalink_patterns = {}
+
+
+def _get_permalink_pattern_and_prefix():
+    """
+    Returns a tuple of (pattern, prefix), where pattern is a compiled regular
+    expression that matches permalinks, and prefix is the text that all
+    permalinks start with, based on the URL of the permalink_redirect view.
+    """
+    script_prefix = urlresolvers.get_script_prefix()
+    try:
+        return _permalink_patterns[script_prefix]
+    except KeyError:
+        permalink = urlresolvers.reverse("permalink_redirect", kwargs={
+            "content_type_id": PERMALINK_CONTENT_TYPE_PLACEHOLDER,
+            "object_id": PERMALINK_OBJECT_PLACEHOLDER,
+        })
+        pattern = re.compile(u"^{0}$".format(re.escape(permalink).replace(
+            re.escape(PERMALINK_CONTENT_TYPE_PLACEHOLDER), ur"(?P<content_type_id>\d+)", 1,
+        ).replace(
+            re.escape(PERMALINK_OBJECT_PLACEHOLDER), ur"(?P<object_id>[^/]+)", 1,
+        )))
+        prefix = permalink.split(PERMALINK_CONTENT_TYPE_PLACEHOLDER, 1)[0].split(PERMALINK_OBJECT_PLACEHOLDER, 1)[0]
+        _permalink_patterns[script_prefix] = (pattern, prefix)
+        return pattern, prefix
+
+
+def get_permalink_pattern():
+    """
+    Returns a compiled regular expression that matches permalinks, based on
+    the URL of the permalink_redirect view.
+    """
+    return _get_permalink_pattern_and_prefix()[0]
+
+
+def get_permalink_prefix():
+    """
+    Returns the text that all permalinks start with, based on the URL of the
+    permalink_redirect view.
+    """
+    return _get_permalink_pattern_and_prefix()[1]
+
+
+def parse(permalink):
+    """
+    Parses the given permalink into a tuple of (content_type_id, object_id),
+    without going through the URL resolver.
+    
+    Raises a PermalinkError if the URL is not a valid permalink.
+    """
+    try:
+        match = get_permalink_pattern().match(permalink)
+    except (urlresolvers.NoReverseMatch, TypeError):
+        match = None
+    if match is None:
+        raise PermalinkError, "'%s' is not a valid permalink." % permalink
+    return int(match.group("content_type_id")), match.group("object_id")
+    
     
 def resolve(permalink):
     """
@@ -37,26 +116,171 @@ def resolve(permalink):
     Raises a PermalinkError if the URL is not a valid permalink. Raises an
     ObjectDoesNotExist if the referenced object does not exist.
     """
-    # Attempt to resolve the URL.
-    try:
-        callback, _, callback_kwargs = urlresolvers.resolve(permalink)  # @UnusedVariable
-    except (urlresolvers.Resolver404, TypeError):
-        raise PermalinkError, "'%s' is not a valid permalink." % permalink
-    # Check if the URL refers to a permalink.
-    if callback != shortcut:
-        raise PermalinkError, "'%s' is not a valid permalink." % permalink
-    # Get the permalink attributes.
-    try:
-        content_type_id = callback_kwargs["content_type_id"]
-        object_id = callback_kwargs["object_id"]
-    except KeyError:
-        raise ImproperlyConfigured, "The permalink_redirect view should be configured using keyword arguments."
+    content_type_id, object_id = parse(permalink)
     # Resolve the object. 
     content_type = ContentType.objects.get_for_id(content_type_id)
+    permalink_resolved.send(sender=content_type.model_class(), object_id=object_id)
     obj = content_type.get_object_for_this_type(id=object_id)
     return obj
 
 
+def get_permalink_cache_size():
+    """Returns the maximum number of resolved permalinks to cache in each process."""
+    return getattr(settings, "PERMALINK_CACHE_SIZE", 1000)
+
+
+def get_permalink_version_key(model):
+    """Returns the cache key of the version of the given model's permalinks."""
+    return "cms.permalinks.version:{app_label}.{model_name}".format(
+        app_label = model._meta.app_label,
+        model_name = model._meta.object_name.lower(),
+    )
+
+
+class ResolvedPermalink(object):
+    
+    """A permalink that has been resolved into an object."""
+    
+    def __init__(self, obj):
+        """Initializes the ResolvedPermalink."""
+        self.obj = obj
+        self.url = obj.get_absolute_url()
+        self.title = getattr(obj, "title", None)
+        if self.title is None:
+            self.title = unicode(obj)
+
+
+class PermalinkCache(object):
+    
+    """
+    A process-level LRU cache of resolved permalinks.
+    
+    Entries are stored with the version of their content type, which is shared
+    between processes using the default cache, and changes whenever an object of
+    that type is saved or deleted, and with the URL version, which changes
+    whenever the URLs of all objects might have changed.
+    """
+    
+    def __init__(self):
+        """Initializes the PermalinkCache."""
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        
+    def get(self, key, version):
+        """Returns the cached entry for the given key and version, or raises a KeyError."""
+        with self._lock:
+            entry_version, resolved_permalink = self._entries.pop(key)
+            if entry_version != version:
+                raise KeyError(key)
+            self._entries[key] = (entry_version, resolved_permalink)
+        return resolved_permalink
+        
+    def set(self, key, version, resolved_permalink):
+        """Caches the given entry, discarding the least recently used entries."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (version, resolved_permalink)
+            while len(self._entries) > get_permalink_cache_size():
+                self._entries.popitem(last=False)
+                
+    def clear(self):
+        """Removes all cached entries."""
+        with self._lock:
+            self._entries.clear()
+
+
+# A single, process-wide permalink cache.
+permalink_cache = PermalinkCache()
+
+
+def get_permalink_versions(models):
+    """
+    Returns a dictionary of the current permalink versions of the given models,
+    each combined with the URL version.
+    """
+    keys = dict(
+        (get_permalink_version_key(model), model)
+        for model
+        in models
+    )
+    versions = cache.get_many(keys.keys() + [URL_VERSION_KEY])
+    for key in keys.keys() + [URL_VERSION_KEY]:
+        if key not in versions:
+            version = uuid.uuid4().hex
+            if not cache.add(key, version):
+                version = cache.get(key, version)
+            versions[key] = version
+    return dict(
+        (model, (versions[URL_VERSION_KEY], versions[key]))
+        for key, model
+        in keys.iteritems()
+    )
+
+
+def resolve_many(permalinks):
+    """
+    Resolves the given permalinks, returning a dictionary mapping each valid
+    permalink to a ResolvedPermalink, or None if the referenced object does not
+    exist. Invalid permalinks are left out.
+    
+    Objects are fetched using a single query for each content type, and are
+    cached between calls.
+    """
+    parsed_permalinks = {}
+    for permalink in permalinks:
+        try:
+            content_type_id, object_id = parse(permalink)
+        except PermalinkError:
+            continue
+        try:
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+        except ContentType.DoesNotExist:
+            continue
+        if model is not None:
+            parsed_permalinks[permalink] = (model, object_id)
+    if not parsed_permalinks:
+        return {}
+    versions = get_permalink_versions(set(model for model, object_id in parsed_permalinks.itervalues()))
+    select_published = publication_manager.select_published_active()
+    # Look up the permalinks in the cache.
+    resolved_permalinks = {}
+    missing_permalinks = {}
+    for permalink, (model, object_id) in parsed_permalinks.iteritems():
+        permalink_resolved.send(sender=model, object_id=object_id)
+        try:
+            resolved_permalinks[permalink] = permalink_cache.get((select_published, model, object_id), versions[model])
+        except KeyError:
+            missing_permalinks.setdefault(model, {}).setdefault(object_id, []).append(permalink)
+    # Fetch the missing objects.
+    for model, permalinks_by_object_id in missing_permalinks.iteritems():
+        try:
+            objs = model._base_manager.in_bulk(permalinks_by_object_id.keys())
+        except (ValueError, TypeError):
+            objs = {}
+        objs = dict((force_unicode(object_id), obj) for object_id, obj in objs.iteritems())
+        for object_id, object_permalinks in permalinks_by_object_id.iteritems():
+            obj = objs.get(force_unicode(object_id))
+            if obj is None:
+                resolved_permalink = None
+            else:
+                resolved_permalink = ResolvedPermalink(obj)
+            permalink_cache.set((select_published, model, object_id), versions[model], resolved_permalink)
+            for permalink in object_permalinks:
+                resolved_permalinks[permalink] = resolved_permalink
+    return resolved_permalinks
+
+
+def invalidate_permalinks(sender, **kwargs):
+    """Invalidates the cached permalinks of the model that was saved or deleted."""
+    # Models without URLs are never resolved from permalinks.
+    if not hasattr(sender, "get_absolute_url"):
+        return
+    invalidate(cache.delete, get_permalink_version_key(sender))
+
+signals.post_save.connect(invalidate_permalinks)
+signals.post_delete.connect(invalidate_permalinks)
+
+
 def expand(permalink):
     """
     Expands the given permalink into a full URL.
@@ -12,6 +12,8 @@ class Migration(SchemaMigration):
         db.create_table('site_content', (
             ('page', self.gf('django.db.models.fields.related.OneToOneField')(related_name='+', unique=True, primary_key=True, to=orm['pages.Page'])),
             ('content_primary', self.gf('cms.models.fields.HtmlField')(blank=True)),
+            ('content_primary_rendered', self.gf('django.db.models.fields.TextField')(null=True)),
+            ('content_primary_dependencies', self.gf('django.db.models.fields.TextField')(blank=True)),
         ))
         db.send_create_signal('site', ['Content'])
 
@@ -53,6 +55,8 @@ class Migration(SchemaMigration):
         'site.content': {
             'Meta': {'object_name': 'Content'},
             'content_primary': ('cms.models.fields.HtmlField', [], {'blank': 'True'}),
+            'content_primary_dependencies': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'content_primary_rendered': ('django.db.models.fields.TextField', [], {'null': 'True'}),
             'page': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'+'", 'unique': 'True', 'primary_key': 'True', 'to': "orm['pages.Page']"})
         }
     }
@@ -8,5 +8,6 @@ class Content(ContentBase):
     
     content_primary = HtmlField(
         "primary content",
-        blank = True
+        blank = True,
+        prerender = True,
     )
\ No newline at end of file
@@ -9,7 +9,7 @@ This file should be excluded from version control to keep the settings local.
 
 import os.path
 
-from production import DATABASES
+from production import DATABASES, CACHES
 
 
 # Run in debug mode.
@@ -41,6 +41,13 @@ TEMPLATE_LOADERS = (
 )
 
 
+# Use a local memory cache, which disables the page cache.
+
+CACHES["default"] = {
+    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+}
+
+
 # Optional separate database settings
 
 #DATABASES["default"]["NAME"] = ""
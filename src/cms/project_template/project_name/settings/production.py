@@ -158,6 +158,7 @@ MIDDLEWARE_CLASSES = (
     "watson.middleware.SearchContextMiddleware",
     "historylinks.middleware.HistoryLinkFallbackMiddleware",
     "cms.middleware.PublicationMiddleware",
+    "cms.apps.pages.middleware.PageCacheMiddleware",
     "cms.apps.pages.middleware.PageMiddleware",
 )
 
@@ -206,9 +207,13 @@ TEMPLATE_CONTEXT_PROCESSORS = (
 
 CACHE_MIDDLEWARE_KEY_PREFIX = "{{ project_name }}"
 
+# The page cache and page tree share versions between processes using the
+# default cache, so it must be a process-shared cache.
+
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
+        "LOCATION": "127.0.0.1:11211",
     },
     # Used for efficient caching of static assets.
     "optimizations": {
@@ -1,13 +1,36 @@
-"""Google sitemaps used by the page managment application."""
+"""
+Google sitemaps used by the page managment application.
+
+Registered sitemaps can be streamed, one shard of at most limit items at a
+time, without loading every item into memory. Shards can also be built in
+advance as gzipped files, using the build_sitemaps management command. Pre-built
+files are used until an item in their section is saved or deleted, the URLs of
+objects change, such as when a page is renamed or moved, or the next item of
+any model is published or expires.
+"""
+
+from __future__ import with_statement
+
+import gzip, math, tempfile, uuid
+from xml.sax.saxutils import escape
 
 from django.contrib.sitemaps import Sitemap
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import signals
+from django.utils import timezone
 
-from cms.models import PublishedBase, OnlineBase, SearchMetaBase, PageBase
+from cms.invalidation import invalidate, get_url_version
+from cms.models import PublishedBase, OnlineBase, SearchMetaBase, PageBase, publication_clock, get_next_publication_change
 
 
 # A dictionary of registered sitemap classes.
 registered_sitemaps = {}
 
+# The registration keys of the sitemaps of each model.
+_sitemap_sections = {}
+
 
 class BaseSitemap(Sitemap):
     
@@ -19,10 +42,80 @@ class BaseSitemap(Sitemap):
     
     model = None
     
+    # The fields that are loaded for each item, or None to load all fields.
+    only_fields = None
+    
+    # The number of items to load from the database at a time.
+    batch_size = 1000
+    
     def items(self):
         """Returns all items in this sitemap."""
         return self.model.objects.all()
     
+    def get_shard_count(self):
+        """Returns the number of shards in this sitemap."""
+        return max(1, int(math.ceil(self.items().count() / float(self.limit))))
+    
+    def prepare_batch(self, items):
+        """
+        Called with each batch of items before their URLs are generated, to allow
+        any data they need to be loaded in bulk.
+        """
+    
+    def iter_items(self, shard=1):
+        """
+        Yields the items in the given shard, in primary key order.
+        
+        The items are loaded in batches, each starting after the primary key of
+        the previous batch, so that memory use is constant.
+        """
+        queryset = self.items().order_by("pk")
+        if self.only_fields is not None:
+            queryset = queryset.only(*self.only_fields)
+        batch_queryset = queryset
+        offset = (shard - 1) * self.limit
+        if offset:
+            try:
+                start_pk = queryset.values_list("pk", flat=True)[offset]
+            except IndexError:
+                return
+            batch_queryset = queryset.filter(pk__gte=start_pk)
+        remaining = self.limit
+        while remaining > 0:
+            batch = list(batch_queryset[:min(self.batch_size, remaining)])
+            if not batch:
+                return
+            self.prepare_batch(batch)
+            for item in batch:
+                yield item
+            remaining -= len(batch)
+            batch_queryset = queryset.filter(pk__gt=batch[-1].pk)
+    
+    def _get_item_value(self, name, item):
+        """Returns the given sitemap attribute for the item."""
+        value = getattr(self, name, None)
+        if callable(value):
+            return value(item)
+        return value
+    
+    def iter_urls(self, shard, domain, protocol):
+        """Yields a dictionary describing the URL of each item in the given shard."""
+        if self.protocol is not None:
+            protocol = self.protocol
+        for item in self.iter_items(shard):
+            priority = self._get_item_value("priority", item)
+            yield {
+                "item": item,
+                "location": u"{protocol}://{domain}{path}".format(
+                    protocol = protocol,
+                    domain = domain,
+                    path = self._get_item_value("location", item),
+                ),
+                "lastmod": self._get_item_value("lastmod", item),
+                "changefreq": self._get_item_value("changefreq", item),
+                "priority": str(priority is not None and priority or ""),
+            }
+    
     
 class PublishedBaseSitemap(BaseSitemap):
     
@@ -97,4 +190,135 @@ def register(model, sitemap_cls=None):
             "model": model,
         })
     # Register the sitemap.
-    registered_sitemaps[registration_key] = sitemap_cls
\ No newline at end of file
+    registered_sitemaps[registration_key] = sitemap_cls
+    _sitemap_sections.setdefault(model, []).append(registration_key)
+
+
+# Writing sitemap XML.
+
+def iter_sitemap_xml(urls):
+    """Yields the chunks of a sitemap XML document for the given URL dictionaries."""
+    yield u'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for url in urls:
+        parts = [u"<url><loc>", escape(url["location"]), u"</loc>"]
+        if url["lastmod"]:
+            parts.extend((u"<lastmod>", url["lastmod"].strftime("%Y-%m-%d"), u"</lastmod>"))
+        if url["changefreq"]:
+            parts.extend((u"<changefreq>", escape(url["changefreq"]), u"</changefreq>"))
+        if url["priority"]:
+            parts.extend((u"<priority>", escape(url["priority"]), u"</priority>"))
+        parts.append(u"</url>\n")
+        yield u"".join(parts)
+    yield u"</urlset>\n"
+
+
+def iter_sitemap_index_xml(locations):
+    """Yields the chunks of a sitemap index XML document for the given sitemap URLs."""
+    yield u'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for location in locations:
+        yield u"<sitemap><loc>{0}</loc></sitemap>\n".format(escape(location))
+    yield u"</sitemapindex>\n"
+
+
+# Pre-built sitemap files.
+
+def get_sitemap_version_key(section):
+    """Returns the cache key of the version of the given sitemap section."""
+    return u"cms.sitemaps.version:{section}".format(
+        section = section,
+    )
+
+
+def get_sitemap_build_key(section):
+    """Returns the cache key that records the pre-built files of the given sitemap section."""
+    return u"cms.sitemaps.build:{section}".format(
+        section = section,
+    )
+
+
+def get_sitemap_version(section):
+    """Returns the current version of the given sitemap section."""
+    key = get_sitemap_version_key(section)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version):
+            version = cache.get(key, version)
+    return version
+
+
+def get_prebuilt_sitemap_name(section, shard):
+    """Returns the storage name of the given pre-built sitemap shard."""
+    return u"sitemaps/sitemap-{section}-{shard}.xml.gz".format(
+        section = section,
+        shard = shard,
+    )
+
+
+def get_sitemap_build(section):
+    """
+    Returns a dictionary describing the pre-built files of the given sitemap
+    section, or None if they have not been built, or are out of date.
+    """
+    build = cache.get(get_sitemap_build_key(section))
+    if build is None or build["version"] != get_sitemap_version(section) or build["url_version"] != get_url_version():
+        return None
+    next_publication_change = build["next_publication_change"]
+    if next_publication_change is not None and publication_clock.get_effective_date(next_publication_change) <= timezone.now():
+        return None
+    return build
+
+
+def get_prebuilt_sitemap(section, shard, domain, protocol):
+    """
+    Returns the storage name of the given pre-built sitemap shard, or None if it
+    has not been built, or is out of date.
+    """
+    build = get_sitemap_build(section)
+    if build is None:
+        return None
+    if (build["domain"], build["protocol"]) != (domain, protocol) or not 1 <= shard <= build["shards"]:
+        return None
+    return get_prebuilt_sitemap_name(section, shard)
+
+
+def build_sitemap(section, sitemap, domain, protocol):
+    """
+    Writes gzipped sitemap files for each shard of the given sitemap section to
+    the default file storage, returning the number of shards written.
+    """
+    version = get_sitemap_version(section)
+    url_version = get_url_version()
+    next_publication_change = get_next_publication_change()
+    shards = sitemap.get_shard_count()
+    for shard in xrange(1, shards + 1):
+        name = get_prebuilt_sitemap_name(section, shard)
+        with tempfile.TemporaryFile() as handle:
+            with gzip.GzipFile(filename=name.rsplit("/", 1)[-1][:-3], mode="wb", fileobj=handle) as gzip_handle:
+                for chunk in iter_sitemap_xml(sitemap.iter_urls(shard, domain, protocol)):
+                    gzip_handle.write(chunk.encode("utf-8"))
+            size = handle.tell()
+            handle.seek(0)
+            sitemap_file = File(handle)
+            sitemap_file.size = size
+            default_storage.delete(name)
+            default_storage.save(name, sitemap_file)
+    cache.set(get_sitemap_build_key(section), {
+        "version": version,
+        "url_version": url_version,
+        "next_publication_change": next_publication_change,
+        "shards": shards,
+        "domain": domain,
+        "protocol": protocol,
+    })
+    return shards
+
+
+def invalidate_sitemaps(sender, **kwargs):
+    """Marks the pre-built sitemaps of the model that was saved or deleted as out of date."""
+    sections = _sitemap_sections.get(sender)
+    if sections:
+        invalidate(cache.delete_many, tuple(get_sitemap_version_key(section) for section in sections))
+
+signals.post_save.connect(invalidate_sitemaps)
+signals.post_delete.connect(invalidate_sitemaps)
\ No newline at end of file
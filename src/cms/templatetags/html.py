@@ -1,10 +1,13 @@
 """Template tags used for processing HTML."""
 
 from django import template
+from django.contrib.contenttypes.models import ContentType
 from django.utils.safestring import mark_safe
 from django.template.defaultfilters import stringfilter
 
 from cms.html import process as process_html
+from cms.models.managers import publication_manager
+from cms.permalinks import permalink_resolved
 
 
 register = template.Library()
@@ -19,9 +22,17 @@ def html(text):
     The text is checked for permalinks embedded in <a> tags, expanding the
     permalinks to their referenced URL. Images containing a permalink source
     are checked for size and thumbnailed as appropriate.
+    
+    If the text comes from a HtmlField with pre-rendered HTML, then the stored
+    HTML is used for published views.
     """
     if not text:
         return ""
+    rendered = getattr(text, "rendered", None)
+    if rendered is not None and publication_manager.select_published_active():
+        for content_type_id, object_id in text.dependencies:
+            permalink_resolved.send(sender=ContentType.objects.get_for_id(content_type_id).model_class(), object_id=object_id)
+        return mark_safe(rendered)
     text = process_html(text)
     return mark_safe(text)
 
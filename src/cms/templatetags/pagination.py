@@ -41,11 +41,14 @@ def pagination(context, page_obj, pagination_key=None):
 
 @register.simple_tag(takes_context=True)
 def pagination_url(context, page_number):
-    """Renders the URL for the given page number."""
+    """
+    Renders the URL for the given page number, or the given cursor if the items
+    are paginated by cursor.
+    """
     request = context["request"]
     url = request.path
     params = request.GET.copy()
-    if unicode(page_number) != u"1":
+    if page_number and unicode(page_number) != u"1":
         params[context.get("pagination_key", "page")] = page_number
     else:
         params.pop(context.get("pagination_key", "page"), None)
@@ -1,6 +1,24 @@
+from datetime import date, datetime, timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
 
+from cms import permalinks
+from cms.html import tokenize
+from cms.invalidation import invalidate_urls, run_pending_invalidations
+from cms.pagination import KeysetPaginator, InvalidCursor
+from cms.models import publication_manager, publication_clock, get_next_publication_change
 from cms.models.fields import resolve_link, LinkResolutionError
+from cms.thumbnails import get_thumbnail, get_thumbnail_cache_key, thumbnail_pool
+from cms.apps.media.models import File
+from cms.apps.pages.models import Page
+from cms.apps.news.models import NewsFeed, Article, Category, get_news_feed_category_list
+from cms.apps.news.feeds import RenderedFeed, get_rendered_feed_version, get_cached_feed, set_cached_feed
 
 
 class TestLinkField(TestCase):
@@ -10,4 +28,374 @@ class TestLinkField(TestCase):
         self.assertEqual(resolve_link("www.example.com/foo/"), "http://www.example.com/foo/")
         self.assertEqual(resolve_link("www.example.com"), "http://www.example.com/")
         self.assertEqual(resolve_link("/foo/"), "/foo/")
-        self.assertRaises(LinkResolutionError, lambda: resolve_link("foo/"))
\ No newline at end of file
+        self.assertRaises(LinkResolutionError, lambda: resolve_link("foo/"))
+
+
+class TestHtml(TestCase):
+    
+    def testTokenize(self):
+        text = u"""<p><A HREF="/r/1-2/" class=external>Link</a> <img src='/r/3-4/' width="10" height=20 /> <a title="a > b" href="/foo/"> <a name> <img <span></p>"""
+        tags = list(tokenize(text))
+        self.assertEqual([text[tag.start:tag.end] for tag in tags], [
+            u'<A HREF="/r/1-2/" class=external>',
+            u"<img src='/r/3-4/' width=\"10\" height=20 />",
+            u'<a title="a > b" href="/foo/">',
+            u"<a name>",
+        ])
+        self.assertEqual([tag.link for tag in tags], [u"/r/1-2/", u"/r/3-4/", u"/foo/", None])
+        self.assertEqual(tags[1].get("height"), u"20")
+        self.assertEqual(text[tags[1].attrs_end:tags[1].end], u" />")
+
+
+def is_worker_detached():
+    """Checks whether a thumbnail worker process has detached from its inherited database connection."""
+    return connection.connection is None
+
+
+class TestThumbnails(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        with override_settings(THUMBNAIL_WORKERS=0):
+            self.obj = File.objects.create(
+                title = "Missing",
+                file = "uploads/files/missing.png",
+            )
+    
+    def tearDown(self):
+        thumbnail_pool.join()
+    
+    @override_settings(THUMBNAIL_WORKERS=0)
+    def testSynchronousThumbnail(self):
+        self.assertRaises(IOError, lambda: get_thumbnail(self.obj.file, 50, 50))
+    
+    @override_settings(THUMBNAIL_WORKERS=0, THUMBNAIL_FAILURE_CACHE_TIMEOUT=0)
+    def testFailuresAreNotRemembered(self):
+        self.assertRaises(IOError, lambda: get_thumbnail(self.obj.file, 50, 50))
+        self.assertEqual(cache.get(get_thumbnail_cache_key(self.obj.file, 50, 50, "resize")), None)
+    
+    @override_settings(THUMBNAIL_WORKERS=1)
+    def testBackgroundThumbnail(self):
+        thumbnail = get_thumbnail(self.obj.file, 50, 40)
+        self.assertTrue(thumbnail.pending)
+        self.assertEqual((thumbnail.url, thumbnail.width, thumbnail.height), (self.obj.file.url, 50, 40))
+        thumbnail_pool.join()
+        self.assertRaises(IOError, lambda: get_thumbnail(self.obj.file, 50, 40))
+    
+    @override_settings(THUMBNAIL_WORKERS=1)
+    def testWorkersDetachFromConnections(self):
+        self.assertTrue(connection.connection is not None)
+        self.assertTrue(thumbnail_pool._get_pool().apply(is_worker_detached))
+        # The connection of the parent process is still usable.
+        self.assertEqual(File.objects.get(id=self.obj.id), self.obj)
+
+
+
+class TestPublicationClock(TestCase):
+    
+    @override_settings(PUBLICATION_CLOCK_RESOLUTION=60)
+    def testClockRounding(self):
+        date = datetime(2013, 1, 1, 12, 30, 15, 500)
+        self.assertEqual(publication_clock.floor(date), datetime(2013, 1, 1, 12, 30))
+        self.assertEqual(publication_clock.get_effective_date(date), datetime(2013, 1, 1, 12, 31))
+        self.assertEqual(publication_clock.get_effective_date(datetime(2013, 1, 1, 12, 31)), datetime(2013, 1, 1, 12, 31))
+        with override_settings(PUBLICATION_CLOCK_RESOLUTION=0):
+            self.assertEqual(publication_clock.floor(date), date)
+    
+    @override_settings(PUBLICATION_CLOCK_RESOLUTION=60)
+    def testPublishedQueriesAreIdentical(self):
+        with publication_manager.select_published(True):
+            self.assertEqual(Page.objects.all().query.sql_with_params(), Page.objects.all().query.sql_with_params())
+    
+    def testNextPublicationChange(self):
+        self.assertEqual(Article.objects.get_next_publication_change(), None)
+        news_feed = NewsFeed.objects.create(page=Page.objects.create(
+            title = "News",
+            content_type = ContentType.objects.get_for_model(NewsFeed),
+        ))
+        Article.objects.create(news_feed=news_feed, title="Upcoming", url_title="upcoming", date=date(2050, 1, 2))
+        Article.objects.create(news_feed=news_feed, title="Later", url_title="later", date=date(2050, 2, 1))
+        self.assertEqual(Article.objects.get_next_publication_change(), datetime(2050, 1, 2, tzinfo=timezone.utc))
+        # Cached pages expire when the article is published.
+        self.assertEqual(get_next_publication_change(), datetime(2050, 1, 2, tzinfo=timezone.utc))
+    
+    @override_settings(PUBLICATION_CLOCK_RESOLUTION=60)
+    def testTimeout(self):
+        publication_date = timezone.now() + timedelta(seconds=30)
+        self.assertTrue(0 < publication_clock.get_timeout(publication_date) <= 90)
+        self.assertEqual(publication_clock.get_effective_date(publication_date).second, 0)
+
+
+class TestKeysetPagination(TestCase):
+    
+    def setUp(self):
+        news_feed = NewsFeed.objects.create(page=Page.objects.create(
+            title = "News",
+            content_type = ContentType.objects.get_for_model(NewsFeed),
+        ))
+        for n in range(5):
+            Article.objects.create(news_feed=news_feed, title="Article {0}".format(n), url_title="article-{0}".format(n), date=date(2013, 1, 1 + n // 2))
+        self.articles = list(Article.objects.order_by("-date", "-id"))
+        self.paginator = KeysetPaginator(Article.objects.all(), 2, ordering=("-date", "-id"))
+    
+    def testPaginateForwardsAndBackwards(self):
+        page_1 = self.paginator.page()
+        self.assertEqual(list(page_1), self.articles[:2])
+        self.assertFalse(page_1.has_previous())
+        self.assertEqual(page_1.previous_cursor(), None)
+        page_2 = self.paginator.page(page_1.next_cursor())
+        self.assertEqual(list(page_2), self.articles[2:4])
+        page_3 = self.paginator.page(page_2.next_cursor())
+        self.assertEqual(list(page_3), self.articles[4:])
+        self.assertFalse(page_3.has_next())
+        self.assertEqual(page_3.next_cursor(), None)
+        page_2 = self.paginator.page(page_3.previous_cursor())
+        self.assertEqual(list(page_2), self.articles[2:4])
+        self.assertTrue(page_2.has_next())
+        page_1 = self.paginator.page(page_2.previous_cursor())
+        self.assertEqual(list(page_1), self.articles[:2])
+        self.assertFalse(page_1.has_previous())
+    
+    def testInvalidCursor(self):
+        self.assertRaises(InvalidCursor, lambda: self.paginator.page("foo"))
+        self.assertRaises(InvalidCursor, lambda: self.paginator.page("WyJhIl0"))
+    
+    def testApproximateCount(self):
+        cache.clear()
+        self.assertEqual(self.paginator.count, 5)
+        Article.objects.all()[0].delete()
+        self.assertEqual(KeysetPaginator(Article.objects.all(), 2, ordering=("-date", "-id")).count, 5)
+        cache.clear()
+        self.assertEqual(KeysetPaginator(Article.objects.all(), 2, ordering=("-date", "-id")).count, 4)
+
+
+class TestNewsFeedCache(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        self.news_feed = NewsFeed.objects.create(page=Page.objects.create(
+            title = "News",
+            content_type = ContentType.objects.get_for_model(NewsFeed),
+        ))
+        self.rendered_feed = RenderedFeed("<rss></rss>", "application/rss+xml", last_modified=1000000000)
+        self.factory = RequestFactory()
+    
+    def testConditionalGet(self):
+        response = self.rendered_feed.get_response(self.factory.get("/"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, "<rss></rss>")
+        response = self.rendered_feed.get_response(self.factory.get("/", HTTP_IF_NONE_MATCH=response["ETag"]))
+        self.assertEqual(response.status_code, 304)
+        response = self.rendered_feed.get_response(self.factory.get("/", HTTP_IF_NONE_MATCH='"foo"'))
+        self.assertEqual(response.status_code, 200)
+        response = self.rendered_feed.get_response(self.factory.get("/", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]))
+        self.assertEqual(response.status_code, 304)
+    
+    def testGzip(self):
+        response = self.rendered_feed.get_response(self.factory.get("/", HTTP_ACCEPT_ENCODING="gzip"))
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response.content, self.rendered_feed.gzip_content)
+    
+    def testSavingArticleInvalidatesFeed(self):
+        page_id = self.news_feed.page_id
+        set_cached_feed(page_id, get_rendered_feed_version(page_id), self.rendered_feed, 60)
+        self.assertEqual(get_cached_feed(page_id).etag, self.rendered_feed.etag)
+        article = Article.objects.create(news_feed=self.news_feed, title="Article", url_title="article")
+        self.assertEqual(get_cached_feed(page_id), None)
+        # Moving an article invalidates the feed that it was moved from.
+        other_news_feed = NewsFeed.objects.create(page=Page.objects.create(
+            parent = self.news_feed.page,
+            title = "Other news",
+            url_title = "other-news",
+            content_type = ContentType.objects.get_for_model(NewsFeed),
+        ))
+        set_cached_feed(page_id, get_rendered_feed_version(page_id), self.rendered_feed, 60)
+        article.news_feed = other_news_feed
+        article.save()
+        self.assertEqual(get_cached_feed(page_id), None)
+    
+    def testChangingUrlsInvalidatesFeed(self):
+        page_id = self.news_feed.page_id
+        set_cached_feed(page_id, get_rendered_feed_version(page_id), self.rendered_feed, 60)
+        invalidate_urls()
+        self.assertEqual(get_cached_feed(page_id), None)
+
+
+@override_settings(PRERENDER_HTML_WORKERS=0)
+class TestPrerenderedArticleLinks(TestCase):
+    
+    def createArticle(self, news_feed, url_title, content=u""):
+        return Article.objects.create(news_feed=news_feed, title=url_title, url_title=url_title, date=date(2013, 1, 1), content=content)
+    
+    def testMovingNewsFeedDiscardsLinksToArticles(self):
+        content_type = ContentType.objects.get_for_model(NewsFeed)
+        news_feed = NewsFeed.objects.create(page=Page.objects.create(
+            title = "News",
+            content_type = content_type,
+        ))
+        section_news_feed = NewsFeed.objects.create(page=Page.objects.create(
+            parent = news_feed.page,
+            title = "Section",
+            url_title = "section",
+            content_type = content_type,
+        ))
+        section_article = self.createArticle(section_news_feed, "section-article")
+        article = self.createArticle(news_feed, "article")
+        linking_article = self.createArticle(news_feed, "linking-article", u'<a href="{0}">Link</a>'.format(permalinks.create(section_article)))
+        other_linking_article = self.createArticle(news_feed, "other-linking-article", u'<a href="{0}">Link</a>'.format(permalinks.create(article)))
+        other_rendered = u'<a href="{0}" title="article">Link</a>'.format(article.get_absolute_url())
+        self.assertEqual(Article.objects.get(id=other_linking_article.id).content.rendered, other_rendered)
+        # Renaming the section discards only the HTML linking to articles below it.
+        section_page = section_news_feed.page
+        section_page.url_title = "renamed-section"
+        section_page.save()
+        self.assertEqual(Article.objects.get(id=linking_article.id).content.rendered, None)
+        self.assertEqual(Article.objects.get(id=other_linking_article.id).content.rendered, other_rendered)
+        # The discarded HTML is rendered again once the transaction has finished.
+        run_pending_invalidations()
+        self.assertEqual(
+            Article.objects.get(id=linking_article.id).content.rendered,
+            u'<a href="{0}" title="section-article">Link</a>'.format(Article.objects.get(id=section_article.id).get_absolute_url()),
+        )
+        self.assertTrue(u"/renamed-section/" in Article.objects.get(id=linking_article.id).content.rendered)
+
+
+class TestAdjacentArticles(TestCase):
+    
+    def setUp(self):
+        news_feed = NewsFeed.objects.create(page=Page.objects.create(
+            title = "News",
+            content_type = ContentType.objects.get_for_model(NewsFeed),
+        ))
+        self.articles = [
+            Article.objects.create(news_feed=news_feed, title="Article {0}".format(n), url_title="article-{0}".format(n), date=date(2013, 1, 1 + n // 2))
+            for n in range(4)
+        ]
+    
+    def testAdjacentArticlesOnSameDate(self):
+        with self.assertNumQueries(1):
+            next_article, previous_article = Article.objects.get_adjacent(self.articles[1])
+        self.assertEqual(next_article, self.articles[0])
+        self.assertEqual(previous_article, self.articles[2])
+        next_article, previous_article = Article.objects.get_adjacent(self.articles[2])
+        self.assertEqual(next_article, self.articles[1])
+        self.assertEqual(previous_article, self.articles[3])
+    
+    def testAdjacentArticlesAtEnds(self):
+        self.assertEqual(Article.objects.get_adjacent(self.articles[0]), (None, self.articles[1]))
+        self.assertEqual(Article.objects.get_adjacent(self.articles[3]), (self.articles[2], None))
+    
+    def testAdjacentArticlesArePublished(self):
+        self.articles[1].is_online = False
+        self.articles[1].save()
+        with publication_manager.select_published(True):
+            self.assertEqual(Article.objects.get_adjacent(self.articles[2]), (self.articles[0], self.articles[3]))
+
+
+class TestArchiveMonths(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        self.news_feed = NewsFeed.objects.create(page=Page.objects.create(
+            title = "News",
+            content_type = ContentType.objects.get_for_model(NewsFeed),
+        ))
+        for n, article_date in enumerate((date(2012, 12, 1), date(2013, 1, 1), date(2013, 1, 15), date(2013, 3, 1))):
+            Article.objects.create(news_feed=self.news_feed, title="Article {0}".format(n), url_title="article-{0}".format(n), date=article_date)
+    
+    def testArchiveMonths(self):
+        self.assertEqual(Article.objects.get_archive_months(self.news_feed.page_id), [
+            (2013, 3, 1),
+            (2013, 1, 2),
+            (2012, 12, 1),
+        ])
+    
+    def testArchiveMonthsAreCached(self):
+        with publication_manager.select_published(True):
+            self.assertEqual(len(Article.objects.get_archive_months(self.news_feed.page_id)), 3)
+            with self.assertNumQueries(0):
+                Article.objects.get_archive_months(self.news_feed.page_id)
+            Article.objects.create(news_feed=self.news_feed, title="Article", url_title="article", date=date(2013, 2, 1))
+            self.assertEqual(len(Article.objects.get_archive_months(self.news_feed.page_id)), 4)
+
+
+class TestNewsFeedCategories(TestCase):
+    
+    def setUp(self):
+        self.news_feeds = [
+            NewsFeed.objects.create(page=Page.objects.create(
+                title = "News {0}".format(n),
+                url_title = "news-{0}".format(n),
+                content_type = ContentType.objects.get_for_model(NewsFeed),
+            ))
+            for n in range(2)
+        ]
+        self.category = Category.objects.create(title="Category", url_title="category")
+        self.articles = [
+            Article.objects.create(news_feed=self.news_feeds[0], title="Article {0}".format(n), url_title="article-{0}".format(n), date=date(2013, 1, 1 + n))
+            for n in range(2)
+        ]
+    
+    def assertArticleCount(self, news_feed, article_count, latest_article_date=None):
+        category_list = list(get_news_feed_category_list(news_feed.page_id))
+        if not article_count:
+            self.assertEqual(category_list, [])
+            return
+        self.assertEqual(category_list, [self.category])
+        self.assertEqual(category_list[0].article_count, article_count)
+        self.assertEqual(category_list[0].latest_article_date, latest_article_date)
+    
+    def testCountsAreMaintained(self):
+        self.assertArticleCount(self.news_feeds[0], 0)
+        self.articles[0].categories.add(self.category)
+        self.assertArticleCount(self.news_feeds[0], 1, date(2013, 1, 1))
+        self.category.article_set.add(self.articles[1])
+        self.assertArticleCount(self.news_feeds[0], 2, date(2013, 1, 2))
+        # Changing the date of an article updates the latest date.
+        self.articles[0].date = date(2013, 1, 3)
+        self.articles[0].save()
+        self.assertArticleCount(self.news_feeds[0], 2, date(2013, 1, 3))
+        self.articles[0].date = date(2013, 1, 1)
+        self.articles[0].save()
+        # Replacing the categories of an article, as the admin does, updates the counts.
+        self.articles[0].categories = []
+        self.assertArticleCount(self.news_feeds[0], 1, date(2013, 1, 2))
+        self.articles[0].categories = [self.category]
+        self.assertArticleCount(self.news_feeds[0], 2, date(2013, 1, 2))
+        # Moving an article updates both news feeds.
+        self.articles[1].news_feed = self.news_feeds[1]
+        self.articles[1].save()
+        self.assertArticleCount(self.news_feeds[0], 1, date(2013, 1, 1))
+        self.assertArticleCount(self.news_feeds[1], 1, date(2013, 1, 2))
+        self.articles[1].delete()
+        self.assertArticleCount(self.news_feeds[1], 0)
+        self.category.article_set.clear()
+        self.assertArticleCount(self.news_feeds[0], 0)
+    
+    def testPublishedCounts(self):
+        self.articles[0].categories.add(self.category)
+        self.articles[1].categories.add(self.category)
+        upcoming_article = Article.objects.create(news_feed=self.news_feeds[0], title="Upcoming", url_title="upcoming", date=timezone.now().date() + timedelta(days=1))
+        upcoming_article.categories.add(self.category)
+        self.assertArticleCount(self.news_feeds[0], 3, upcoming_article.date)
+        # Only published articles are counted when selecting published articles.
+        with publication_manager.select_published(True):
+            self.assertArticleCount(self.news_feeds[0], 2, date(2013, 1, 2))
+        # Taking articles offline updates the published counts.
+        for article in self.articles:
+            article.is_online = False
+            article.save()
+        with publication_manager.select_published(True):
+            self.assertEqual(list(get_news_feed_category_list(self.news_feeds[0].page_id)), [])
+        # The counts are recalculated once the upcoming article is published.
+        original_now = timezone.now
+        timezone.now = lambda: original_now() + timedelta(days=2)
+        try:
+            with publication_manager.select_published(True):
+                self.assertArticleCount(self.news_feeds[0], 1, upcoming_article.date)
+        finally:
+            timezone.now = original_now
+    
+    def testPermalinksUseCounts(self):
+        self.articles[0].categories.add(self.category)
+        self.assertEqual(self.category._get_permalinks().keys(), [u"page_{0}".format(self.news_feeds[0].page_id)])
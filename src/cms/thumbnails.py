@@ -0,0 +1,228 @@
+"""
+Background thumbnail generation.
+
+Thumbnails are generated by a pool of local worker processes, so that requests
+never block on image processing. Until a thumbnail has been generated, a
+placeholder is returned that uses the URL of the original file, displayed at
+the requested size.
+
+Each process starts its own pool the first time it needs a thumbnail, and only
+knows about the thumbnails queued by that process, so a site served by several
+processes runs THUMBNAIL_WORKERS workers in each of them, and a thumbnail
+requested by several processes at once might be generated more than once. Set
+THUMBNAIL_WORKERS to zero to generate thumbnails synchronously instead, without
+any worker processes.
+
+Worker processes are forked from the process that first needs a thumbnail,
+such as a web server worker, rather than from a preforking master, so they are
+never shared between processes. They start by detaching from the database and
+cache connections that they inherit, so those sockets are only ever used by
+the parent. Servers that disable threads, such as uWSGI without enable-threads,
+cannot run the pool, since its results are collected by a background thread.
+
+Pages showing a pending thumbnail use the original file, so the
+thumbnail_pending signal is sent, letting caches avoid storing them.
+"""
+
+from __future__ import with_statement
+
+import hashlib, multiprocessing, os, threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, connections
+from django.dispatch import Signal
+
+import optimizations
+from optimizations.thumbnailcache import RESIZE
+
+
+__all__ = ("Thumbnail", "thumbnail_pending", "get_thumbnail", "queue_thumbnail",)
+
+
+# Sent whenever a pending thumbnail is returned, with the model class of the file as the sender.
+thumbnail_pending = Signal(providing_args=("file",))
+
+
+def get_thumbnail_workers():
+    """
+    Returns the number of worker processes used to generate thumbnails. If
+    zero, then thumbnails are generated synchronously.
+    """
+    return getattr(settings, "THUMBNAIL_WORKERS", 2)
+
+
+def get_thumbnail_cache_timeout():
+    """Returns the number of seconds to remember generated thumbnails for."""
+    return getattr(settings, "THUMBNAIL_CACHE_TIMEOUT", 60 * 60 * 24 * 30)
+
+
+def get_thumbnail_failure_cache_timeout():
+    """
+    Returns the number of seconds to remember that a thumbnail could not be
+    generated for, before trying again. If zero, then failures are not
+    remembered.
+    """
+    return getattr(settings, "THUMBNAIL_FAILURE_CACHE_TIMEOUT", 60)
+
+
+class Thumbnail(object):
+    
+    """A thumbnail of an image, which might still be waiting to be generated."""
+    
+    def __init__(self, url, width, height, pending=False):
+        """Initializes the Thumbnail."""
+        self.url = url
+        self.width = width
+        self.height = height
+        self.pending = pending
+
+
+def get_thumbnail_cache_key(file, width, height, method):
+    """Returns the cache key of the generated thumbnail of the given file."""
+    return "cms.thumbnails.thumbnail:{hash}".format(
+        hash = hashlib.md5(u"{name}:{width}:{height}:{method}".format(
+            name = file.name,
+            width = width,
+            height = height,
+            method = method,
+        ).encode("utf-8")).hexdigest(),
+    )
+
+
+def generate_thumbnail(app_label, model_name, field_name, name, width, height, method):
+    """
+    Generates a thumbnail of the named file, returning a tuple of (url, width,
+    height), or an empty tuple if the thumbnail could not be generated.
+    
+    This is run in a worker process, so it only takes picklable arguments.
+    """
+    field = models.get_model(app_label, model_name)._meta.get_field(field_name)
+    file = field.attr_class(None, field, name)
+    try:
+        thumbnail = optimizations.get_thumbnail(file, width, height, method)
+        return (thumbnail.url, thumbnail.width, thumbnail.height)
+    except Exception:  # PIL raises all sorts of Exceptions, and they can't be allowed to kill the worker.
+        return ()
+
+
+# The database connections inherited by a worker process, which are kept open
+# and unused, since closing them would also close them for the parent.
+_inherited_connections = []
+
+
+def init_worker():
+    """
+    Detaches a new worker process from the database and cache connections it
+    inherited from its parent.
+    
+    Database connections send a termination message when they are closed or
+    garbage collected, ending the parent's session, so they are set aside
+    rather than closed. Closing the cache connections only closes the worker's
+    copies of their sockets.
+    """
+    for connection in connections.all():
+        if connection.connection is not None:
+            _inherited_connections.append(connection.connection)
+            connection.connection = None
+    if hasattr(cache, "close"):
+        cache.close()
+
+
+class ThumbnailPool(object):
+    
+    """A pool of worker processes that generate thumbnails."""
+    
+    def __init__(self):
+        """Initializes the ThumbnailPool."""
+        self._pool = None
+        self._pool_pid = None
+        self._pending = set()
+        self._lock = threading.Lock()
+    
+    def _get_pool(self):
+        """Returns the process pool, creating it if this process does not have one yet."""
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = multiprocessing.Pool(get_thumbnail_workers(), init_worker)
+            self._pool_pid = os.getpid()
+            self._pending.clear()
+        return self._pool
+    
+    def _finish(self, cache_key, result):
+        """Stores the result of a generated thumbnail."""
+        if result:
+            cache.set(cache_key, result, get_thumbnail_cache_timeout())
+        else:
+            # The file might be fixed, so failures are only remembered briefly.
+            timeout = get_thumbnail_failure_cache_timeout()
+            if timeout > 0:
+                cache.set(cache_key, result, timeout)
+        with self._lock:
+            self._pending.discard(cache_key)
+    
+    def submit(self, cache_key, file, width, height, method):
+        """
+        Queues the generation of the given thumbnail, unless it is already
+        queued. If thumbnails are generated synchronously, then the result is
+        returned.
+        """
+        args = (
+            file.field.model._meta.app_label,
+            file.field.model._meta.object_name,
+            file.field.name,
+            file.name,
+            width,
+            height,
+            method,
+        )
+        if not get_thumbnail_workers():
+            result = generate_thumbnail(*args)
+            self._finish(cache_key, result)
+            return result
+        with self._lock:
+            if cache_key in self._pending:
+                return
+            pool = self._get_pool()
+            self._pending.add(cache_key)
+        pool.apply_async(generate_thumbnail, args, callback=lambda result: self._finish(cache_key, result))
+    
+    def join(self):
+        """Waits for all queued thumbnails to be generated."""
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+# A single, process-wide thumbnail pool.
+thumbnail_pool = ThumbnailPool()
+
+
+def queue_thumbnail(file, width, height, method=RESIZE):
+    """Queues the generation of a thumbnail of the given file, if it has not been generated."""
+    cache_key = get_thumbnail_cache_key(file, width, height, method)
+    if cache.get(cache_key) is None:
+        thumbnail_pool.submit(cache_key, file, width, height, method)
+
+
+def get_thumbnail(file, width, height, method=RESIZE):
+    """
+    Returns a Thumbnail of the given file, which must belong to a FileField.
+    
+    If the thumbnail has not been generated yet, it is queued for generation,
+    and a pending Thumbnail is returned with the URL of the original file and
+    the requested size. Raises an IOError if the thumbnail could not be
+    generated.
+    """
+    cache_key = get_thumbnail_cache_key(file, width, height, method)
+    result = cache.get(cache_key)
+    if result is None:
+        result = thumbnail_pool.submit(cache_key, file, width, height, method)
+        if result is None:
+            thumbnail_pending.send(sender=file.field.model, file=file)
+            return Thumbnail(file.url, width, height, pending=True)
+    if not result:
+        raise IOError("Could not generate a thumbnail of {0!r}.".format(file.name))
+    return Thumbnail(*result)
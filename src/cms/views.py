@@ -1,8 +1,18 @@
 """Views used by the CMS."""
 
+from __future__ import with_statement
+
+from django.contrib.sites.models import get_current_site
+from django.core import urlresolvers
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, Http404
 from django.shortcuts import render
+from django.utils.cache import patch_vary_headers
 from django.views import generic
 
+from cms.models import publication_manager
+from cms.sitemaps import iter_sitemap_xml, iter_sitemap_index_xml, get_prebuilt_sitemap
+
 
 def handler500(request):
     """Renders a pretty error page."""
@@ -11,6 +21,93 @@ def handler500(request):
     return response
     
     
+def get_sitemap(sitemaps, section):
+    """Returns the sitemap instance for the given section, or raises a 404."""
+    try:
+        sitemap = sitemaps[section]
+    except KeyError:
+        raise Http404("No sitemap available for section: %r" % section)
+    if callable(sitemap):
+        sitemap = sitemap()
+    return sitemap
+
+
+def iter_selected_published(chunks, select_published):
+    """
+    Yields the given chunks of a streamed response with the given publication
+    filtering, as the PublicationMiddleware will have ended it by the time the
+    response is sent.
+    """
+    with publication_manager.select_published(select_published):
+        for chunk in chunks:
+            yield chunk
+
+
+def sitemap_index(request, sitemaps, sitemap_url_name="cms.views.sitemap"):
+    """
+    Renders an index of the given sitemaps, with a link to each shard of each
+    section.
+    """
+    protocol = request.is_secure() and "https" or "http"
+    domain = get_current_site(request).domain
+    def iter_locations():
+        for section in sorted(sitemaps.iterkeys()):
+            sitemap = get_sitemap(sitemaps, section)
+            location = u"{protocol}://{domain}{path}".format(
+                protocol = sitemap.protocol or protocol,
+                domain = domain,
+                path = urlresolvers.reverse(sitemap_url_name, kwargs={"section": section}),
+            )
+            yield location
+            for shard in xrange(2, sitemap.get_shard_count() + 1):
+                yield u"{location}?p={shard}".format(
+                    location = location,
+                    shard = shard,
+                )
+    chunks = iter_selected_published(iter_sitemap_index_xml(iter_locations()), publication_manager.select_published_active())
+    return HttpResponse(chunks, content_type="application/xml")
+
+
+def sitemap(request, sitemaps, section):
+    """
+    Renders a shard of the given sitemap section, selected using the p query
+    parameter.
+    
+    If the shard has been pre-built by the build_sitemaps command, and is up to
+    date, then the gzipped file is sent. Otherwise, the sitemap is streamed
+    from the database.
+    """
+    sitemap = get_sitemap(sitemaps, section)
+    try:
+        shard = int(request.GET.get("p", 1))
+    except ValueError:
+        raise Http404("No page %r" % request.GET["p"])
+    if shard < 1:
+        raise Http404("No page %r" % shard)
+    protocol = sitemap.protocol or (request.is_secure() and "https" or "http")
+    domain = get_current_site(request).domain
+    # Send the pre-built file, if possible.
+    if "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", ""):
+        name = get_prebuilt_sitemap(section, shard, domain, protocol)
+        if name is not None:
+            try:
+                handle = default_storage.open(name)
+            except (IOError, OSError):
+                pass
+            else:
+                response = HttpResponse(handle.chunks(), content_type="application/xml")
+                response["Content-Encoding"] = "gzip"
+                patch_vary_headers(response, ("Accept-Encoding",))
+                return response
+    # Stream the sitemap.
+    if shard > 1 and shard > sitemap.get_shard_count():
+        raise Http404("Page %s empty" % shard)
+    chunks = iter_selected_published(iter_sitemap_xml(sitemap.iter_urls(shard, domain, protocol)), publication_manager.select_published_active())
+    response = HttpResponse(chunks, content_type="application/xml")
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
 class TextTemplateView(generic.TemplateView):
 
     """A template view that returns a text/plain response."""